@@ -1,142 +1,500 @@
-# Tạo limiter: 30 req / 60s
+import asyncio
+import hashlib
 import os
-from typing import List
+import re
+import threading
+import time
+import weakref
+from functools import lru_cache
+from typing import TYPE_CHECKING, Generator, Iterator, List, Optional, Union
 
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 import json
-from my_type import CHOOSEN_MODEL, GEMINI_MODEL, GROQ_MODEL, Dream, RateLimiter
-
-from google import genai
-from google.genai import types
+from json_stream import JsonArrayStream
+from my_type import FALLBACK_MODEL, GEMINI_MODEL, GROQ_MODEL, LLM_CALL_TIMEOUT, BatchDream, Dream, ExtractedDream
+from providers import Provider, provider_for, register_provider
+from pydantic import ValidationError
+from rate_scheduler import DailyUsage, RateScheduler
+from retry_policy import LatencyTracker, RetryPolicy, acall_hedged, call_hedged, status_of
+from run_metrics import get_metrics
 
 from output_helper import write_output
 
-from dotenv import load_dotenv, find_dotenv
-load_dotenv(find_dotenv())  # loads .env into process env
+# SDK của provider (google.genai, langchain_*) và dotenv được import khi tạo client lần đầu,
+# để các lệnh chỉ đọc PDF / parse tên file không phải trả giá import chúng
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
-_rate_limiter_30_per_min = RateLimiter(30, 60.0) # gemini-2.0-flash-lite
+@lru_cache(maxsize=None)
+def _load_env():
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())  # loads .env into process env
 
-# Tạo limiter: 15 req / 60s
-_rate_limiter_15_per_min = RateLimiter(15, 60.0) # gemini-2.5-flash-lite
+# 1 token bucket / model theo MODEL_QUOTAS, có thể tràn sang FALLBACK_MODEL; quota ngày lưu ở OUTPUT_PATH/QUOTA_FILE
+_scheduler = RateScheduler(fallback=FALLBACK_MODEL, usage=DailyUsage())
 
-# Tạo limiter: 10 req / 60s
-_rate_limiter_10_per_min = RateLimiter(10, 60.0) # gemini-2.5-flash
+# Backoff + deadline cho lỗi tạm thời, p95 độ trễ / model để hedge (xem retry_policy.py)
+_retry = RetryPolicy()
+_latency = LatencyTracker()
 
-# if CHOOSEN_MODEL == GEMINI_MODEL.GEMINI_2_5_FLASH:
-#     _rate_limiter_10_per_min.acquire()
-# if CHOOSEN_MODEL == GEMINI_MODEL.GEMINI_2_0_FLASH_LITE:
-#     _rate_limiter_30_per_min.acquire()
-# if CHOOSEN_MODEL == GEMINI_MODEL.GEMINI_2_5_FLASH_LITE or CHOOSEN_MODEL == GEMINI_MODEL.GEMINI_2_0_FLASH:
-#     _rate_limiter_15_per_min.acquire()
-  
-def gemini_prompt(prompt: str, OUTPUT_FILENAME: str, model: GEMINI_MODEL):    
-    _rate_limiter_15_per_min.acquire()
-      
-    system_instruction = """
+GEMINI_SYSTEM_INSTRUCTION = """
     công việc của bạn là nhận dữ liệu text được đọc từ 1 file pdf (nội dung của pdf chủ yếu là về những giấc mơ), 
     và bạn có nhiệm vụ phải chắt lọc lấy đúng phần nội dung của giấc mơ trong đoạn text đó, với các yêu cầu sau:
     - tôi muốn trả về 1 mảng JSON (no prose) gồm các giấc mơ có trong đoạn text trên, 
-    1 giấc mơ có 6 key case_id, dream_id, date, dream_text, state_of_mind, notes, 
-    với case_id có format là Cxxxx (x là số, ví dụ C0001, C0002,...) và phải bắt đầu từ case_id trước đó (được cung cấp trong văn bản),
-    tất cả các giấc mơ trong cùng 1 đoạn text đều có chung case_id, state_of_mind (được lấy từ cụm từ "State of mind: " hoặc  "Dream mood:" trong văn bản) và
+    1 giấc mơ có 4 key date, dream_text, state_of_mind, notes, 
+    tất cả các giấc mơ trong cùng 1 đoạn text đều có chung state_of_mind (được lấy từ cụm từ "State of mind: " hoặc  "Dream mood:" trong văn bản) và
     date (lấy theo định dạng dd/mm/yyyy),
     notes là From PDF: title_pdf, 
-    dream_id có format là Dxxxx (x là số, ví dụ D0001, D0002,...),
+    giữ đúng thứ tự các giấc mơ như trong văn bản,
     phần dream_text là quan trọng nhất, bạn phải lấy chính xác từng dream riêng biệt không bị lẫn phần analysis (các câu in đậm) hay các phần như chú thích, lời chào hỏi,
     và nội dung phải y hệt với văn bản gốc (loại bỏ các ký tự escapse, các từ để liệt kê như my first dream is, second dream,... hay các chỉ mục 1., 2., ...,),
     """
 
-    client = genai.Client()
+# Thêm vào system instruction khi gửi nhiều PDF trong 1 request
+GEMINI_BATCH_INSTRUCTION = """
+    - văn bản có thể gồm nhiều tài liệu, mỗi tài liệu bắt đầu bằng dòng "### DOCUMENT n" (n = 0, 1, 2, ...),
+    mỗi tài liệu là 1 file pdf riêng với title_pdf, date và state_of_mind riêng,
+    mỗi giấc mơ phải có thêm key doc_index = n của tài liệu chứa nó, không được trộn giấc mơ giữa các tài liệu,
+    """
+
+# Tell the parser exactly what JSON we want
+GROQ_DREAM_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "required": ["date", "dream_text", "state_of_mind", "notes"],
+        "properties": {
+            "date": {"type": "string", "description": "format dd/mm/yyyy when possible"},
+            "dream_text": {"type": "string"},
+            "state_of_mind": {"type": "string"},
+            "notes": {"type": "string"}
+        },
+        "additionalProperties": False
+    }
+}
+
+# --- Client dùng chung (1 client / provider, tái sử dụng kết nối) ---
+# GEMINI_BASE_URL / GROQ_BASE_URL cho phép trỏ sang 1 server giả lập khi test.
+
+# Khoá khi khởi tạo: nếu 2 thread cùng tạo client, bản thừa bị GC sẽ đóng kết nối
+_client_lock = threading.Lock()
+
+def _make_gemini_client() -> "genai.Client":
+    from google import genai
+    from google.genai import types
+
+    _load_env()
+    # timeout tính bằng ms; hết giờ => lỗi timeout, retry_policy thử lại
+    http_options = types.HttpOptions(base_url=os.getenv("GEMINI_BASE_URL"), timeout=int(LLM_CALL_TIMEOUT * 1000))
+    return genai.Client(http_options=http_options)
+
+_new_gemini_client = lru_cache(maxsize=None)(_make_gemini_client)
+
+def get_gemini_client() -> "genai.Client":
+    with _client_lock:
+        return _new_gemini_client()
+
+# Client async theo event loop: transport của client.aio (và async client của ChatGroq) gắn với loop
+# dùng nó lần đầu, nên mỗi asyncio.run (run_async, từng participant của run_study) cần client riêng
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+def _loop_client(key, factory):
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        clients = _loop_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = factory()
+        return clients[key]
+
+def get_gemini_aio_client() -> "genai.client.AsyncClient":
+    return _loop_client("gemini", _make_gemini_client).aio
+
+def get_groq_aio_chain(model: GROQ_MODEL):
+    """Như get_groq_chain nhưng riêng cho event loop đang chạy (agroq_prompt)."""
+    return _loop_client(("groq", model), lambda: _make_groq_chain(model))
 
-    config = types.GenerateContentConfig(
-        system_instruction=system_instruction,
+async def aclose_llm_clients():
+    """Đóng client async của event loop đang chạy; gọi cuối run_async, trước khi asyncio.run đóng loop."""
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        clients = _loop_clients.pop(loop, {})
+    for key, client in clients.items():
+        if key == "gemini":
+            await client.aio.aclose()
+        else:
+            # (chain, format_instructions): ChatGroq giữ AsyncGroq trong async_client._client
+            groq_client = getattr(getattr(client[0].middle[0], "async_client", None), "_client", None)
+            if groq_client is not None:
+                await groq_client.close()
+
+@lru_cache(maxsize=None)
+def get_gemini_config() -> "types.GenerateContentConfig":
+    from google.genai import types
+    return types.GenerateContentConfig(
+        system_instruction=GEMINI_SYSTEM_INSTRUCTION,
         thinking_config=types.ThinkingConfig(thinking_budget=0),
         response_mime_type="application/json",
-        response_schema=list[Dream],
+        response_schema=list[ExtractedDream],
     )
-    
-    response = client.models.generate_content(
-        model=model.value, contents=prompt, config=config
+
+@lru_cache(maxsize=None)
+def get_gemini_batch_config() -> "types.GenerateContentConfig":
+    from google.genai import types
+    return types.GenerateContentConfig(
+        system_instruction=GEMINI_SYSTEM_INSTRUCTION + GEMINI_BATCH_INSTRUCTION,
+        thinking_config=types.ThinkingConfig(thinking_budget=0),
+        response_mime_type="application/json",
+        response_schema=list[BatchDream],
     )
 
-    data: List[Dream] = response.parsed
-    
-    write_output(f"\n{response.text}\n", OUTPUT_FILENAME)
-    
-    return data
+def get_groq_chain(model: GROQ_MODEL):
+    """Trả về (chain, format_instructions) dựng sẵn cho model."""
+    with _client_lock:
+        return _new_groq_chain(model)
 
-def groq_prompt(user_prompt: str, OUTPUT_FILENAME: str, model: GROQ_MODEL, pdf_title: str = "Unknown PDF"): 
-    # rateLimiter = RateLimiter(40, 60.0) # gemini-2.0-flash-lite
-    # rateLimiter.acquire()
+def get_groq_stream_chain(model: GROQ_MODEL):
+    """Như get_groq_chain nhưng không có JsonOutputParser (stream text thô cho JsonArrayStream)."""
+    with _client_lock:
+        return _new_groq_stream_chain(model)
 
-    
+@lru_cache(maxsize=None)
+def _new_groq_stream_chain(model: GROQ_MODEL):
+    chain, format_instructions = _new_groq_chain(model)
+    return chain.first | chain.middle[0], format_instructions
+
+def _make_groq_chain(model: GROQ_MODEL):
+    from langchain_groq import ChatGroq
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import JsonOutputParser
+
+    _load_env()
     # Initialize Groq LLM
+    extra = {"base_url": os.environ["GROQ_BASE_URL"]} if os.getenv("GROQ_BASE_URL") else {}
     llm = ChatGroq(
         model_name=model.value,
-        temperature=0
+        temperature=0,
+        timeout=LLM_CALL_TIMEOUT,
+        **extra,
     )
 
-    
-    # Tell the parser exactly what JSON we want
-    schema = {
-        "type": "array",
-        "items": {
-            "type": "object",
-            "required": ["case_id", "dream_id", "date", "dream_text", "state_of_mind", "notes"],
-            "properties": {
-                "case_id": {"type": "string"},
-                "dream_id": {"type": "string"},
-                "date": {"type": "string", "description": "format dd/mm/yyyy when possible"},
-                "dream_text": {"type": "string"},
-                "state_of_mind": {"type": "string"},
-                "notes": {"type": "string"}
-            },
-            "additionalProperties": False
-        }
-    }
-    parser = JsonOutputParser(schema=schema)
+    parser = JsonOutputParser(schema=GROQ_DREAM_SCHEMA)
     format_instructions = parser.get_format_instructions()
 
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "{sys_msg}\n\n{format_instructions}"),
+        ("user",
+         "Context:\n"
+         "pdf_title: {pdf_title}\n"
+         "Text:\n{input}")
+    ])
+
+    # Chain: prompt -> LLM -> JSON parser
+    return prompt | llm | parser, format_instructions
+
+_new_groq_chain = lru_cache(maxsize=None)(_make_groq_chain)
+
+def _groq_sys_msg(pdf_title: str) -> str:
     # Build a clean, variable-safe system message.
     # IMPORTANT: no quoted placeholder names like {'case_id'}; use {case_id} only when you intend variables.
     base_instruction = (
         "Extract each distinct dream report from the user's text. "
         "Output ONLY JSON and always in JSON Array (no prose). Each item must include these fields: "
-        "case_id, dream_id, date, dream_text, state_of_mind, notes. "
-        f"and when generating dream_id, continue from last_dream_id (in text) and use 4 digits (e.g., D0001, D0002...). "
-        "case_id is C01 for all dreams. "
+        "date, dream_text, state_of_mind, notes, in the order the dreams appear in the text. "
         "All dreams share the same state_of_mind, state_of_mind is after this word: 'State of mind: '."
         "All dreams share the same date, format date to dd/mm/yyyy format."
         f'set notes to "From PDF: {pdf_title}" .'
         "If a field is unknown, use an empty string."
     )
-    sys_msg = f"{base_instruction.strip()}"
-    # sys_msg = f"{instruction.strip()}\n\n{base_instruction}" if instruction else base_instruction
+    return f"{base_instruction.strip()}"
 
+# Đổi prompt/schema => đổi version => cache cũ (cache_helper) tự hết hiệu lực
+INSTRUCTION_VERSION = hashlib.sha256(
+    (GEMINI_SYSTEM_INSTRUCTION + _groq_sys_msg("{pdf_title}") + json.dumps(GROQ_DREAM_SCHEMA, sort_keys=True)).encode("utf-8")
+).hexdigest()[:16]
+# Kết quả của đường batch (llm_batch_prompt) có version riêng: đổi GEMINI_BATCH_INSTRUCTION / BatchDream chỉ làm
+# hết hiệu lực kết quả batch, và kết quả batch / từng file không ghi đè lẫn nhau trong cache
+BATCH_INSTRUCTION_VERSION = hashlib.sha256(
+    ("batch:" + INSTRUCTION_VERSION + GEMINI_BATCH_INSTRUCTION
+     + json.dumps(BatchDream.model_json_schema(), sort_keys=True)).encode("utf-8")
+).hexdigest()[:16]
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "{sys_msg}\n\n{format_instructions}"),
-        ("user",
-         "Context:\n"
-         "pdf_title: {pdf_title}\n"
-         "Text:\n{input}")
-    ])
-
-    # Chain: prompt -> LLM -> JSON parser
-    chain = prompt | llm | parser
-
-    # Invoke with all required variables
-    result = chain.invoke({
-        "sys_msg": sys_msg,
+def _groq_inputs(user_prompt: str, pdf_title: str, format_instructions: str) -> dict:
+    return {
+        "sys_msg": _groq_sys_msg(pdf_title),
         "format_instructions": format_instructions,
         "pdf_title": pdf_title,
         "input": user_prompt,
-    })
+    }
+
+def estimate_tokens(text: str) -> int:
+    # ~4 ký tự / token cho tiếng Anh, đủ để chia quota TPM
+    return len(text) // 4
+
+def _request_tokens(prompt: str) -> int:
+    # input + output (output chép lại gần như toàn bộ dream text)
+    return estimate_tokens(GEMINI_SYSTEM_INSTRUCTION) + 2 * estimate_tokens(prompt)
+
+def is_rate_limited(e: Exception) -> bool:
+    return status_of(e) == 429
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    # Gemini trả RetryInfo trong body: "retryDelay": "17s"
+    m = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(e, "details", "")))
+    return float(m.group(1)) if m else None
+
+def _on_error(e: Exception, used, attempt: int, deadline: float) -> Optional[float]:
+    """
+    Quyết định thử lại: None => raise. 429 chặn bucket của model trong scheduler (mọi thread cùng
+    lùi lại, lần acquire sau tự chờ) nên trả về 0; lỗi khác trả về thời gian backoff cần ngủ.
+    """
+    retry_after = retry_after_seconds(e) if is_rate_limited(e) else None
+    delay = _retry.next_delay(e, attempt, deadline, retry_after)
+    if delay is None:
+        return None
+    get_metrics().count("retries")
+    if is_rate_limited(e):
+        _scheduler.report_rate_limited(used, delay)
+        print(f"Rate limited on {used.value}, backing off {delay:.1f}s ...")
+        return 0.0
+    print(f"{type(e).__name__} on {used.value}, retrying in {delay:.1f}s ...")
+    return delay
+
+def _record_usage(usage):
+    # Gemini: usage_metadata.prompt_token_count / candidates_token_count; langchain (Groq): dict input_tokens / output_tokens
+    if not usage:
+        return
+    if isinstance(usage, dict):
+        get_metrics().add_tokens(usage.get("input_tokens"), usage.get("output_tokens"))
+    else:
+        get_metrics().add_tokens(usage.prompt_token_count, usage.candidates_token_count)
+
+def _with_scheduler(model, prompt: str, call, spill: bool = True):
+    """Chạy call(model_được_cấp) dưới scheduler: chờ quota, thử lại lỗi tạm thời, hedge request chậm."""
+    metrics = get_metrics()
+    tokens = _request_tokens(prompt)
+    deadline = _retry.deadline()
+    for attempt in range(_retry.max_attempts):
+        with metrics.span("rate_wait"):
+            used = _scheduler.acquire(model, tokens, spill)
+        try:
+            with metrics.span("llm"):
+                data = call_hedged(lambda: call(used), _latency.hedge_after(used),
+                                   lambda: _scheduler.try_acquire(used, tokens), _latency, used)
+        except Exception as e:
+            delay = _on_error(e, used, attempt, deadline)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        _scheduler.report_success(used)
+        return data
+
+async def _awith_scheduler(model, prompt: str, call, spill: bool = True):
+    metrics = get_metrics()
+    tokens = _request_tokens(prompt)
+    deadline = _retry.deadline()
+    for attempt in range(_retry.max_attempts):
+        with metrics.span("rate_wait"):
+            used = await _scheduler.aacquire(model, tokens, spill)
+        try:
+            with metrics.span("llm"):
+                data = await acall_hedged(lambda: call(used), _latency.hedge_after(used),
+                                          lambda: _scheduler.try_acquire(used, tokens), _latency, used)
+        except Exception as e:
+            delay = _on_error(e, used, attempt, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        _scheduler.report_success(used)
+        return data
+
+def llm_prompt(prompt: str, OUTPUT_FILENAME: str, model: Union[GEMINI_MODEL, GROQ_MODEL], pdf_title: str = "Unknown PDF") -> List[Dream]:
+    """Gọi model qua scheduler (quota riêng của model, backoff khi 429, tràn sang FALLBACK_MODEL)."""
+    def call(used):
+        return provider_for(used).prompt(prompt, OUTPUT_FILENAME, used, pdf_title)
+
+    return _with_scheduler(model, prompt, call)
+
+async def allm_prompt(prompt: str, OUTPUT_FILENAME: str, model: Union[GEMINI_MODEL, GROQ_MODEL], pdf_title: str = "Unknown PDF") -> List[Dream]:
+    async def call(used):
+        return await provider_for(used).aprompt(prompt, OUTPUT_FILENAME, used, pdf_title)
+
+    return await _awith_scheduler(model, prompt, call)
+
+def llm_batch_prompt(prompt: str, OUTPUT_FILENAME: str, model: GEMINI_MODEL) -> List[BatchDream]:
+    """1 request cho nhiều tài liệu (xem pdf_helper.llm_filter_dream_batch). Chỉ provider có batch (Gemini)."""
+    batch = provider_for(model).batch
+    if batch is None:
+        raise ValueError(f"batch mode is not supported by {model.value}")
+
+    # không tràn sang fallback: model fallback có thể không hỗ trợ batch
+    return _with_scheduler(model, prompt, lambda used: batch(prompt, OUTPUT_FILENAME, used), spill=False)
+
+def llm_prompt_stream(prompt: str, OUTPUT_FILENAME: str, model: Union[GEMINI_MODEL, GROQ_MODEL], pdf_title: str = "Unknown PDF") -> Generator[Dream, None, bool]:
+    """
+    Bản stream của llm_prompt: yield từng Dream ngay khi object JSON của nó đóng ngoặc.
+    Giá trị return (yield from) = True nếu response đầy đủ, False nếu bị cắt / lỗi giữa chừng
+    (các Dream đã yield vẫn giữ). Lỗi tạm thời chỉ được thử lại khi chưa yield Dream nào; không hedge.
+    """
+    metrics = get_metrics()
+    tokens = _request_tokens(prompt)
+    deadline = _retry.deadline()
+    for attempt in range(_retry.max_attempts):
+        with metrics.span("rate_wait"):
+            used = _scheduler.acquire(model, tokens)
+        start = time.perf_counter()
+        stream = provider_for(used).stream(prompt, OUTPUT_FILENAME, used, pdf_title)
+
+        yielded = 0
+        try:
+            while True:
+                try:
+                    dream = next(stream)
+                except StopIteration as stop:
+                    complete = stop.value
+                    break
+                if not yielded:
+                    metrics.record("llm_first", time.perf_counter() - start)
+                yielded += 1
+                yield dream
+        except Exception as e:
+            metrics.record("llm", time.perf_counter() - start)
+            if yielded:
+                write_output(f"\n[stream error after {yielded} dreams: {e}]\n", OUTPUT_FILENAME)
+                return False
+            delay = _on_error(e, used, attempt, deadline)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        metrics.record("llm", time.perf_counter() - start)
+        _latency.add(used, time.perf_counter() - start)
+        _scheduler.report_success(used)
+        return complete
+
+def _as_dreams(items) -> List[Dream]:
+    # response_schema không có case_id / dream_id (id_allocator cấp sau) => Dream với ID rỗng
+    return [Dream(**d.model_dump()) for d in items or []]
+
+# gemini_prompt / groq_prompt gọi thẳng API (không qua rate limit) => dùng llm_prompt
+def gemini_prompt(prompt: str, OUTPUT_FILENAME: str, model: GEMINI_MODEL, pdf_title: str = "Unknown PDF"):
+    response = get_gemini_client().models.generate_content(
+        model=model.value, contents=prompt, config=get_gemini_config()
+    )
+
+    data = _as_dreams(response.parsed)
+    _record_usage(response.usage_metadata)
+    
+    write_output(f"\n{response.text}\n", OUTPUT_FILENAME)
+    
+    return data
+
+def gemini_batch_prompt(prompt: str, OUTPUT_FILENAME: str, model: GEMINI_MODEL) -> List[BatchDream]:
+    response = get_gemini_client().models.generate_content(
+        model=model.value, contents=prompt, config=get_gemini_batch_config()
+    )
+    _record_usage(response.usage_metadata)
+    write_output(f"\n{response.text}\n", OUTPUT_FILENAME)
+    return response.parsed or []
+
+def groq_prompt(user_prompt: str, OUTPUT_FILENAME: str, model: GROQ_MODEL, pdf_title: str = "Unknown PDF"): 
+    chain, format_instructions = get_groq_chain(model)
+    llm_chain, _ = get_groq_stream_chain(model)
+
+    # Invoke with all required variables (prompt -> LLM, rồi parse riêng để lấy usage_metadata)
+    message = llm_chain.invoke(_groq_inputs(user_prompt, pdf_title, format_instructions))
+    _record_usage(message.usage_metadata)
+    result = chain.last.invoke(message)
     
     write_output(f"\n{result}\n", OUTPUT_FILENAME)
 
     result = [Dream(**d) for d in result]
 
-    return result
\ No newline at end of file
+    return result
+
+def _dreams_from_stream(texts: Iterator[str], OUTPUT_FILENAME: str) -> Generator[Dream, None, bool]:
+    parser = JsonArrayStream()
+    raw = []
+    try:
+        for text in texts:
+            raw.append(text)
+            for obj in parser.feed(text):
+                try:
+                    yield Dream(**obj)
+                except ValidationError:
+                    parser.errors += 1
+    finally:
+        # ghi cả response 1 lần (như gemini_prompt) để log các file không xen kẽ nhau
+        write_output(f"\n{''.join(raw)}\n", OUTPUT_FILENAME)
+    if parser.truncated or parser.errors:
+        write_output(f"\n[stream truncated={parser.truncated} invalid_objects={parser.errors}]\n", OUTPUT_FILENAME)
+    return not parser.truncated and not parser.errors
+
+def gemini_prompt_stream(prompt: str, OUTPUT_FILENAME: str, model: GEMINI_MODEL, pdf_title: str = "Unknown PDF") -> Generator[Dream, None, bool]:
+    stream = get_gemini_client().models.generate_content_stream(
+        model=model.value, contents=prompt, config=get_gemini_config()
+    )
+    usage = []
+
+    def _texts():
+        for chunk in stream:
+            if chunk.usage_metadata:
+                usage[:] = [chunk.usage_metadata]  # chunk cuối mang tổng usage
+            yield chunk.text or ""
+
+    complete = yield from _dreams_from_stream(_texts(), OUTPUT_FILENAME)
+    _record_usage(usage[0] if usage else None)
+    return complete
+
+def groq_prompt_stream(user_prompt: str, OUTPUT_FILENAME: str, model: GROQ_MODEL, pdf_title: str = "Unknown PDF") -> Generator[Dream, None, bool]:
+    chain, format_instructions = get_groq_stream_chain(model)
+    stream = chain.stream(_groq_inputs(user_prompt, pdf_title, format_instructions))
+    usage = []
+
+    def _texts():
+        for chunk in stream:
+            if chunk.usage_metadata:
+                usage[:] = [chunk.usage_metadata]
+            yield chunk.content
+
+    complete = yield from _dreams_from_stream(_texts(), OUTPUT_FILENAME)
+    _record_usage(usage[0] if usage else None)
+    return complete
+
+# --- Async API: giữ nhiều request cùng lúc dưới rate limiter ---
+
+async def agemini_prompt(prompt: str, OUTPUT_FILENAME: str, model: GEMINI_MODEL, pdf_title: str = "Unknown PDF") -> List[Dream]:
+    response = await get_gemini_aio_client().models.generate_content(
+        model=model.value, contents=prompt, config=get_gemini_config()
+    )
+
+    data = _as_dreams(response.parsed)
+    _record_usage(response.usage_metadata)
+
+    write_output(f"\n{response.text}\n", OUTPUT_FILENAME)
+
+    return data
+
+async def agroq_prompt(user_prompt: str, OUTPUT_FILENAME: str, model: GROQ_MODEL, pdf_title: str = "Unknown PDF") -> List[Dream]:
+    chain, format_instructions = get_groq_aio_chain(model)
+    llm_chain = chain.first | chain.middle[0]
+
+    message = await llm_chain.ainvoke(_groq_inputs(user_prompt, pdf_title, format_instructions))
+    _record_usage(message.usage_metadata)
+    result = chain.last.invoke(message)
+
+    write_output(f"\n{result}\n", OUTPUT_FILENAME)
+
+    return [Dream(**d) for d in result]
+
+# pdf_title chỉ dùng trong prompt của Groq, Gemini lấy title từ chính văn bản
+register_provider(GEMINI_MODEL, Provider(gemini_prompt, agemini_prompt, gemini_prompt_stream, gemini_batch_prompt))
+register_provider(GROQ_MODEL, Provider(groq_prompt, agroq_prompt, groq_prompt_stream))
@@ -0,0 +1,161 @@
+"""
+So sánh text_normalizer với chuỗi làm sạch cũ (bản copy nguyên văn bên dưới):
+1) golden check: output phải giống hệt trên toàn bộ corpus trong outputs/
+2) micro-benchmark: thời gian chạy cũ / mới
+
+Chạy: python bench_normalizer.py [số vòng]
+"""
+import csv
+import re
+import sys
+import time
+from typing import Callable, List
+
+import text_normalizer as tn
+from my_type import OUTPUT_PATH
+
+# ---- Bản cũ (pdf_helper trước khi có text_normalizer) ----
+
+def legacy_extract_clean_block(text: str, remove_noise=True):
+    if not text:
+        return None
+    RX_START = re.compile(r'(?im)^\s*(?:Date of dream|Dream date)\s*:?.*$')
+    RX_STOP  = re.compile(r'(?im)^\s*(?:Revision|student note|Student mark)\b.*$')
+    m_start = RX_START.search(text)
+    if not m_start:
+        return None
+    start_idx = m_start.start()
+    m_stop = RX_STOP.search(text, start_idx)
+    end_idx = m_stop.start() if m_stop else len(text)
+    block = text[start_idx:end_idx]
+    if remove_noise:
+        block = legacy_remove_noise_chunk(block)
+    return block
+
+def legacy_remove_noise_chunk(block: str) -> str:
+    RX_PAGE  = re.compile(r'(?m)^\s*\d+\s*/\s*\d+\s*$')
+    RX_PAREN_HTTP_LINE = re.compile(r'(?im)^\s*\(https?://', re.IGNORECASE)
+    m_open = RX_PAREN_HTTP_LINE.search(block)
+    if not m_open:
+        return block
+    m_page = RX_PAGE.search(block, m_open.end())
+    if not m_page:
+        return block
+    return block[:m_open.start()] + block[m_page.end():]
+
+def legacy_remove_dash_bracket_blocks(text: str) -> str:
+    BLOCK_RX = re.compile(r"\[\s*-\s*.*?\]", flags=re.DOTALL)
+    out = BLOCK_RX.sub("", text)
+    out = re.sub(r"\s{2,}", " ", out)
+    out = re.sub(r"\s+([,.!?;:…])", r"\1", out)
+    return out.strip()
+
+def legacy_strip_allcaps_runs(text: str, min_words: int = 0) -> str:
+    ALLCAPS_RUN = re.compile(
+    r"""
+    (
+      \b[A-Z][A-Z'’\-]+
+      (?:[ ,:;–-]+\b[A-Z][A-Z'’\-]+){2,}
+    )
+    """,
+    re.VERBOSE,
+    )
+    def _repl(m):
+        run = m.group(0)
+        n_words = len(re.findall(r"\b[A-Z][A-Z'’\-]+\b", run))
+        return "" if n_words >= min_words else run
+    out = ALLCAPS_RUN.sub(_repl, text)
+    out = re.sub(r"\s{2,}", " ", out)
+    out = re.sub(r"\s+([,.!?;:])", r"\1", out)
+    return out.strip()
+
+def legacy_clean_dream_text(s: str) -> str:
+    if not s:
+        return ""
+    s = s.replace("\r\n", "\n").replace("\r", "\n")
+    s = s.replace("\u00A0", " ")
+    s = re.sub(r"[ \t]+", " ", s)
+    s = "\n".join(line.strip() for line in s.split("\n"))
+    s = s.replace("\n", " ")
+    s = re.sub(r" +", " ", s)
+    s = s.strip()
+    m = re.fullmatch(r'\s*"""\s*([\s\S]*?)\s*"""\s*', s)
+    if m:
+        s = m.group(1).strip()
+    m = re.fullmatch(r'\s*"\s*([\s\S]*?)\s*"\s*', s)
+    if m:
+        s = m.group(1).strip()
+    return s
+
+# ---- Corpus ----
+
+def load_corpus() -> List[str]:
+    docs = []
+    for path in sorted(OUTPUT_PATH.glob("*.txt")):
+        text = path.read_text(encoding="utf-8", errors="replace")
+        docs.extend(chunk for chunk in text.split("\n\n") if chunk.strip())
+    for path in sorted(OUTPUT_PATH.glob("*.csv")):
+        with path.open(encoding="utf-8", newline="") as f:
+            docs.extend(row.get("dream_text") or "" for row in csv.DictReader(f))
+    # biến thể bẩn: xuống dòng / tab / nbsp / ngoặc kép / khối [- ...] như text PDF thô
+    dirty = []
+    for i, doc in enumerate(docs[:2000]):
+        d = doc.replace(". ", ".\r\n  " if i % 2 else ". \u00a0\t\n\n ")
+        d = d.replace(", ", " ,\t" if i % 3 else ",\u2003\n")
+        d = d.replace(" the ", " the\u00a0\u2003  ", 1)
+        if i % 5 == 0:
+            d = f'  """ {d} [- note\n here ] """ '
+        elif i % 7 == 0:
+            d = f'"{d} [-x]…  !"'
+        dirty.append(d)
+    return docs + dirty
+
+def golden(corpus: List[str]) -> int:
+    pairs = [
+        ("clean_dream_text", legacy_clean_dream_text, tn.clean_dream_text),
+        ("remove_dash_bracket_blocks", legacy_remove_dash_bracket_blocks, tn.remove_dash_bracket_blocks),
+        ("strip_allcaps_runs", legacy_strip_allcaps_runs, tn.strip_allcaps_runs),
+        ("extract_clean_block", legacy_extract_clean_block, tn.extract_clean_block),
+        ("prompt chain", lambda s: legacy_remove_dash_bracket_blocks(legacy_clean_dream_text(s)), tn.normalize_prompt),
+    ]
+    failures = 0
+    for name, old, new in pairs:
+        for doc in corpus:
+            if old(doc) != new(doc):
+                failures += 1
+                print(f"MISMATCH {name}: {doc[:80]!r}")
+                break
+    return failures
+
+def bench(fn: Callable[[str], object], corpus: List[str], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for doc in corpus:
+            fn(doc)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    corpus = load_corpus()
+    print(f"Corpus: {len(corpus)} texts, {sum(map(len, corpus)) / 1e6:.1f}M chars")
+
+    if golden(corpus):
+        sys.exit(1)
+    print("Golden check: identical output")
+
+    def legacy_chain(s):
+        block = legacy_extract_clean_block(s) or s
+        return legacy_remove_dash_bracket_blocks(legacy_clean_dream_text(block))
+
+    def new_chain(s):
+        block = tn.extract_clean_block(s) or s
+        return tn.normalize_prompt(block)
+
+    for name, old, new in [
+        ("clean_dream_text", legacy_clean_dream_text, tn.clean_dream_text),
+        ("remove_dash_bracket_blocks", legacy_remove_dash_bracket_blocks, tn.remove_dash_bracket_blocks),
+        ("full prompt chain", legacy_chain, new_chain),
+    ]:
+        t_old = bench(old, corpus, rounds)
+        t_new = bench(new, corpus, rounds)
+        print(f"{name:28s} old {t_old:.3f}s  new {t_new:.3f}s  x{t_old / t_new:.2f}")
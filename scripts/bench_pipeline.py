@@ -0,0 +1,145 @@
+"""
+Benchmark offline toàn bộ pipeline: PDF giả (synth_pdfs) + server Gemini giả (fake_llm_server).
+Không cần API key thật, chạy được trong CI.
+
+1) readPdf tuần tự trên vài file (độ trễ 1 file end-to-end)
+2) main.py đầy đủ (subprocess, mode theo cấu hình trong main.py) => throughput + p50/p95
+   từng bước (báo cáo run_metrics <csv>.metrics.json)
+
+    python bench_pipeline.py --files 40 --latency 0.3 --rpm 120 --error-rate 0.02
+    python bench_pipeline.py --report bench.json                     # lưu kết quả làm baseline
+    python bench_pipeline.py --baseline bench.json --tolerance 0.25  # exit 1 nếu throughput giảm > 25%
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from fake_llm_server import FakeLLMServer
+from synth_pdfs import generate_corpus
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+def _percentiles(values):
+    from run_metrics import percentile
+    return {"n": len(values), "p50_s": round(percentile(values, 50), 4), "p95_s": round(percentile(values, 95), 4)}
+
+def bench_readpdf(folder: Path, out_dir: Path, n: int) -> dict:
+    # my_type đọc DREAMS_* lúc import => đặt env trước khi import pdf_helper
+    os.environ["DREAMS_INPUT_PATH"] = str(folder)
+    os.environ["DREAMS_OUTPUT_PATH"] = str(out_dir)
+    from output_helper import initOutput
+    from pdf_helper import readPdf
+
+    initOutput("bench_readpdf.txt")
+    latencies = []
+    for file in sorted(folder.glob("*.pdf"))[:n]:
+        start = time.perf_counter()
+        readPdf("", file.name, "bench_readpdf.txt")
+        latencies.append(time.perf_counter() - start)
+    return _percentiles(latencies)
+
+def bench_main(folders: List[Path], out_dir: Path, env: dict) -> dict:
+    # nhiều người => main.py --all trên cả thư mục data giả (manifest + chạy song song theo người)
+    data_root = folders[0].parent.parent
+    env = dict(env, DREAMS_INPUT_PATH=str(folders[0]), DREAMS_DATA_PATH=str(data_root), DREAMS_OUTPUT_PATH=str(out_dir))
+    cmd = [sys.executable, "main.py"] + (["--all"] if len(folders) > 1 else [])
+    start = time.perf_counter()
+    with (out_dir / "main.log").open("w", encoding="utf-8") as log:
+        proc = subprocess.run(cmd, cwd=SCRIPTS_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"main.py exited with {proc.returncode}, see {out_dir / 'main.log'}")
+
+    files = sum(len(list(folder.glob("*.pdf"))) for folder in folders)
+    rows = 0
+    for csv_path in out_dir.glob("*.csv"):
+        if csv_path.name.endswith(".metrics.csv"):
+            continue
+        with csv_path.open(encoding="utf-8", newline="") as f:
+            rows += sum(1 for _ in csv.DictReader(f))
+
+    metrics = {}
+    reports = list(out_dir.glob("*.metrics.json"))
+    if reports:
+        metrics = json.loads(reports[0].read_text(encoding="utf-8"))
+
+    return {
+        "files": files,
+        "rows": rows,
+        "wall_s": round(wall, 3),
+        "files_per_s": round(files / wall, 3) if wall else 0.0,
+        "stages": metrics.get("stages", {}),
+        "totals": metrics.get("totals", {}),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline pipeline benchmark (synthetic PDFs + fake Gemini server)")
+    ap.add_argument("--files", type=int, default=30, help="số PDF giả / người")
+    ap.add_argument("--participants", type=int, default=1, help="> 1: chạy main.py --all")
+    ap.add_argument("--hard", type=float, default=0.5, help="tỉ lệ PDF phải gọi LLM (có phần phân tích)")
+    ap.add_argument("--latency", type=float, default=0.3)
+    ap.add_argument("--jitter", type=float, default=0.1)
+    ap.add_argument("--rpm", type=int, default=None, help="server trả 429 khi vượt số request / phút này")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="tỉ lệ 429 ngẫu nhiên")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--quota-scale", type=float, default=100.0, help="DREAMS_QUOTA_SCALE cho scheduler phía client")
+    ap.add_argument("--readpdf", type=int, default=5, help="số file chạy readPdf tuần tự (0 = bỏ qua)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--report", type=Path, default=None, help="ghi kết quả JSON ra file này")
+    ap.add_argument("--baseline", type=Path, default=None, help="so throughput với báo cáo trước")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--keep", action="store_true", help="giữ thư mục tạm (PDF, CSV, log)")
+    args = ap.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="dreams_bench_"))
+    server = FakeLLMServer(latency=args.latency, jitter=args.jitter, rpm=args.rpm, error_rate=args.error_rate,
+                           retry_after=args.retry_after, seed=args.seed).start()
+    env = dict(os.environ, GEMINI_BASE_URL=server.base_url, GEMINI_API_KEY="fake-key",
+               DREAMS_QUOTA_SCALE=str(args.quota_scale))
+    os.environ.update(env)
+
+    try:
+        folders = generate_corpus(work / "data", args.participants, args.files, args.hard, args.seed)
+        report = {"config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()}}
+
+        if args.readpdf:
+            (work / "readpdf").mkdir()
+            report["readpdf"] = bench_readpdf(folders[0], work / "readpdf", args.readpdf)
+
+        (work / "main").mkdir()
+        report["main"] = bench_main(folders, work / "main", env)
+        report["server"] = dict(server.stats)
+    finally:
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    m = report["main"]
+    print(f"main.py: {m['files']} files, {m['rows']} rows in {m['wall_s']:.2f}s => {m['files_per_s']:.2f} files/s")
+    if "readpdf" in report:
+        r = report["readpdf"]
+        print(f"readPdf: n={r['n']} p50={r['p50_s'] * 1000:.0f}ms p95={r['p95_s'] * 1000:.0f}ms")
+    for name, s in m["stages"].items():
+        print(f"  {name:12s} n={s['count']:<5d} p50={s['p50_s'] * 1000:8.1f}ms  p95={s['p95_s'] * 1000:8.1f}ms")
+    print(f"server: {report['server']}" + (f", kept in {work}" if args.keep else ""))
+
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        base = json.loads(args.baseline.read_text(encoding="utf-8"))["main"]["files_per_s"]
+        if m["files_per_s"] < base * (1 - args.tolerance):
+            print(f"REGRESSION: {m['files_per_s']:.2f} files/s < baseline {base:.2f} files/s (-{args.tolerance:.0%})")
+            sys.exit(1)
+        print(f"OK vs baseline {base:.2f} files/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from enum import Enum
+from pathlib import Path
+from typing import List, Optional
+
+from my_type import OUTPUT_PATH, Dream
+
+CACHE_FILE = OUTPUT_PATH / "llm_cache.sqlite"
+
+class LLMCache:
+    """
+    Cache kết quả LLM trên đĩa (SQLite), key = sha256(prompt, model, instruction_version).
+    Lưu list Dream (dạng JSON) đã parse từ response, chưa qua update_dreams.
+    Eviction: xoá entry cũ hơn max_age_days, rồi xoá entry ít dùng nhất
+    khi vượt max_entries hoặc max_bytes.
+    """
+
+    def __init__(self, db_path: Path = CACHE_FILE, max_entries: int = 20000,
+                 max_bytes: int = 200 * 1024 * 1024, max_age_days: float = 90,
+                 evict_every: int = 100):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(prompt: str, model: Enum, instruction_version: str) -> str:
+        h = hashlib.sha256()
+        for part in (prompt, model.value, instruction_version):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dream]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return [Dream(**d) for d in json.loads(row[0])]
+
+    def put(self, key: str, model: Enum, dreams: List[Dream]):
+        value = json.dumps([d.model_dump() for d in dreams], ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model.value, value, len(value), now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict_locked()
+
+    def evict(self):
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.max_age,))
+
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count > self.max_entries or total > self.max_bytes:
+            # xoá dần entry ít được truy cập nhất cho đến khi dưới ngưỡng
+            removed_bytes = 0
+            to_delete = []
+            for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at"):
+                if count - len(to_delete) <= self.max_entries and total - removed_bytes <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                removed_bytes += size
+            self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", to_delete)
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache() -> LLMCache:
+    # Khởi tạo lười, dùng chung cho cả module
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache()
+        return _llm_cache
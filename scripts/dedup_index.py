@@ -0,0 +1,224 @@
+"""
+Chống gửi LLM nhiều lần cho cùng 1 báo cáo giấc mơ (trùng file dưới tên khác / ở folder người khác).
+Kết quả trích của file đầu tiên được lưu theo:
+- sha256 byte của PDF (bản copy y hệt)
+- sha256 text đã chuẩn hoá (bỏ khác biệt khoảng trắng / hoa thường / dấu câu)
+- tuỳ chọn MinHash 5-word shingle + LSH (bản gần trùng, vd. sửa vài chữ), ngưỡng NEAR_DUP_THRESHOLD
+File trùng dùng lại các Dream đó, chỉ đóng dấu lại notes (case_id / dream_id: id_allocator, xem pdf_helper.hybrid_filter_dream_text).
+Mọi key nằm trong namespace model + INSTRUCTION_VERSION + version / cấu hình của cleaner, layout_filter,
+prompt_budget (pdf_helper._dedup_namespace): đổi 1 trong số đó thì không dùng lại kết quả cũ.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import struct
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from my_type import NEAR_DUP_THRESHOLD, OUTPUT_PATH, Dream
+
+DEDUP_FILE = OUTPUT_PATH / "dedup_index.sqlite"
+
+NUM_PERM = 64
+BANDS = 16          # 16 band x 4 hàng: cặp có Jaccard ~0.9 gần như chắc chắn chung ít nhất 1 band
+SHINGLE_WORDS = 5
+_MERSENNE = (1 << 61) - 1
+_PERMS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE)
+    for i in range(NUM_PERM)
+]
+
+RX_NON_WORD = re.compile(r"[\W_]+")
+
+# chờ lock của bản trùng trong async: poll thay vì giữ 1 thread của executor (huỷ task giữa chừng vẫn an toàn)
+_ALOCK_POLL_SECONDS = 0.05
+
+class _Inflight:
+    # lock của 1 nội dung + số người đang giữ / chờ: về 0 thì bỏ khỏi DedupIndex._inflight
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+class DedupHit(NamedTuple):
+    dreams: List[Dream]
+    source_title: str
+    kind: str  # "pdf" | "text" | "near"
+
+def normalize_content(text: str) -> str:
+    return RX_NON_WORD.sub(" ", text).casefold().strip()
+
+def content_key(text: str) -> str:
+    return hashlib.sha256(normalize_content(text).encode("utf-8")).hexdigest()
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def minhash(text: str) -> List[int]:
+    words = normalize_content(text).split()
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMS]
+
+def _bands(sig: List[int]) -> List[str]:
+    rows = NUM_PERM // BANDS
+    return [hashlib.blake2b(struct.pack(f"<{rows}Q", *sig[i * rows:(i + 1) * rows]), digest_size=8).hexdigest()
+            for i in range(BANDS)]
+
+def similarity(a: List[int], b: List[int]) -> float:
+    # ước lượng Jaccard của 2 tập shingle
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+class DedupIndex:
+    def __init__(self, db_path: Path = DEDUP_FILE, near_threshold: float = NEAR_DUP_THRESHOLD):
+        self.db_path = Path(db_path)
+        self.near_threshold = near_threshold
+        self.hits: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Inflight] = {}
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                title_pdf TEXT NOT NULL,
+                dreams TEXT NOT NULL,
+                sig BLOB,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pdf_hashes (
+                pdf_key TEXT PRIMARY KEY,
+                key TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS lsh (
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lsh_bucket ON lsh(bucket);"""
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _ns(namespace: str, key: str) -> str:
+        return f"{namespace}:{key}"
+
+    def _enter(self, key: str) -> _Inflight:
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is None:
+                entry = self._inflight[key] = _Inflight()
+            entry.users += 1
+            return entry
+
+    def _leave(self, key: str, entry: _Inflight):
+        with self._lock:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._inflight[key]
+
+    @contextmanager
+    def lock_for(self, key: str):
+        """1 lock / nội dung: bản trùng đang chạy song song chờ bản đầu tiên thay vì gọi LLM lần 2."""
+        entry = self._enter(key)
+        try:
+            with entry.lock:
+                yield
+        finally:
+            self._leave(key, entry)
+
+    @asynccontextmanager
+    async def alock_for(self, key: str):
+        """Như lock_for cho ASYNC_MODE, dùng chung lock với đường sync / các event loop khác (run_study)."""
+        entry = self._enter(key)
+        try:
+            while not entry.lock.acquire(blocking=False):
+                await asyncio.sleep(_ALOCK_POLL_SECONDS)
+            try:
+                yield
+            finally:
+                entry.lock.release()
+        finally:
+            self._leave(key, entry)
+
+    def _load(self, key: str) -> Optional[Tuple[str, str, Optional[bytes]]]:
+        return self._conn.execute("SELECT title_pdf, dreams, sig FROM extractions WHERE key = ?", (key,)).fetchone()
+
+    def lookup(self, namespace: str, pdf_hash: str, text_key: str, text: Optional[str] = None) -> Optional[DedupHit]:
+        """text != None: thử thêm MinHash (chậm hơn, chỉ khi USE_NEAR_DEDUP)."""
+        with self._lock:
+            kind, row = None, None
+            if pdf_hash:
+                mapped = self._conn.execute("SELECT key FROM pdf_hashes WHERE pdf_key = ?", (self._ns(namespace, pdf_hash),)).fetchone()
+                if mapped is not None:
+                    kind, row = "pdf", self._load(mapped[0])
+            if row is None and text_key:
+                kind, row = "text", self._load(self._ns(namespace, text_key))
+            if row is None and text:
+                kind, row = "near", self._near_locked(namespace, text)
+            if row is None:
+                return None
+            self.hits[kind] += 1
+        return DedupHit([Dream(**d) for d in json.loads(row[1])], row[0], kind)
+
+    def _near_locked(self, namespace: str, text: str):
+        sig = minhash(text)
+        candidates = set()
+        for band in _bands(sig):
+            candidates.update(k for (k,) in self._conn.execute("SELECT key FROM lsh WHERE bucket = ?", (self._ns(namespace, band),)))
+        best, best_sim = None, self.near_threshold
+        for key in candidates:
+            row = self._load(key)
+            if row is None or row[2] is None:
+                continue
+            sim = similarity(sig, list(struct.unpack(f"<{NUM_PERM}Q", row[2])))
+            if sim >= best_sim:
+                best, best_sim = row, sim
+        return best
+
+    def record(self, namespace: str, pdf_hash: str, text_key: str, title_pdf: str, dreams: List[Dream],
+               text: Optional[str] = None):
+        key = self._ns(namespace, text_key)
+        sig = minhash(text) if text else None
+        value = json.dumps([d.model_dump() for d in dreams], ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, title_pdf, dreams, sig, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, title_pdf, value, struct.pack(f"<{NUM_PERM}Q", *sig) if sig else None, time.time()),
+            )
+            if pdf_hash:
+                self._conn.execute("INSERT OR REPLACE INTO pdf_hashes (pdf_key, key) VALUES (?, ?)",
+                                   (self._ns(namespace, pdf_hash), key))
+            if sig:
+                self._conn.execute("DELETE FROM lsh WHERE key = ?", (key,))
+                self._conn.executemany("INSERT INTO lsh (bucket, key) VALUES (?, ?)",
+                                       [(self._ns(namespace, band), key) for band in _bands(sig)])
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        return {"entries": count, **self.hits}
+
+_dedup_index: Optional[DedupIndex] = None
+_dedup_lock = threading.Lock()
+
+def get_dedup_index() -> DedupIndex:
+    # Khởi tạo lười, dùng chung cho cả module
+    global _dedup_index
+    with _dedup_lock:
+        if _dedup_index is None:
+            _dedup_index = DedupIndex()
+        return _dedup_index
@@ -0,0 +1,142 @@
+"""
+DreamBatch: nhiều Dream lưu theo cột (1 list str / field) thay cho list pydantic Dream.
+Dùng cho các lượt xử lý hàng loạt (gộp / làm sạch lại hàng chục nghìn dòng CSV):
+- kiểm tra kiểu 1 lần ở biên (from_rows / from_dreams), bên trong không tạo object / model_copy cho từng dòng
+- apply(field, fn) chạy fn trên cả cột (vd. clean_dream_text), batch[i] là view DreamRow (__slots__) không copy dữ liệu
+- to_dreams() khi cần lại list Dream (model_construct, không validate lần 2)
+
+    batch = DreamBatch.from_rows(iter_rows("*_dreams.csv")).apply("dream_text", clean_dream_text)
+    write_csv(batch, "clean_all.csv")
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from my_type import Dream
+
+FIELDS = tuple(Dream.model_fields)  # case_id, dream_id, date, dream_text, state_of_mind, notes
+_REQUIRED = tuple(name for name, f in Dream.model_fields.items() if f.is_required())
+
+class DreamRow:
+    """View của 1 dòng trong DreamBatch: đọc / ghi thẳng vào cột, không giữ bản sao."""
+    __slots__ = ("_batch", "_index")
+
+    def __init__(self, batch: "DreamBatch", index: int):
+        self._batch = batch
+        self._index = index
+
+    def to_dict(self) -> Dict[str, str]:
+        return {name: col[self._index] for name, col in self._batch.columns.items()}
+
+    def to_dream(self) -> Dream:
+        return Dream.model_construct(**self.to_dict())
+
+    def __repr__(self) -> str:
+        return f"DreamRow({self.to_dict()!r})"
+
+def _column_property(name: str) -> property:
+    def _get(row: DreamRow) -> str:
+        return row._batch.columns[name][row._index]
+
+    def _set(row: DreamRow, value: str):
+        row._batch.columns[name][row._index] = value
+
+    return property(_get, _set)
+
+for _name in FIELDS:
+    setattr(DreamRow, _name, _column_property(_name))
+
+class DreamBatch:
+    __slots__ = ("columns",)
+
+    def __init__(self, columns: Optional[Dict[str, List[str]]] = None):
+        self.columns: Dict[str, List[str]] = columns if columns is not None else {name: [] for name in FIELDS}
+
+    # --- biên: kiểm tra 1 lần khi đưa dữ liệu vào ---
+
+    @classmethod
+    def from_dreams(cls, dreams: Iterable[Dream]) -> "DreamBatch":
+        # Dream đã được pydantic kiểm tra khi tạo, chỉ cần đọc thuộc tính
+        batch = cls()
+        for d in dreams:
+            for name, col in batch.columns.items():
+                col.append(getattr(d, name))
+        return batch
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict], strict: bool = False) -> "DreamBatch":
+        """
+        Dòng dạng dict (csv.DictReader, JSON của LLM). Thiếu field / None => "" (như CSV output),
+        strict=True thì thiếu field bắt buộc của Dream => ValueError. Giá trị khác str được ép về str.
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        if strict:
+            for n, row in enumerate(rows):
+                missing = [name for name in _REQUIRED if row.get(name) is None]
+                if missing:
+                    raise ValueError(f"row {n}: missing {', '.join(missing)}")
+
+        columns = {}
+        for name in FIELDS:
+            # kiểm tra theo cột: trường hợp thường gặp (toàn str) chỉ tốn 1 lượt all()
+            col = [row.get(name) for row in rows]
+            if not all(type(v) is str for v in col):
+                col = [v if isinstance(v, str) else "" if v is None else str(v) for v in col]
+            columns[name] = col
+        return cls(columns)
+
+    # --- truy cập ---
+
+    def __len__(self) -> int:
+        return len(self.columns[FIELDS[0]])
+
+    def __getitem__(self, index: int) -> DreamRow:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return DreamRow(self, index)
+
+    def __iter__(self) -> Iterator[DreamRow]:
+        return (DreamRow(self, i) for i in range(len(self)))
+
+    def column(self, name: str) -> List[str]:
+        return self.columns[name]
+
+    # --- xử lý theo cột ---
+
+    def apply(self, name: str, fn: Callable[[str], str]) -> "DreamBatch":
+        """Chạy fn trên cả cột name (tại chỗ), trả về chính batch để nối lệnh."""
+        col = self.columns[name]
+        col[:] = map(fn, col)
+        return self
+
+    def take(self, indices: Sequence[int]) -> "DreamBatch":
+        return DreamBatch({name: [col[i] for i in indices] for name, col in self.columns.items()})
+
+    def filter(self, name: str, predicate: Callable[[str], bool]) -> "DreamBatch":
+        return self.take([i for i, v in enumerate(self.columns[name]) if predicate(v)])
+
+    def extend(self, other: "DreamBatch") -> "DreamBatch":
+        for name, col in self.columns.items():
+            col.extend(other.columns[name])
+        return self
+
+    def clear(self):
+        for col in self.columns.values():
+            col.clear()
+
+    # --- xuất ---
+
+    def iter_dicts(self) -> Iterator[Dict[str, str]]:
+        # csv.DictWriter.writerows nhận thẳng iterator này
+        names = list(self.columns)
+        return (dict(zip(names, values)) for values in zip(*self.columns.values()))
+
+    def iter_tuples(self, names: Sequence[str] = FIELDS) -> Iterator[tuple]:
+        # csv.writer: nhanh hơn DictWriter khi đã biết thứ tự cột
+        return zip(*(self.columns[name] for name in names))
+
+    def to_dreams(self) -> List[Dream]:
+        return [Dream.model_construct(**row) for row in self.iter_dicts()]
+
+    def __repr__(self) -> str:
+        return f"DreamBatch({len(self)} rows)"
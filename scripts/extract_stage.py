@@ -0,0 +1,92 @@
+"""
+Bước đọc PDF chạy trên nhiều process (mỗi task tự mở 1 document PyMuPDF,
+không chia sẻ gì giữa các worker), tách hẳn khỏi độ trễ của LLM.
+
+    python extract_stage.py          # đọc toàn bộ INPUT_PATH, in thống kê
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+from layout_filter import LayoutStats, total_stats
+from my_type import INPUT_PATH, USE_DEDUP, USE_LAYOUT_FILTER
+from pdf_helper import PdfPrompt, load_pdf_text, parse_filename, prompt_from_block
+from run_metrics import get_metrics
+
+@dataclass
+class ExtractedPdf:
+    index: int                 # vị trí trong danh sách input
+    file_path: str
+    prompt: PdfPrompt
+    ids: List[int]
+    year: Optional[int]
+    title_pdf: str
+    page_count: int
+    # giây theo bước, cùng tên span với đường thread (text_store, pdf_open, pdf_text, clean, prompt):
+    # process chính record() lại vào get_metrics(), span ghi trong worker không tự về được
+    timings: Dict[str, float] = field(default_factory=dict)
+    layout: Optional[LayoutStats] = None  # layout_filter của file này (USE_LAYOUT_FILTER), process chính record_stats()
+
+def extract_one(index: int, file_path: Union[str, Path]) -> ExtractedPdf:
+    """Worker: đọc 1 PDF (hoặc lấy từ text_store), trả về prompt đã làm sạch + metadata (picklable)."""
+    file_path = Path(file_path)
+    metrics = get_metrics()
+    # 1 worker process chạy 1 file 1 lúc => chênh lệch tổng layout_filter trước / sau là của file này
+    layout_before = total_stats()
+
+    with metrics.capture() as timings:
+        pages, block, pdf_hash = load_pdf_text(file_path)
+        ids, year, title_pdf = parse_filename(file_path.name)
+        with metrics.span("prompt"):
+            prompt = prompt_from_block(block, title_pdf, pdf_hash if USE_DEDUP else "")
+
+    layout = total_stats().minus(layout_before) if USE_LAYOUT_FILTER else None
+    return ExtractedPdf(index, str(file_path), prompt, ids, year, title_pdf, len(pages), dict(timings), layout)
+
+def start_extract_stage(files: List[Path], workers: Optional[int] = None) -> queue.Queue:
+    """
+    Chạy extract_one trên ProcessPoolExecutor, đẩy kết quả (theo thứ tự hoàn thành)
+    vào queue trả về. Lỗi của 1 file được đẩy vào queue dưới dạng exception;
+    None đánh dấu kết thúc.
+    """
+    out: queue.Queue = queue.Queue()
+
+    def _feed():
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [
+                pool.submit(extract_one, i, str(file))
+                for i, file in enumerate(files)
+            ]
+            for fut in as_completed(futures):
+                try:
+                    out.put(fut.result())
+                except Exception as e:
+                    out.put(e)
+        out.put(None)
+
+    threading.Thread(target=_feed, name="extract-stage", daemon=True).start()
+    return out
+
+def iter_extracted(files: List[Path], workers: Optional[int] = None) -> Iterator[ExtractedPdf]:
+    q = start_extract_stage(files, workers)
+    while (item := q.get()) is not None:
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+if __name__ == "__main__":
+  files = sorted(f for f in INPUT_PATH.rglob("*.pdf") if f.is_file())
+  start = time.perf_counter()
+  pages = 0
+
+  for item in iter_extracted(files):
+    pages += item.page_count
+    print(f"{item.index + 1}/{len(files)} {Path(item.file_path).name}: {item.page_count} pages, "
+          f"{len(item.prompt.text)} chars, " + ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in item.timings.items()))
+
+  elapsed = time.perf_counter() - start
+  print(f"Extracted {len(files)} PDFs ({pages} pages) in {elapsed:.2f}s")
@@ -0,0 +1,182 @@
+"""
+Server giả lập Gemini generateContent / streamGenerateContent để chạy pipeline không tốn quota.
+Trỏ client vào đây bằng GEMINI_BASE_URL=http://127.0.0.1:<port> (xem ai_helper._make_gemini_client).
+
+- latency / jitter: thời gian "sinh" response (giây)
+- rpm: vượt số request / 60s này thì trả 429 RESOURCE_EXHAUSTED (kèm Retry-After + RetryInfo)
+- error_rate: tỉ lệ 429 ngẫu nhiên (ngoài rpm)
+Dream trả về được cắt từ chính prompt (theo marker First dream / Dream 2 ...), nên số dòng CSV
+gần giống pipeline thật. Prompt gộp nhiều tài liệu (### DOCUMENT n) được trả kèm doc_index.
+
+    python fake_llm_server.py --port 8765 --latency 0.5 --rpm 60
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+RX_DOCUMENT = re.compile(r"^### DOCUMENT (\d+)\n", re.M)
+RX_TITLE = re.compile(r"title_pdf: (.*?)\. PDF text: ")
+RX_DATE = re.compile(r"(?:Date of dream|Dream date)\s*:?\s*(\d{1,2}/\d{1,2}/\d{4})", re.I)
+RX_STATE = re.compile(r"(?:State of mind|Dream mood)\s*:\s*(.*?)(?=\s+(?:First dream|Dream \d|$))", re.I)
+RX_MARKER = re.compile(r"\b(?:(?:First|Second|Third|Fourth|Fifth) dream|Dream \d+)\s*:?\s*", re.I)
+
+def _dreams_for(prompt: str, doc_index: Optional[int] = None) -> List[dict]:
+    m = RX_TITLE.search(prompt)
+    title = m.group(1) if m else "unknown"
+    body = prompt[m.end():] if m else prompt
+    date = RX_DATE.search(body)
+    state = RX_STATE.search(body)
+
+    parts = RX_MARKER.split(body)[1:] or [body]
+    out = []
+    for text in parts:
+        d = {
+            "date": date.group(1) if date else "",
+            "dream_text": text.strip()[:2000],
+            "state_of_mind": state.group(1).strip() if state else "",
+            "notes": f"From PDF: {title}",
+        }
+        if doc_index is not None:
+            d["doc_index"] = doc_index
+        out.append(d)
+    return out
+
+def build_response_text(prompt: str) -> str:
+    docs = RX_DOCUMENT.split(prompt)
+    if len(docs) > 1:
+        # ["", "0", text0, "1", text1, ...]
+        items = [d for i in range(1, len(docs), 2) for d in _dreams_for(docs[i + 1], int(docs[i]))]
+    else:
+        items = _dreams_for(prompt)
+    return json.dumps(items, ensure_ascii=False)
+
+class FakeLLMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, jitter: float = 0.0,
+                 rpm: Optional[int] = None, error_rate: float = 0.0, retry_after: float = 1.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "streamed": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window: deque = deque()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLLMServer":
+        threading.Thread(target=self._httpd.serve_forever, name="fake-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _admit(self) -> bool:
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            limited = (self.rpm is not None and len(self._window) >= self.rpm) or self._rng.random() < self.error_rate
+            if limited:
+                self.stats["rate_limited"] += 1
+                return False
+            self._window.append(now)
+            self.stats["ok"] += 1
+            return True
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not server._admit():
+                    self._send_json(429, {"error": {
+                        "code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Resource has been exhausted (fake)",
+                        "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{server.retry_after:g}s"}],
+                    }}, {"Retry-After": f"{server.retry_after:g}"})
+                    return
+
+                prompt = "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+                text = build_response_text(prompt)
+                usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4,
+                         "totalTokenCount": (len(prompt) + len(text)) // 4}
+                delay = server._delay()
+
+                if ":streamGenerateContent" in self.path:
+                    server.stats["streamed"] += 1
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    pieces = [text[i:i + 200] for i in range(0, len(text), 200)] or [""]
+                    for k, piece in enumerate(pieces):
+                        time.sleep(delay / len(pieces))
+                        chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": piece}]}, "index": 0}]}
+                        if k == len(pieces) - 1:
+                            chunk["candidates"][0]["finishReason"] = "STOP"
+                            chunk["usageMetadata"] = usage
+                        self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.close_connection = True
+                    return
+
+                time.sleep(delay)
+                self._send_json(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+                    "usageMetadata": usage,
+                })
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Fake Gemini generateContent server")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.5)
+    ap.add_argument("--jitter", type=float, default=0.1)
+    ap.add_argument("--rpm", type=int, default=None)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    args = ap.parse_args()
+
+    srv = FakeLLMServer(port=args.port, latency=args.latency, jitter=args.jitter, rpm=args.rpm,
+                        error_rate=args.error_rate, retry_after=args.retry_after).start()
+    print(f"Fake Gemini server on {srv.base_url} (GEMINI_BASE_URL={srv.base_url}), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.stop()
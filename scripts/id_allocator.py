@@ -0,0 +1,49 @@
+"""
+Cấp case_id / dream_id tại máy thay vì nhờ LLM đánh số tiếp (prompt không còn "last case id").
+- case_id: file thứ i (0-based, theo thứ tự input) = last_case_id + i + 1, không phụ thuộc kết quả
+  của file trước => các file có thể xong lệch thứ tự mà ID vẫn xác định
+- dream_id: D0001, D0002, ... theo thứ tự giấc mơ trong từng file (case)
+
+    ids = IdAllocator(journal.last_case_id or "C0000")
+    rows = ids.stamp(i, dreams)     # sau khi trích xong file thứ i
+"""
+import re
+from typing import Iterable, List
+
+from my_type import Dream
+
+RX_CASE_ID = re.compile(r"^[Cc](\d+)$")
+
+def parse_case_id(case_id: str) -> int:
+    # "C0215" -> 215, không đúng format => 0
+    m = RX_CASE_ID.match(case_id or "")
+    return int(m.group(1)) if m else 0
+
+def format_case_id(n: int) -> str:
+    return f"C{n:04d}"
+
+def format_dream_id(k: int) -> str:
+    return f"D{k:04d}"
+
+def stamp_ids(dreams: Iterable[Dream], case_id: str, first_dream: int = 1) -> List[Dream]:
+    """Ghi đè case_id / dream_id (bỏ qua giá trị LLM / rule_extractor trả về nếu có)."""
+    return [
+        d.model_copy(update={"case_id": case_id, "dream_id": format_dream_id(k)})
+        for k, d in enumerate(dreams, start=first_dream)
+    ]
+
+class IdAllocator:
+    """case_id theo vị trí của file trong 1 lần chạy, tiếp nối last_case_id của lần trước (journal)."""
+
+    def __init__(self, last_case_id: str = "C0000"):
+        self.base = parse_case_id(last_case_id)
+
+    def case_id(self, index: int) -> str:
+        return format_case_id(self.base + index + 1)
+
+    def stamp(self, index: int, dreams: Iterable[Dream], first_dream: int = 1) -> List[Dream]:
+        return stamp_ids(dreams, self.case_id(index), first_dream)
+
+    def last(self, total: int) -> str:
+        # case_id cuối cùng đã cấp sau total file (file rỗng vẫn chiếm 1 case_id)
+        return format_case_id(self.base + total)
@@ -0,0 +1,137 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from my_type import DATA_PATH, INPUT_PATH, OUTPUT_PATH
+from output_helper import checkpoint_outputs
+
+def journal_key(file: Path) -> str:
+    # Đường dẫn tương đối so với DATA_PATH (cùng key dù chạy 1 người hay --all), ngoài DATA_PATH thì so với INPUT_PATH
+    for root in (DATA_PATH, INPUT_PATH):
+        try:
+            return file.relative_to(root).as_posix()
+        except ValueError:
+            pass
+    return file.as_posix()
+
+def _input_prefix() -> Optional[str]:
+    try:
+        return INPUT_PATH.relative_to(DATA_PATH).as_posix() + "/"
+    except ValueError:
+        return None
+
+# journal cũ (trước manifest / --all) lưu key tương đối so với INPUT_PATH
+_LEGACY_PREFIX = _input_prefix()
+
+class JournalMissing(RuntimeError):
+    """CSV đã có dữ liệu nhưng không có journal: không biết file nào đã xong / case_id nào đã cấp."""
+
+class RunJournal:
+    """
+    Journal (JSONL, append-only) các file đã xử lý xong của 1 lần chạy.
+    Dòng đầu (reset): {file: null, csv_offset, output_offset} ngay sau header CSV,
+    mỗi dòng sau: {file, case_start, case_end, rows, csv_offset, output_offset}.
+    Chỉ ghi sau khi các dòng CSV của file đã được ghi xuống đĩa, nên mọi byte
+    CSV nằm sau csv_offset cuối cùng là của 1 file chưa xong => cắt bỏ khi resume.
+    """
+
+    def __init__(self, csv_filename: str, output_filename: str):
+        self.csv_path = OUTPUT_PATH / csv_filename
+        self.output_path = OUTPUT_PATH / output_filename
+        self.path = OUTPUT_PATH / f"{Path(csv_filename).stem}.journal.jsonl"
+        self.done: dict[str, dict] = {}
+        self.last: Optional[dict] = None
+        self.start: Optional[dict] = None  # mốc cắt khi chưa có file nào commit
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # dòng cuối ghi dở khi crash
+                if entry.get("file") is None:
+                    self.start = entry
+                    continue
+                self.done[entry["file"]] = entry
+                self.last = entry
+
+    @property
+    def last_case_id(self) -> Optional[str]:
+        # case_id cuối cùng đã cấp, lần chạy tiếp theo bắt đầu sau nó
+        return self.last["case_end"] if self.last else None
+
+    def is_done(self, key: str) -> bool:
+        if key in self.done:
+            return True
+        return _LEGACY_PREFIX is not None and key.startswith(_LEGACY_PREFIX) and key[len(_LEGACY_PREFIX):] in self.done
+
+    def recover(self):
+        """
+        Cắt CSV / output về offset đã commit cuối cùng (xoá dòng trùng của file đang dở).
+        Crash trước lần commit đầu tiên => cắt về mốc của reset() (ngay sau header CSV).
+        CSV có dữ liệu mà không có journal => JournalMissing thay vì ghi tiếp từ C0001.
+        """
+        point = self.last or self.start
+        if point is None:
+            point = self._legacy_start_point()
+            if point is None:
+                return
+        for path, offset in ((self.csv_path, point["csv_offset"]), (self.output_path, point["output_offset"])):
+            if path.exists() and path.stat().st_size > offset:
+                with path.open("r+b") as f:
+                    f.truncate(offset)
+                print(f"Truncated {path.name} to last committed offset {offset}")
+
+    def _legacy_start_point(self) -> Optional[dict]:
+        if not self.csv_path.exists():
+            return None
+        with self.csv_path.open("rb") as f:
+            header = f.readline()
+            has_rows = bool(f.readline().strip())
+        if not self.path.exists():
+            if has_rows:
+                raise JournalMissing(
+                    f"{self.csv_path.name} already has rows but no journal ({self.path.name}); "
+                    "move or delete it to start over"
+                )
+            return None
+        # journal rỗng (tạo trước khi reset() ghi mốc): chưa file nào xong, giữ header CSV, output log để nguyên
+        output_size = self.output_path.stat().st_size if self.output_path.exists() else 0
+        return {"csv_offset": len(header), "output_offset": output_size}
+
+    def reset(self):
+        """Gọi ngay sau initCSV: journal mới với mốc cắt là cuối header CSV / kích thước output hiện tại."""
+        self.done.clear()
+        self.last = None
+        self.start = {
+            "file": None,
+            "csv_offset": self.csv_path.stat().st_size if self.csv_path.exists() else 0,
+            "output_offset": self.output_path.stat().st_size if self.output_path.exists() else 0,
+        }
+        with self.path.open("w", encoding="utf-8") as f:
+            f.write(json.dumps(self.start) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def commit(self, key: str, case_start: Optional[str], case_end: Optional[str], rows: int):
+        # đẩy buffer của OutputWriter xuống đĩa trước khi đo offset
+        checkpoint_outputs(self.csv_path.name, self.output_path.name)
+        entry = {
+            "file": key,
+            "case_start": case_start,
+            "case_end": case_end,
+            "rows": rows,
+            "csv_offset": self.csv_path.stat().st_size if self.csv_path.exists() else 0,
+            "output_offset": self.output_path.stat().st_size if self.output_path.exists() else 0,
+        }
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[key] = entry
+        self.last = entry
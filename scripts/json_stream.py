@@ -0,0 +1,84 @@
+import json
+import re
+from typing import List
+
+# Ký tự cấu trúc cần theo dõi; phần còn lại của chunk được bỏ qua bằng finditer
+_STRUCT = re.compile(r'[\[\]{}"\\]')
+
+class JsonArrayStream:
+    """
+    Parser tăng dần cho 1 mảng JSON các object, nhận text theo từng chunk (response stream).
+    feed() trả về các object (dict) vừa đóng ngoặc trong chunk đó, nên có thể ghi từng giấc mơ
+    ngay khi nó hoàn chỉnh. Text trước '[' (```json, lời dẫn) bị bỏ qua.
+    Sau khi stream kết thúc: truncated = True nếu mảng chưa đóng (response bị cắt);
+    các object đã trả về trước đó vẫn hợp lệ.
+    """
+
+    def __init__(self):
+        self.started = False  # đã gặp '[' ngoài cùng
+        self.done = False     # đã gặp ']' ngoài cùng
+        self.errors = 0       # object đóng ngoặc nhưng không phải JSON hợp lệ
+        self._depth = 0       # độ sâu bên trong mảng ngoài cùng
+        self._in_str = False
+        self._skip_first = False  # ký tự đầu chunk sau bị escape bởi '\' cuối chunk trước
+        self._carry: List[str] = []  # phần object đang dở từ các chunk trước
+
+    @property
+    def truncated(self) -> bool:
+        return not self.done
+
+    def feed(self, chunk: str) -> List[dict]:
+        out = []
+        if self.done or not chunk:
+            return out
+
+        obj_start = 0
+        skip_to = 1 if self._skip_first else 0
+        self._skip_first = False
+
+        for m in _STRUCT.finditer(chunk):
+            i = m.start()
+            if i < skip_to:
+                continue
+            c = chunk[i]
+
+            if self._in_str:
+                if c == "\\":
+                    skip_to = i + 2
+                    if skip_to > len(chunk):
+                        self._skip_first = True
+                elif c == '"':
+                    self._in_str = False
+                continue
+
+            if not self.started:
+                if c == "[":
+                    self.started = True
+                continue
+
+            if c == '"':
+                self._in_str = True
+            elif c in "[{":
+                if self._depth == 0:
+                    obj_start = i
+                self._depth += 1
+            elif self._depth == 0:
+                if c == "]":
+                    self.done = True
+                    break
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    text = "".join(self._carry) + chunk[obj_start:i + 1]
+                    self._carry.clear()
+                    try:
+                        obj = json.loads(text)
+                    except json.JSONDecodeError:
+                        self.errors += 1
+                        continue
+                    if isinstance(obj, dict):
+                        out.append(obj)
+
+        if self._depth > 0:
+            self._carry.append(chunk[obj_start:])
+        return out
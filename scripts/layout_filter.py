@@ -0,0 +1,133 @@
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import fitz  # PyMuPDF
+
+from rule_extractor import DREAM_MARKER
+from style_index import PageStyleIndex, StyledSpan
+
+# Tăng khi đổi luật lọc: text_store lưu pages đã lọc theo version này
+LAYOUT_FILTER_VERSION = "3"
+
+# Màu đánh dấu phần phân tích / ghi chú của người chấm (xem đoạn comment cũ trong build_prompt_text)
+MARKER_COLORS = {"#c216c2"}
+
+# Dòng nhãn mà extract_clean_block / rule_extractor cần => luôn giữ nguyên dù in đậm
+RX_KEEP_LINE = re.compile(
+    r'^\s*(?:Date of dream|Dream date|Date|State of mind|Dream mood|Mood|Feeling|Dream and analysis|Dream analysis'
+    r'|Revision|student note|Student mark|Reviewer(?:’|\'|)s? Message)\b',
+    re.I,
+)
+
+# Tiêu đề giấc mơ ("First dream", "The third dream:", "Dream 2") là ranh giới mà prompt_budget.split_at_dreams /
+# rule_extractor dựa vào => giữ dù in đậm / in hoa. Chỉ khi dòng (hoặc span) chỉ có tiêu đề:
+# câu phân tích in đậm "The first dream shows ..." vẫn bị bỏ
+RX_DREAM_HEADING = re.compile(r'^\s*(?:' + DREAM_MARKER.pattern.lstrip('^') + r'|dream)\s*[:\-–.]?\s*$', re.I)
+
+@dataclass
+class LayoutStats:
+    kept_chars: int = 0
+    removed_chars: int = 0
+    removed_bold: int = 0
+    removed_caps: int = 0
+    removed_marker: int = 0
+
+    def add(self, other: "LayoutStats"):
+        self.kept_chars += other.kept_chars
+        self.removed_chars += other.removed_chars
+        self.removed_bold += other.removed_bold
+        self.removed_caps += other.removed_caps
+        self.removed_marker += other.removed_marker
+
+    def minus(self, other: "LayoutStats") -> "LayoutStats":
+        return LayoutStats(*(getattr(self, f) - getattr(other, f) for f in self.__dataclass_fields__))
+
+    def __str__(self) -> str:
+        total = self.kept_chars + self.removed_chars
+        pct = 100.0 * self.removed_chars / total if total else 0.0
+        return (f"removed {self.removed_chars}/{total} chars ({pct:.1f}%): "
+                f"bold {self.removed_bold}, all-caps {self.removed_caps}, marker {self.removed_marker}")
+
+# Cụm in hoa phải có ít nhất chừng này từ (>= 2 chữ cái mỗi từ) mới bị bỏ:
+# "OK", "USA", "I" hay "I SAW" trong giấc mơ được giữ lại
+CAPS_RUN_MIN_WORDS = 2
+RX_CAPS_WORD = re.compile(r"[^\W\d_]{2,}")
+
+def is_caps_run(text: str) -> bool:
+    # như is_all_caps (pdf_helper) nhưng cho cả cụm nhiều từ: "DREAM JOURNAL WEEK 3"
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters or not all(ch.isupper() for ch in letters):
+        return False
+    return len(RX_CAPS_WORD.findall(text)) >= CAPS_RUN_MIN_WORDS
+
+def _drop_reason(sp: StyledSpan) -> str:
+    if sp.color in MARKER_COLORS:
+        return "marker"
+    if sp.bold:
+        return "bold"
+    if is_caps_run(sp.text):
+        return "caps"
+    return ""
+
+def filter_page(page: fitz.Page) -> Tuple[str, LayoutStats]:
+    """
+    Text của trang (giống page.get_text(), mỗi dòng 1 "\\n") nhưng đã bỏ span in đậm
+    (phần phân tích), span màu đánh dấu và cụm chữ in hoa (header, ghi chú).
+    Dòng nhãn (RX_KEEP_LINE) được giữ nguyên để vẫn tìm được block Date of dream -> Revision,
+    tiêu đề giấc mơ (RX_DREAM_HEADING) cũng vậy để không mất ranh giới giữa các giấc mơ.
+    """
+    stats = LayoutStats()
+    out = []
+    # không dùng italic => bỏ get_texttrace(), chỉ cần get_text("dict")
+    for line in PageStyleIndex(page, with_italic=False).lines():
+        line_text = "".join(sp.text for sp in line)
+        if RX_KEEP_LINE.match(line_text) or RX_DREAM_HEADING.match(line_text):
+            stats.kept_chars += len(line_text)
+            out.append(line_text + "\n")
+            continue
+
+        kept = []
+        for sp in line:
+            reason = _drop_reason(sp) if sp.text.strip() and not RX_DREAM_HEADING.match(sp.text) else ""
+            if not reason:
+                kept.append(sp.text)
+                continue
+            n = len(sp.text)
+            stats.removed_chars += n
+            if reason == "bold":
+                stats.removed_bold += n
+            elif reason == "caps":
+                stats.removed_caps += n
+            else:
+                stats.removed_marker += n
+
+        text = "".join(kept)
+        stats.kept_chars += len(text)
+        if text.strip():
+            out.append(text + "\n")
+    return "".join(out), stats
+
+def filter_document(doc: fitz.Document) -> Tuple[List[str], LayoutStats]:
+    stats = LayoutStats()
+    pages = []
+    for page in doc:
+        text, page_stats = filter_page(page)
+        pages.append(text)
+        stats.add(page_stats)
+    return pages, stats
+
+# Tổng của cả lần chạy (trong process hiện tại)
+_totals = LayoutStats()
+_totals_lock = threading.Lock()
+
+def record_stats(stats: LayoutStats):
+    with _totals_lock:
+        _totals.add(stats)
+
+def total_stats() -> LayoutStats:
+    with _totals_lock:
+        total = LayoutStats()
+        total.add(_totals)
+        return total
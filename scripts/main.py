@@ -1,63 +1,424 @@
+import argparse
+import asyncio
+import contextvars
+from collections import deque
+from concurrent.futures import CancelledError, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from queue import Queue
+from typing import Callable, Iterator, Optional, TypeVar
 from pathlib import Path
-from pdf_helper import readPdf
-from output_helper import initCSV, initOutput, write_csv, write_output
-from datetime import datetime
+from pdf_helper import PdfPrompt, areadPdf, build_prompt_text, hybrid_filter_dream_stream, hybrid_filter_dream_text, llm_filter_dream_batch, readPdf, rule_filter_dream_text
+from output_helper import OutputWriter, initCSV, initOutput, write_csv, write_output
 
-from my_type import CHOOSEN_MODEL, INPUT_PATH, OUTPUT_PATH
+from ai_helper import aclose_llm_clients, estimate_tokens
+from cache_helper import get_llm_cache
+from dedup_index import get_dedup_index
+from extract_stage import ExtractedPdf, extract_one
+from id_allocator import IdAllocator
+from journal_helper import RunJournal, journal_key
+from layout_filter import record_stats, total_stats
+from manifest import by_participant, participant_for, refresh_manifest
+from providers import all_models, current_model, parse_model, set_default_model
+from rate_scheduler import DailyQuotaExceeded
+from run_metrics import get_metrics
+from my_type import BATCH_TOKEN_BUDGET, DATA_PATH, INPUT_PATH, MODEL_RPM, OUTPUT_PATH, PARTICIPANT_SUBDIR, PARTICIPANT_WORKERS, USE_DEDUP, USE_LAYOUT_FILTER, USE_LLM_CACHE
+
+# Pipeline: đọc PDF (PyMuPDF) trên 1 pool, gọi LLM trên 1 pool khác
+PIPELINE_MODE = True
+EXTRACT_WORKERS = 4
+EXTRACT_PROCESSES = 0  # > 0: đọc PDF bằng process pool (extract_stage) thay cho thread
+LLM_WORKERS: Optional[int] = None  # None = rpm của model đang dùng, không để quá 1 cửa sổ rate limit đang chờ
+
+# Gộp nhiều PDF vào 1 request (BATCH_TOKEN_BUDGET trong my_type), chỉ với Gemini
+BATCH_MODE = False
+
+# Stream response của LLM: ghi từng giấc mơ vào CSV ngay khi nhận được (chỉ llm_prompt, không batch / async)
+STREAM_MODE = False
+
+# Dùng async client (ai_helper.agemini_prompt) thay cho thread pool
+ASYNC_MODE = False
+MAX_IN_FLIGHT = 32
+
+def _extract_pool():
+  if EXTRACT_PROCESSES:
+    return ProcessPoolExecutor(EXTRACT_PROCESSES)
+  return ThreadPoolExecutor(EXTRACT_WORKERS)
+
+def _llm_workers() -> int:
+  return LLM_WORKERS or MODEL_RPM[current_model()]
+
+# Số file đã gửi (đọc PDF + LLM) nhưng chưa ghi CSV, tính theo số LLM worker
+WINDOW_PER_WORKER = 2
+
+T = TypeVar("T")
+
+def _window() -> int:
+  return WINDOW_PER_WORKER * _llm_workers()
+
+def _in_order(total: int, window: int, submit: Callable[[int], T]) -> Iterator[T]:
+  """
+  submit(i) cho file thứ i, trả kết quả theo thứ tự i; chỉ gửi trước tối đa window file
+  chưa được lấy ra, để lỗi giữa chừng không kéo theo cả 1 hàng đợi request đã gửi.
+  """
+  submitted = deque()
+  nxt = 0
+  for _ in range(total):
+    while nxt < total and len(submitted) < window:
+      submitted.append(submit(nxt))
+      nxt += 1
+    yield submitted.popleft()
+
+def _cancel_pending(*pools: Executor):
+  # huỷ job còn trong hàng đợi (chưa chạy) trước khi with ... chờ các pool đóng
+  for pool in pools:
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _scoped(file_key: str, fn, *args):
+  # chạy fn trong file_scope để run_metrics gắn các span đo được vào đúng file
+  with get_metrics().file_scope(file_key):
+    return fn(*args)
+
+def _submit_in_context(pool: Executor, fn, *args) -> Future:
+  # thread của pool không mang context của thread gửi job: chép sang để giữ model (providers.use_model)
+  return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def _submit_scoped(pool: Executor, file: Path, fn, *args) -> Future:
+  return _submit_in_context(pool, _scoped, journal_key(file), fn, *args)
+
+def _submit_extract(pool, i: int, file: Path, output_filename: str) -> Future:
+  if EXTRACT_PROCESSES:
+    return pool.submit(extract_one, i, str(file))
+  return _submit_scoped(pool, file, build_prompt_text, file.parent, file.name, output_filename)
+
+def _prompt_of(result, output_filename: str) -> PdfPrompt:
+  # process worker không ghi output log / metrics / tổng layout_filter, ghi ở đây
+  if isinstance(result, ExtractedPdf):
+    for stage, seconds in result.timings.items():
+      get_metrics().record(stage, seconds, journal_key(Path(result.file_path)))
+    if result.layout is not None:
+      record_stats(result.layout)
+    write_output(result.prompt.text, output_filename)
+    return result.prompt
+  return result
+
+def _llm_extract(prompt_future: Future, output_filename: str):
+  # chờ bước đọc PDF của chính file này (thường đã xong từ trước)
+  return hybrid_filter_dream_text(_prompt_of(prompt_future.result(), output_filename), output_filename)
+
+def _write_result(i: int, total: int, file: Path, res, case_id: str, csv_filename: str, output_filename: str, journal: Optional[RunJournal]):
+  print(f"Done file {i + 1}/{total}: {file.name}")
+
+  if res:
+    write_csv(res, csv_filename)
+    write_output("\n\n", output_filename)
+
+  if journal is not None:
+    # case_end vẫn ghi khi file rỗng: case_id này đã được cấp, resume phải tiếp tục sau nó
+    journal.commit(journal_key(file), case_id if res else None, case_id, len(res or []))
+
+def run_pipelined(files: list[Path], csv_filename: str, output_filename: str, last_case_id: str, journal: Optional[RunJournal] = None) -> str:
+  """
+  Chạy song song đọc PDF và gọi LLM, nhưng vẫn ghi CSV theo đúng thứ tự input.
+  case_id / dream_id do id_allocator cấp theo vị trí file (case_id của file thứ i luôn là
+  last_case_id + i + 1), nên kết quả xác định dù các request hoàn thành lệch thứ tự.
+  """
+  total = len(files)
+  ids = IdAllocator(last_case_id)
+
+  with _extract_pool() as extract_pool, ThreadPoolExecutor(_llm_workers()) as llm_pool:
+    def _submit(i: int) -> Future:
+      prompt = _submit_extract(extract_pool, i, files[i], output_filename)
+      return _submit_scoped(llm_pool, files[i], _llm_extract, prompt, output_filename)
+
+    try:
+      for i, fut in enumerate(_in_order(total, _window(), _submit)):
+        _write_result(i, total, files[i], ids.stamp(i, fut.result()), ids.case_id(i), csv_filename, output_filename, journal)
+    except BaseException:
+      _cancel_pending(extract_pool, llm_pool)
+      raise
+
+  return ids.last(total)
+
+def _llm_stream(prompt_future: Future, output_filename: str, out: Queue):
+  # đẩy từng Dream sang thread ghi; lỗi cũng được đẩy sang để thread ghi raise lại
+  try:
+    prompt = _prompt_of(prompt_future.result(), output_filename)
+    for d in hybrid_filter_dream_stream(prompt, output_filename):
+      out.put(d)
+  except Exception as e:
+    out.put(e)
+  finally:
+    out.put(None)
+
+def run_streaming(files: list[Path], csv_filename: str, output_filename: str, last_case_id: str, journal: Optional[RunJournal] = None) -> str:
+  """
+  Như run_pipelined nhưng response được stream: dòng CSV của file đang ở đầu hàng đợi
+  được ghi ngay khi LLM trả xong từng giấc mơ, không chờ cả response.
+  """
+  total = len(files)
+  ids = IdAllocator(last_case_id)
+
+  with _extract_pool() as extract_pool, ThreadPoolExecutor(_llm_workers()) as llm_pool:
+    def _submit(i: int) -> Queue:
+      q = Queue()
+      prompt = _submit_extract(extract_pool, i, files[i], output_filename)
+      _submit_scoped(llm_pool, files[i], _llm_stream, prompt, output_filename, q)
+      return q
+
+    try:
+      for i, q in enumerate(_in_order(total, _window(), _submit)):
+        file = files[i]
+        case_id = ids.case_id(i)
+        rows = 0
+        for item in iter(q.get, None):
+          if isinstance(item, Exception):
+            raise item
+          rows += 1
+          write_csv(ids.stamp(i, [item], first_dream=rows), csv_filename)
+
+        print(f"Done file {i + 1}/{total}: {file.name}")
+        if rows:
+          write_output("\n\n", output_filename)
+        if journal is not None:
+          journal.commit(journal_key(file), case_id if rows else None, case_id, rows)
+    except BaseException:
+      _cancel_pending(extract_pool, llm_pool)
+      raise
+
+  return ids.last(total)
+
+def run_batched(files: list[Path], csv_filename: str, output_filename: str, last_case_id: str, journal: Optional[RunJournal] = None) -> str:
+  """
+  Như run_pipelined, nhưng gom các PDF liên tiếp thành batch (theo BATCH_TOKEN_BUDGET)
+  để mỗi request chứa nhiều tài liệu. case_id vẫn là last_case_id + i + 1 cho file thứ i.
+  Batch được gom dần khi từng PDF đọc xong (theo thứ tự) và gửi ngay khi đầy.
+  """
+  total = len(files)
+  ids = IdAllocator(last_case_id)
+  window = _window()
+
+  with _extract_pool() as extract_pool, ThreadPoolExecutor(_llm_workers()) as llm_pool:
+    # [i, kết quả] chờ ghi theo thứ tự: list Dream (rule), Future (file bị chia nhỏ),
+    # (Future batch, vị trí trong batch), hoặc None khi batch chứa file này chưa được gửi
+    pending = deque()
+    batch, used = [], 0
+
+    def _flush():
+      nonlocal batch, used
+      if batch:
+        # 1 request cho cả batch: span / token được tính cho file đầu tiên của batch
+        fut = _submit_scoped(llm_pool, files[batch[0][0][0]], llm_filter_dream_batch, [doc for _, doc in batch], output_filename)
+        for k, (entry, _) in enumerate(batch):
+          entry[1] = (fut, k)
+        batch, used = [], 0
+
+    def _result(res):
+      if isinstance(res, tuple):
+        fut, k = res
+        return fut.result()[k]
+      return res.result() if isinstance(res, Future) else res
+
+    def _ready(res) -> bool:
+      fut = res[0] if isinstance(res, tuple) else res
+      return res is not None and (not isinstance(fut, Future) or fut.done())
+
+    def _write_head():
+      i, res = pending.popleft()
+      _write_result(i, total, files[i], ids.stamp(i, _result(res)), ids.case_id(i), csv_filename, output_filename, journal)
+
+    def _submit(i: int) -> Future:
+      return _submit_extract(extract_pool, i, files[i], output_filename)
+
+    try:
+      for i, prompt in enumerate(_in_order(total, window, _submit)):
+        doc = _prompt_of(prompt.result(), output_filename)
+        # tài liệu rõ ràng được parser regex xử lý luôn, chỉ gom phần còn lại vào batch
+        res = rule_filter_dream_text(doc)
+        if res is None and doc.chunks:
+          # tài liệu đã bị chia nhỏ theo PROMPT_TOKEN_BUDGET không gộp batch, gửi từng phần riêng
+          res = _submit_scoped(llm_pool, files[i], hybrid_filter_dream_text, doc, output_filename)
+        entry = [i, res]
+        pending.append(entry)
+        if res is None:
+          tokens = estimate_tokens(doc.text)
+          if batch and used + tokens > BATCH_TOKEN_BUDGET:
+            _flush()
+          batch.append((entry, doc))
+          used += tokens
+
+        # ghi các file đầu hàng đã có kết quả; quá window file chưa ghi thì gửi batch đang gom và chờ
+        while pending and _ready(pending[0][1]):
+          _write_head()
+        if len(pending) > window:
+          _flush()
+          while len(pending) > window:
+            _write_head()
+
+      _flush()
+      while pending:
+        _write_head()
+    except BaseException:
+      _cancel_pending(extract_pool, llm_pool)
+      raise
+
+  return ids.last(total)
+
+async def run_async(files: list[Path], csv_filename: str, output_filename: str, last_case_id: str, journal: Optional[RunJournal] = None) -> str:
+  """Giống run_pipelined nhưng dùng async client: tối đa MAX_IN_FLIGHT request cùng lúc."""
+  total = len(files)
+  ids = IdAllocator(last_case_id)
+  in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+  async def _one(i: int, file: Path):
+    # mỗi task có context riêng, asyncio.to_thread mang theo file_scope
+    with get_metrics().file_scope(journal_key(file)):
+      async with in_flight:
+        return await areadPdf(file.parent, file.name, output_filename, ids.case_id(i))
+
+  tasks = [asyncio.create_task(_one(i, file)) for i, file in enumerate(files)]
+
+  try:
+    for i, (file, task) in enumerate(zip(files, tasks)):
+      _write_result(i, total, file, await task, ids.case_id(i), csv_filename, output_filename, journal)
+  finally:
+    # lỗi giữa chừng: huỷ các file còn lại, rồi đóng client async của loop này (asyncio.run sắp đóng loop)
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await aclose_llm_clients()
+
+  return ids.last(total)
+
+def run_files(files: list[Path], csv_filename: str, output_filename: str):
+  """
+  1 lần chạy = 1 CSV / output log / journal; resume từ journal nếu CSV đã có.
+  Gọi trong khối with OutputWriter() (1 handle có buffer cho CSV / output log, fsync mỗi lần journal commit).
+  """
+  # Resume: đọc journal của lần chạy trước (nếu có) thay vì sửa tay START_FROM_FILE / last_case_id
+  journal = RunJournal(csv_filename, output_filename)
+
+  if not Path(OUTPUT_PATH / output_filename).exists():
+    initOutput(output_filename)
+
+  if not Path(OUTPUT_PATH / csv_filename).exists():
+    initCSV(csv_filename)
+    journal.reset()
+  else:
+    # CSV có dữ liệu mà không có journal (vd. CSV cũ trong outputs/) => JournalMissing, không ghi đè / ghi trùng
+    journal.recover()
+
+  last_case_id = journal.last_case_id or "C0000"
+
+  pending = [f for f in files if not journal.is_done(journal_key(f))]
+  total_files = len(files)
+
+  print(f"{total_files - len(pending)}/{total_files} files already done, resuming after case {last_case_id}")
+
+  if pending and PIPELINE_MODE and ASYNC_MODE:
+    last_case_id = asyncio.run(run_async(pending, csv_filename, output_filename, last_case_id, journal))
+  elif pending and PIPELINE_MODE and STREAM_MODE:
+    last_case_id = run_streaming(pending, csv_filename, output_filename, last_case_id, journal)
+  elif pending and PIPELINE_MODE and BATCH_MODE:
+    last_case_id = run_batched(pending, csv_filename, output_filename, last_case_id, journal)
+  elif pending and PIPELINE_MODE:
+    last_case_id = run_pipelined(pending, csv_filename, output_filename, last_case_id, journal)
+  else:
+    ids = IdAllocator(last_case_id)
+    for i, file in enumerate(pending):
+      print(f"Processing file {total_files - len(pending) + i + 1}/{total_files}: {file.name} ...")
+
+      with get_metrics().file_scope(journal_key(file)):
+        res = readPdf(file.parent, file.name, output_filename, ids.case_id(i))
+
+      if res:
+        write_csv(res, csv_filename)
+        write_output("\n\n", output_filename)
+
+      journal.commit(journal_key(file), ids.case_id(i) if res else None, ids.case_id(i), len(res or []))
+
+def run_study(groups: dict[str, list[Path]]):
+  """
+  Mỗi người (participant trong manifest) 1 lần run_files với output riêng <slug>_dreams.csv.
+  PARTICIPANT_WORKERS người chạy song song, dùng chung scheduler quota của ai_helper.
+  Lỗi của 1 người không dừng những người khác; chạy lại lệnh để resume phần còn dở.
+  Hết quota ngày (DailyQuotaExceeded) thì không bắt đầu thêm người nào nữa.
+  """
+  failed = {}
+  quota_error = None
+  with OutputWriter(), ThreadPoolExecutor(PARTICIPANT_WORKERS) as pool:
+    futures = {
+      slug: _submit_in_context(pool, run_files, files, f"{slug}_dreams.csv", f"output_{slug}_dreams.txt")
+      for slug, files in groups.items()
+    }
+    for slug, fut in futures.items():
+      try:
+        fut.result()
+        print(f"Participant {slug}: done ({len(groups[slug])} files)")
+      except CancelledError:
+        failed[slug] = quota_error
+        print(f"Participant {slug}: not started, daily quota used up")
+      except DailyQuotaExceeded as e:
+        failed[slug] = quota_error = e
+        print(f"Participant {slug}: stopped: {e}")
+        pool.shutdown(wait=False, cancel_futures=True)
+      except Exception as e:
+        failed[slug] = e
+        print(f"Participant {slug}: FAILED: {e!r}")
+  return failed
 
 if __name__ == "__main__":
-  # readPdf(folder / "demo.pdf")
-  data = list()
-  par = str()
-  num_tokens = 0
-  last_case_id = "C0215" # C0001 - C0093 | C0094 - C0176 | C0177
-  now = datetime.now().strftime("%Y%m%d_%H%M%S")
-  count = 0
-  sub_folder = ""
-  is_start = False
-  total_files = sum(1 for _ in INPUT_PATH.rglob("*") if _.is_file())
-
-  CSV_FILENAME = f"clean_{now}_{CHOOSEN_MODEL.value}.csv"
-  CSV_FILENAME = f"test.csv"
-  CSV_FILENAME = f"4_trinh_dreams.csv"
-
-  OUTPUT_FILENAME = f"output_{now}_{CHOOSEN_MODEL.value}.txt"
-  OUTPUT_FILENAME = f"output_test.txt"
-  OUTPUT_FILENAME = f"output_4_trinh_dreams.txt"
-  
-  START_FROM_FILE = "When I was pregnant I had a dream about eating chicken"
-  
-  if(START_FROM_FILE == ""):
-    is_start = True
-
-  if not Path(OUTPUT_PATH / CSV_FILENAME).exists():
-    initCSV(CSV_FILENAME)
-    
-  if not Path(OUTPUT_PATH / OUTPUT_FILENAME).exists():
-    initOutput(OUTPUT_FILENAME)
-
-  for file in INPUT_PATH.rglob("*"):
-    if file.is_dir():
-      # sub_folder = file.name
-      continue
-    
-    count += 1
-    print(f"Processing file {count}/{total_files}: {file.name} ...")
-
-    if not is_start and file.name.find(START_FROM_FILE) >= 0:
-      is_start = True
-      continue
-    
-    if not is_start:
-      print(f"Skipping file {file.name} ...")
-      continue
-        
-    res = readPdf("", file.name, OUTPUT_FILENAME, last_case_id)
-      
-    if not res:
-      continue
-    
-    last_case_id = res[-1].case_id
-        
-    write_csv(res, CSV_FILENAME)
-    write_output("\n\n", OUTPUT_FILENAME)
+  ap = argparse.ArgumentParser(description="Extract dreams from the PDFs in INPUT_PATH into a CSV")
+  ap.add_argument("--model", choices=[m.value for m in all_models()], default=None,
+                  help="model LLM (mặc định: DREAMS_MODEL hoặc CHOOSEN_MODEL trong my_type)")
+  ap.add_argument("--all", action="store_true",
+                  help="mọi người trong DATA_PATH (manifest.py), mỗi người 1 CSV / journal riêng")
+  ap.add_argument("--participant", action="append", default=None,
+                  help="chỉ chạy người này (slug trong manifest, vd. 4_trinh), lặp lại được; ngụ ý --all")
+  args = ap.parse_args()
+  if args.model:
+    set_default_model(parse_model(args.model))
+
+  if args.all or args.participant:
+    # quét DATA_PATH 1 lần (chỉ mở lại PDF mới / đã đổi), rồi chia job theo người
+    groups = {
+      slug: [DATA_PATH / e.path for e in entries]
+      for slug, entries in by_participant(refresh_manifest(), PARTICIPANT_SUBDIR).items()
+      if not args.participant or slug in args.participant
+    }
+    print(f"{len(groups)} participants, {sum(map(len, groups.values()))} files")
+    failed = run_study(groups)
+    report_stem = "study"
+  else:
+    # tên output theo người của INPUT_PATH, vd. data/4. TRINH (19 - 25) 123 Dreams/D -> 4_trinh_dreams.csv
+    slug = participant_for(INPUT_PATH)
+    CSV_FILENAME = f"{slug}_dreams.csv"
+    OUTPUT_FILENAME = f"output_{slug}_dreams.txt"
+
+    # chỉ PDF (như manifest): file khác (.DS_Store, .docx, ...) không được chiếm case_id
+    files = sorted(f for f in INPUT_PATH.rglob("*") if f.is_file() and f.suffix.lower() == ".pdf")
+    failed = {}
+    try:
+      with OutputWriter():
+        run_files(files, CSV_FILENAME, OUTPUT_FILENAME)
+    except DailyQuotaExceeded as e:
+      # file đã xong vẫn nằm trong CSV + journal, các request còn lại đã bị huỷ
+      failed[slug] = e
+      print(f"Stopped: {e}")
+    report_stem = Path(CSV_FILENAME).stem
+
+  if USE_LLM_CACHE:
+    print(f"LLM cache: {get_llm_cache().stats()}")
+
+  if USE_DEDUP:
+    print(f"Dedup: {get_dedup_index().stats()}")
+
+  if USE_LAYOUT_FILTER:
+    print(f"Layout filter total: {total_stats()}")
+
+  # p50 / p95 từng bước => <csv>.metrics.json / .metrics.csv
+  get_metrics().write_report(report_stem)
+
+  if failed:
+    if any(isinstance(e, DailyQuotaExceeded) for e in failed.values()):
+      raise SystemExit(f"Daily quota used up, {len(failed)} participants not finished: {', '.join(failed)}. "
+                       "Run the same command again after the quota resets to resume.")
+    raise SystemExit(f"{len(failed)} participants failed: {', '.join(failed)}")
@@ -0,0 +1,124 @@
+"""
+Manifest (index) của toàn bộ DATA_PATH: quét thư mục 1 lần, mỗi PDF 1 dòng JSONL
+{participant, subdir, path, size, mtime, ids, year, title_pdf, page_count}.
+Lần quét sau chỉ mở lại PDF có size / mtime thay đổi (page_count, parse_filename lấy từ manifest cũ).
+
+    data/<k>. <NAME> (19 - 25) <n> Dreams/<subdir>/<file>.pdf  ->  participant = "<k>_<name>"
+
+    python manifest.py              # quét DATA_PATH, ghi OUTPUT_PATH/manifest.jsonl, in số file / người
+"""
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+from my_type import DATA_PATH, MANIFEST_FILE, OUTPUT_PATH
+from pdf_helper import parse_filename
+
+RX_PARTICIPANT = re.compile(r"^\s*(\d+)\s*[._)-]?\s*([^\(]+)")
+
+@dataclass
+class ManifestEntry:
+    participant: str      # slug, vd. "4_trinh" (tên file output: 4_trinh_dreams.csv)
+    subdir: str           # thư mục con trong folder của người đó, vd. "D" ("" nếu PDF nằm ngay trong folder)
+    path: str             # tương đối so với DATA_PATH (posix)
+    size: int
+    mtime: float
+    ids: List[int]
+    year: Optional[int]
+    title_pdf: str
+    page_count: int
+
+def participant_slug(folder_name: str) -> str:
+    # "4. TRINH (19 - 25) 123 Dreams" -> "4_trinh"
+    m = RX_PARTICIPANT.match(folder_name)
+    name = f"{m.group(1)}_{m.group(2)}" if m else folder_name
+    return re.sub(r"\W+", "_", name.strip().lower()).strip("_")
+
+def participant_for(folder: Path, root: Path = DATA_PATH) -> str:
+    """Slug của người sở hữu folder (vd. INPUT_PATH); ngoài root thì lấy theo tên folder."""
+    try:
+        return participant_slug(folder.relative_to(root).parts[0])
+    except (ValueError, IndexError):
+        return participant_slug(folder.name)
+
+def _page_count(path: Path) -> int:
+    try:
+        with fitz.open(path) as doc:
+            return doc.page_count
+    except Exception as e:
+        print(f"Cannot open {path.name}: {e}")
+        return 0
+
+def build_manifest(root: Path = DATA_PATH, previous: Optional[Dict[str, ManifestEntry]] = None) -> List[ManifestEntry]:
+    """Quét root đúng 1 lần (os.walk), trả về các PDF theo thứ tự (participant, path)."""
+    previous = previous or {}
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.lower().endswith(".pdf"):
+                continue
+            path = Path(dirpath) / name
+            rel = path.relative_to(root)
+            if len(rel.parts) < 2:
+                continue  # PDF nằm ngay trong root, không thuộc người nào
+            st = path.stat()
+            key = rel.as_posix()
+
+            old = previous.get(key)
+            if old is not None and old.size == st.st_size and old.mtime == st.st_mtime:
+                entries.append(old)
+                continue
+
+            ids, year, title_pdf = parse_filename(name)
+            entries.append(ManifestEntry(
+                participant=participant_slug(rel.parts[0]),
+                subdir="/".join(rel.parts[1:-1]),
+                path=key,
+                size=st.st_size,
+                mtime=st.st_mtime,
+                ids=ids,
+                year=year,
+                title_pdf=title_pdf,
+                page_count=_page_count(path),
+            ))
+    entries.sort(key=lambda e: (e.participant, e.path))
+    return entries
+
+def load_manifest(path: Path = OUTPUT_PATH / MANIFEST_FILE) -> Dict[str, ManifestEntry]:
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as f:
+        return {e.path: e for e in (ManifestEntry(**json.loads(line)) for line in f if line.strip())}
+
+def save_manifest(entries: List[ManifestEntry], path: Path = OUTPUT_PATH / MANIFEST_FILE):
+    # ghi file tạm rồi replace: đọc song song không bao giờ thấy manifest ghi dở
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps(asdict(e), ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+def refresh_manifest(root: Path = DATA_PATH, path: Path = OUTPUT_PATH / MANIFEST_FILE) -> List[ManifestEntry]:
+    entries = build_manifest(root, load_manifest(path))
+    save_manifest(entries, path)
+    return entries
+
+def by_participant(entries: List[ManifestEntry], subdir: Optional[str] = None) -> Dict[str, List[ManifestEntry]]:
+    """Nhóm theo người (giữ thứ tự path); subdir != None chỉ lấy PDF trong thư mục con đó (vd. "D")."""
+    groups: Dict[str, List[ManifestEntry]] = {}
+    for e in entries:
+        if subdir is None or e.subdir == subdir:
+            groups.setdefault(e.participant, []).append(e)
+    return groups
+
+if __name__ == "__main__":
+    entries = refresh_manifest()
+    for participant, items in by_participant(entries).items():
+        print(f"{participant}: {len(items)} PDFs, {sum(e.page_count for e in items)} pages, {sum(e.size for e in items) / 1e6:.1f} MB")
+    print(f"Manifest: {len(entries)} PDFs -> {(OUTPUT_PATH / MANIFEST_FILE).as_posix()}")
@@ -1,13 +1,27 @@
+import asyncio
+import os
 from enum import Enum
 from pathlib import Path
 import threading
+from typing import NamedTuple, Optional, Union
 from pydantic import BaseModel
 import time
 from collections import deque
 
 BASE_DIR = Path(__file__).resolve().parent.parent
-INPUT_PATH = BASE_DIR / "data/4. TRINH (19 - 25) 123 Dreams/D"
-OUTPUT_PATH = BASE_DIR / "outputs"
+# DREAMS_INPUT_PATH / DREAMS_OUTPUT_PATH: trỏ sang thư mục khác (vd. bench_pipeline.py chạy trên dữ liệu giả)
+INPUT_PATH = Path(os.getenv("DREAMS_INPUT_PATH") or BASE_DIR / "data/4. TRINH (19 - 25) 123 Dreams/D")
+OUTPUT_PATH = Path(os.getenv("DREAMS_OUTPUT_PATH") or BASE_DIR / "outputs")
+# Toàn bộ dữ liệu (mọi người), dùng cho manifest.py và main.py --all
+DATA_PATH = Path(os.getenv("DREAMS_DATA_PATH") or BASE_DIR / "data")
+MANIFEST_FILE = "manifest.jsonl"
+PARTICIPANT_SUBDIR = "D"  # chỉ xử lý PDF trong thư mục con này của mỗi người (None = tất cả)
+PARTICIPANT_WORKERS = 4   # số người chạy song song trong main.py --all (chung quota của scheduler)
+
+# Hàng đợi job dùng chung cho nhiều worker process / máy (xem work_queue.py)
+QUEUE_FILE = "work_queue.sqlite"
+QUEUE_LEASE_SECONDS = 300  # job không được heartbeat quá lâu thì worker khác lấy lại
+QUEUE_MAX_ATTEMPTS = 3
 
 class GEMINI_MODEL(Enum):
     GEMINI_2_5_FLASH = "gemini-2.5-flash"
@@ -19,14 +33,56 @@ class GROQ_MODEL(Enum):
     LLAMA_3_1_8B_INSTANT = "llama-3.1-8b-instant"
     LLAMA_3_3_70B_VERSATILE = "llama-3.3-70b-versatile"
 
+class ModelQuota(NamedTuple):
+    rpm: int  # requests / phút
+    tpm: int  # tokens / phút (input + output)
+    rpd: int  # requests / ngày
+
+# Quota free tier của từng model
+MODEL_QUOTAS = {
+    GEMINI_MODEL.GEMINI_2_5_FLASH: ModelQuota(10, 250_000, 250),
+    GEMINI_MODEL.GEMINI_2_5_FLASH_LITE: ModelQuota(15, 250_000, 1_000),
+    GEMINI_MODEL.GEMINI_2_0_FLASH_LITE: ModelQuota(30, 1_000_000, 200),
+    GEMINI_MODEL.GEMINI_2_0_FLASH: ModelQuota(15, 1_000_000, 200),
+    GROQ_MODEL.LLAMA_3_1_8B_INSTANT: ModelQuota(30, 6_000, 14_400),
+    GROQ_MODEL.LLAMA_3_3_70B_VERSATILE: ModelQuota(30, 12_000, 1_000),
+}
+
+# DREAMS_QUOTA_SCALE > 1: nới quota khi chạy với server giả (bench_pipeline.py), server tự trả 429 theo rpm của nó
+_QUOTA_SCALE = float(os.getenv("DREAMS_QUOTA_SCALE") or 1)
+if _QUOTA_SCALE != 1:
+    MODEL_QUOTAS = {
+        model: ModelQuota(int(q.rpm * _QUOTA_SCALE), int(q.tpm * _QUOTA_SCALE), int(q.rpd * _QUOTA_SCALE))
+        for model, q in MODEL_QUOTAS.items()
+    }
+
+# Số request / ngày đã dùng của từng model lưu ở OUTPUT_PATH/QUOTA_FILE (cạnh llm_cache), chung cho mọi
+# lần chạy / process; ngày tính theo QUOTA_DAY_TZ (quota ngày của Gemini reset lúc 0h giờ Pacific)
+QUOTA_FILE = "quota_usage.sqlite"
+QUOTA_DAY_TZ = "America/Los_Angeles"
+
+# Số request / phút của từng model
+MODEL_RPM = {model: quota.rpm for model, quota in MODEL_QUOTAS.items()}
+
+class ExtractedDream(BaseModel):
+  # phần LLM trả về (response_schema); case_id / dream_id do id_allocator cấp sau
+  date: str
+  dream_text: str
+  state_of_mind: str
+  notes: str
+
 class Dream(BaseModel):
-  case_id: str
-  dream_id: str
+  case_id: str = ""
+  dream_id: str = ""
   date: str
   dream_text: str
   state_of_mind: str
   notes: str
   
+class BatchDream(ExtractedDream):
+  # vị trí của tài liệu trong request gộp nhiều PDF
+  doc_index: int
+
 # --- Rate limiter chung cho toàn module ---
 class RateLimiter:
     def __init__(self, max_calls: int, period_seconds: float):
@@ -56,5 +112,70 @@ class RateLimiter:
         with self._lock:
             self._calls.append(time.monotonic())
 
+    def _reserve(self) -> float:
+        # Giữ chỗ 1 lần gọi, trả về số giây phải chờ trước khi được gọi
+        with self._lock:
+            now = time.monotonic()
+            while self._calls and (now - self._calls[0]) > self.period:
+                self._calls.popleft()
+
+            start_at = now
+            if len(self._calls) >= self.max_calls:
+                start_at = self._calls[-self.max_calls] + self.period
+            self._calls.append(start_at)
+            return start_at - now
+
+    async def aacquire(self):
+        # Bản async của acquire: không chặn event loop khi phải chờ
+        sleep_for = self._reserve()
+        if sleep_for > 0:
+            await asyncio.sleep(sleep_for)
+
+# Đo thời gian từng bước / token / retry, ghi <csv>.metrics.json|csv cuối mỗi lần chạy (xem run_metrics.py)
+COLLECT_METRICS = True
+
+# Cache kết quả LLM theo nội dung prompt (xem cache_helper.py)
+USE_LLM_CACHE = True
+
+# Lưu text trích từ PDF để lần chạy sau không phải mở lại PDF (xem text_store.py)
+USE_TEXT_STORE = True
+
+# Bỏ span in đậm / màu đánh dấu / in hoa ngay khi đọc PDF, trước khi gửi LLM (xem layout_filter.py)
+USE_LAYOUT_FILTER = False
+
+# PDF trùng nội dung (byte PDF / text đã chuẩn hoá) với 1 file đã trích thì dùng lại kết quả, không gọi LLM
+# USE_NEAR_DEDUP: thêm MinHash cho bản gần trùng (Jaccard shingle >= NEAR_DUP_THRESHOLD), xem dedup_index.py
+USE_DEDUP = True
+USE_NEAR_DEDUP = False
+NEAR_DUP_THRESHOLD = 0.9
+
+# Parser regex trước, chỉ gọi LLM khi điểm tin cậy < ngưỡng (xem rule_extractor.py)
+USE_RULE_EXTRACTOR = True
+RULE_CONFIDENCE_THRESHOLD = 0.8
+
+# Bỏ lời chào / Reviewer's Message khỏi prompt; prompt dài hơn PROMPT_TOKEN_BUDGET token (ước lượng)
+# được chia thành nhiều request tại ranh giới giấc mơ (xem prompt_budget.py)
+USE_PROMPT_BUDGET = True
+PROMPT_TOKEN_BUDGET = 3000
+
+# Thử lại request LLM khi gặp lỗi tạm thời (429, 5xx, timeout), xem retry_policy.py
+LLM_MAX_ATTEMPTS = 5
+LLM_BACKOFF_BASE = 1.0      # giây, nhân đôi mỗi lần thử (có jitter)
+LLM_BACKOFF_MAX = 60.0
+LLM_CALL_TIMEOUT = 120.0    # giây / request (timeout của client)
+LLM_TOTAL_DEADLINE = 600.0  # giây cho cả chuỗi thử lại của 1 prompt
+
+# Gửi thêm 1 bản sao khi request chạy lâu hơn p95 (HEDGE_QUANTILE) của HEDGE_MIN_SAMPLES request gần nhất
+USE_HEDGING = False  # tốn thêm quota cho bản sao, bật khi độ trễ đuôi đáng kể
+HEDGE_MIN_SAMPLES = 20
+HEDGE_QUANTILE = 95
+
+# Gộp nhiều PDF ngắn vào 1 request, tối đa ~ số token này / request
+BATCH_TOKEN_BUDGET = 6000
+
+# Model mặc định; đổi theo lần chạy bằng DREAMS_MODEL=... hoặc main.py --model ... (xem providers.py)
 # CHOOSEN_MODEL = GROQ_MODEL.LLAMA_3_1_8B_INSTANT
 CHOOSEN_MODEL = GEMINI_MODEL.GEMINI_2_5_FLASH_LITE
+
+# Model phụ: nhận bớt request khi model chính hết quota / phải chờ lâu (None = tắt)
+FALLBACK_MODEL: Optional[Union[GEMINI_MODEL, GROQ_MODEL]] = None
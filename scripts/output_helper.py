@@ -1,7 +1,14 @@
 from pathlib import Path
-from openpyxl import Workbook
 import csv
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional, Union
 from my_type import OUTPUT_PATH, Dream
+from dream_batch import DreamBatch
+from run_metrics import get_metrics
+from text_normalizer import clean_dream_text
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -10,6 +17,8 @@ CSV_FILE = Path(OUTPUT_PATH / "clean.csv")
 CSV_FIELDNAMES = ["case_id", "dream_id", "date", "dream_text", "state_of_mind", "notes"]
 
 def write_excel(file_name: str, data: list):
+  from openpyxl import Workbook  # chỉ cần khi xuất Excel
+
   # Tạo workbook mới
   wb = Workbook()
   ws = wb.active
@@ -23,13 +32,102 @@ def write_excel(file_name: str, data: list):
   wb.save(f"{OUTPUT_PATH/file_name}.xlsx")
   print(f"Excel file created: {OUTPUT_PATH/file_name}.xlsx")  
  
-def write_csv(rows: list[Dream], file_name: str ):     
+class OutputWriter:
+  """
+  Giữ 1 file handle (có buffer) cho mỗi file output thay vì mở / đóng / print mỗi lần ghi.
+  Buffer được flush định kỳ (flush_interval giây) hoặc khi gọi flush(); fsync chỉ ở checkpoint().
+  Dùng như context manager: trong khối with, write_output / write_csv đi qua writer này.
+
+    with OutputWriter():
+      write_csv(rows, "clean.csv")
+  """
+
+  def __init__(self, flush_interval: float = 2.0, buffer_size: int = 1 << 16):
+    self.flush_interval = flush_interval
+    self.buffer_size = buffer_size
+    self._handles = {}
+    self._lock = threading.Lock()
+    self._last_flush = time.monotonic()
+    self._previous: Optional["OutputWriter"] = None
+
+  def _handle(self, file_name: str):
+    f = self._handles.get(file_name)
+    if f is None:
+      f = open(OUTPUT_PATH / file_name, "a", encoding="utf-8", newline="", buffering=self.buffer_size)
+      self._handles[file_name] = f
+    return f
+
+  def _maybe_flush(self):
+    now = time.monotonic()
+    if now - self._last_flush >= self.flush_interval:
+      for f in self._handles.values():
+        f.flush()
+      self._last_flush = now
+
+  def write(self, text: str, file_name: str):
+    with self._lock:
+      self._handle(file_name).write(text)
+      self._maybe_flush()
+
+  def write_rows(self, rows: Iterable[dict], file_name: str):
+    with self._lock:
+      writer = csv.DictWriter(self._handle(file_name), fieldnames=CSV_FIELDNAMES)
+      writer.writerows(rows)
+      self._maybe_flush()
+
+  def flush(self, *file_names: str):
+    with self._lock:
+      for name in file_names or list(self._handles):
+        if name in self._handles:
+          self._handles[name].flush()
+
+  def checkpoint(self, *file_names: str):
+    """flush + fsync: sau lời gọi này dữ liệu đã nằm trên đĩa (dùng trước khi ghi journal)."""
+    with self._lock:
+      for name in file_names or list(self._handles):
+        f = self._handles.get(name)
+        if f is not None:
+          f.flush()
+          os.fsync(f.fileno())
+
+  def close(self):
+    with self._lock:
+      for f in self._handles.values():
+        f.close()
+      self._handles.clear()
+
+  def __enter__(self):
+    global _active_writer
+    self._previous, _active_writer = _active_writer, self
+    return self
+
+  def __exit__(self, *exc):
+    global _active_writer
+    self.checkpoint()
+    self.close()
+    _active_writer = self._previous
+    return False
+
+_active_writer: Optional[OutputWriter] = None
+
+def checkpoint_outputs(*file_names: str):
+  # Không có writer đang chạy thì mỗi lần ghi đã tự đóng file, không cần làm gì
+  if _active_writer is not None:
+    _active_writer.checkpoint(*file_names)
+
+def write_csv(rows: Union[list[Dream], DreamBatch], file_name: str ):     
   csv_file = Path(OUTPUT_PATH / file_name)   
-  rows = [r.model_dump() for r in rows]
+  # DreamBatch: ghi thẳng từ các cột, không model_dump từng dòng
+  rows = rows.iter_dicts() if isinstance(rows, DreamBatch) else [r.model_dump() for r in rows]
 
-  with csv_file.open(mode="a", encoding="utf-8", newline="") as f:
-    writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES)
-    writer.writerows(rows)
+  with get_metrics().span("csv_write"):
+    if _active_writer is not None:
+      _active_writer.write_rows(rows, file_name)
+      return
+
+    with csv_file.open(mode="a", encoding="utf-8", newline="") as f:
+      writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES)
+      writer.writerows(rows)
   print(f"Output written to {csv_file.as_posix()}")
 
 def initOutput(file_name):
@@ -47,13 +145,142 @@ def initCSV(file_name):
 
 def read_rows():
   """Returns a list of dicts (each row keyed by FIELDNAMES)."""
-  if not CSV_FILE.exists() or CSV_FILE.stat().st_size == 0:
-    return [] 
-  with CSV_FILE.open(mode="r", encoding="utf-8", newline="") as f:
-    reader = csv.DictReader(f)
-    return list(reader)
+  return list(iter_rows([CSV_FILE]))
+
+def resolve_csv_paths(paths: Optional[Iterable[Union[str, Path]]] = None) -> list[Path]:
+  """Tên file / glob (tương đối với OUTPUT_PATH) hoặc đường dẫn -> list Path, mặc định clean.csv."""
+  if paths is None:
+    return [CSV_FILE]
+  out = []
+  for p in [paths] if isinstance(paths, (str, Path)) else paths:
+    p = Path(p)
+    base = p if p.is_absolute() else OUTPUT_PATH / p
+    if any(ch in p.name for ch in "*?["):
+      out.extend(sorted(base.parent.glob(base.name)))
+    else:
+      out.append(base)
+  return out
+
+def participant_of(csv_path: Path) -> str:
+  # "4_trinh_dreams.csv" -> "4_trinh"
+  stem = Path(csv_path).stem
+  return stem[:-len("_dreams")] if stem.endswith("_dreams") else stem
+
+def _match(value: str, wanted) -> bool:
+  if wanted is None:
+    return True
+  if callable(wanted):
+    return bool(wanted(value))
+  if isinstance(wanted, str):
+    return value == wanted
+  return value in wanted
+
+def iter_rows(paths: Optional[Iterable[Union[str, Path]]] = None,
+              case_id: Union[str, Iterable[str], Callable[[str], bool], None] = None,
+              date: Union[str, Iterable[str], Callable[[str], bool], None] = None,
+              participant: Optional[str] = None) -> Iterator[dict]:
+  """
+  Đọc lần lượt từng dòng của 1 hay nhiều CSV output (generator, không giữ cả file trong bộ nhớ).
+  case_id / date: 1 giá trị, tập giá trị, hoặc hàm kiểm tra. participant so với tên file
+  (xem participant_of), không phân biệt hoa thường.
+  """
+  for path in resolve_csv_paths(paths):
+    if participant is not None and participant_of(path).lower() != participant.lower():
+      continue
+    if not path.exists() or path.stat().st_size == 0:
+      continue
+    with path.open(mode="r", encoding="utf-8", newline="") as f:
+      for row in csv.DictReader(f):
+        if _match(row.get("case_id", ""), case_id) and _match(row.get("date", ""), date):
+          yield row
+
+def iter_batches(paths: Optional[Iterable[Union[str, Path]]] = None, batch_size: int = 10_000, **filters) -> Iterator[DreamBatch]:
+  """Như iter_rows nhưng gom thành DreamBatch (theo cột) tối đa batch_size dòng, cho các lượt xử lý hàng loạt."""
+  rows = []
+  for row in iter_rows(paths, **filters):
+    rows.append(row)
+    if len(rows) >= batch_size:
+      yield DreamBatch.from_rows(rows)
+      rows.clear()
+  if rows:
+    yield DreamBatch.from_rows(rows)
+
+def _dedup_key(date: str, dream_text: str) -> bytes:
+  # cùng 1 giấc mơ ở nhiều lần chạy: trùng date + dream_text (bỏ khác biệt khoảng trắng / hoa thường)
+  text = " ".join(dream_text.split()).lower()
+  return hashlib.blake2b(f"{date}\x00{text}".encode("utf-8"), digest_size=16).digest()
+
+def merge_csv(paths: Iterable[Union[str, Path]], out_file_name: str, dedup: bool = True, clean: bool = False,
+              batch_size: int = 10_000, **filters) -> int:
+  """
+  Gộp nhiều CSV output thành 1 file, giữ thứ tự đọc. Đọc / ghi theo DreamBatch (tối đa batch_size dòng
+  trong bộ nhớ); khi dedup chỉ lưu thêm 16 byte hash cho mỗi giấc mơ khác nhau.
+  clean=True: chạy lại clean_dream_text trên cột dream_text (vd. sau khi đổi text_normalizer).
+  Trả về số dòng đã ghi.
+  """
+  out_path = OUTPUT_PATH / out_file_name
+  seen = set()
+  written = 0
+  with out_path.open("w", encoding="utf-8", newline="") as f:
+    writer = csv.writer(f)
+    writer.writerow(CSV_FIELDNAMES)
+    for batch in iter_batches(paths, batch_size, **filters):
+      if clean:
+        batch.apply("dream_text", clean_dream_text)
+      if dedup:
+        keep = []
+        for i, key in enumerate(map(_dedup_key, batch.column("date"), batch.column("dream_text"))):
+          if key not in seen:
+            seen.add(key)
+            keep.append(i)
+        if len(keep) < len(batch):
+          batch = batch.take(keep)
+      writer.writerows(batch.iter_tuples(CSV_FIELDNAMES))
+      written += len(batch)
+  print(f"Merged {written} rows into {out_path.as_posix()}")
+  return written
+
+def export_columnar(paths: Iterable[Union[str, Path]], out_file_name: str, batch_size: int = 10_000, **filters) -> int:
+  """
+  Xuất CSV output sang Parquet (cần pyarrow) theo từng batch, thêm cột participant.
+  Đuôi .feather / .arrow => ghi Arrow IPC thay cho Parquet.
+  """
+  try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+  except ImportError as e:
+    raise ImportError("export_columnar cần pyarrow: pip install pyarrow") from e
+
+  fields = CSV_FIELDNAMES + ["participant"]
+  schema = pa.schema([(name, pa.string()) for name in fields])
+  out_path = OUTPUT_PATH / out_file_name
+  is_arrow = out_path.suffix in (".feather", ".arrow")
+  sink = pa.ipc.new_file(str(out_path), schema) if is_arrow else pq.ParquetWriter(str(out_path), schema)
+
+  written = 0
+  try:
+    for path in resolve_csv_paths(paths):
+      who = participant_of(path)
+      # DreamBatch đã theo cột: mỗi cột -> 1 pa.array
+      for dreams in iter_batches([path], batch_size, **filters):
+        columns = {**dreams.columns, "participant": [who] * len(dreams)}
+        batch = pa.record_batch([pa.array(columns[name], pa.string()) for name in fields], schema=schema)
+        if is_arrow:
+          sink.write_batch(batch)
+        else:
+          sink.write_table(pa.Table.from_batches([batch]))
+        written += batch.num_rows
+  finally:
+    sink.close()
+
+  print(f"Exported {written} rows to {out_path.as_posix()}")
+  return written
   
 def write_output(text: str, file_name: str = "output"):
+  if _active_writer is not None:
+    _active_writer.write(text, file_name)
+    return
+
   output_path = OUTPUT_PATH / file_name
   with open(output_path, "a", encoding="utf-8") as f:
     f.write(text)
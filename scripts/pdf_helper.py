@@ -1,90 +1,352 @@
-from collections import Counter
-import math
+import asyncio
+import hashlib
 from pathlib import Path
 import re
-import unicodedata as ud
 
-from typing import Iterable, List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, NamedTuple, Optional, Tuple
 
-from annotated_types import doc
 import fitz  # PyMuPDF
 
 from output_helper import write_output  # PyMuPDF
 
-from my_type import CHOOSEN_MODEL, INPUT_PATH, Dream
-from ai_helper import gemini_prompt, groq_prompt
-
-def readPdf(sub_folder, file_name, output_file_name, last_case_id="D0000") -> List[Dream]:
-    id, file_path, date_from_filename, title_guess, dream_text, error = (None, None, None, None, None, None)
+from my_type import INPUT_PATH, PROMPT_TOKEN_BUDGET, RULE_CONFIDENCE_THRESHOLD, USE_DEDUP, USE_LAYOUT_FILTER, USE_LLM_CACHE, USE_NEAR_DEDUP, USE_PROMPT_BUDGET, USE_RULE_EXTRACTOR, USE_TEXT_STORE, Dream
+from ai_helper import BATCH_INSTRUCTION_VERSION, INSTRUCTION_VERSION, allm_prompt, estimate_tokens, llm_batch_prompt, llm_prompt, llm_prompt_stream
+from cache_helper import LLMCache, get_llm_cache
+from dedup_index import content_key, file_sha256, get_dedup_index
+from id_allocator import stamp_ids
+from layout_filter import LAYOUT_FILTER_VERSION, filter_document, record_stats
+from prompt_budget import PROMPT_BUDGET_VERSION, drop_boilerplate, merge_chunk_dreams, split_at_dreams
+from providers import current_model
+from rule_extractor import extract_with_confidence
+from run_metrics import get_metrics
+from style_index import PageStyleIndex
+from text_normalizer import clean_dream_text, extract_clean_block, normalize_prompt
+from text_store import get_text_store
+
+class PdfPrompt(NamedTuple):
+    text: str             # prompt gửi cho LLM (đã làm sạch, 1 dòng)
+    title_pdf: str
+    block: Optional[str]  # đoạn Date of dream -> Revision còn giữ xuống dòng (cho rule_extractor)
+    chunks: Tuple[str, ...] = ()  # prompt vượt PROMPT_TOKEN_BUDGET: các phần gửi riêng (prompt_budget)
+    content_key: str = ""         # hash text đã chuẩn hoá (dedup_index), "" nếu không có block
+    pdf_hash: str = ""            # sha256 byte của file PDF (chỉ khi USE_DEDUP)
+
+def readPdf(sub_folder, file_name, output_file_name, case_id="C0001") -> List[Dream]:
+    prompt = build_prompt_text(sub_folder, file_name, output_file_name)
+
+    return stamp_ids(hybrid_filter_dream_text(prompt, output_file_name), case_id)
+
+def build_prompt_text(sub_folder, file_name, output_file_name) -> PdfPrompt:
+    """
+    Phần chỉ đọc PDF của readPdf (không gọi LLM), để pipeline trong main.py
+    có thể chạy bước PyMuPDF song song với các lần gọi LLM.
+    """
     file_path: Path = INPUT_PATH / sub_folder / file_name
-    doc = fitz.open(file_path)
-    id, date_from_filename, title_pdf = parse_filename(file_name)
-    pdf_text_list = []
-    text = ""
-    is_not_dream_text = False
-    
-    # for i,page in enumerate(doc):
-    #     data = page.get_text("dict")  # structured: blocks -> lines -> spans
-    #     for block in data.get("blocks", []):
-    #         if "lines" not in block:       # skip image blocks, etc.
-    #             continue
-    #         for line in block["lines"]:
-    #             if len(pdf_text_list) > 0 and pdf_text_list[-1] != '\xa0':
-    #                 pdf_text_list.append(".")
-    #             for span in line["spans"]:
-    #                 text  = span["text"]
-    #                 flags = span.get("flags", 0)
-    #                 is_bold   = bool(flags & 16)
-    #                 is_italic = bool(flags & 2)
-    #                 srgb = span.get("color", 0)
-    #                 hex_rgb = f"#{srgb:06x}"
-                    
-    #                 # if hex_rgb == "#c216c2" or hex_rgb == "#ffffff":
-    #                 #     is_not_dream_text = not is_not_dream_text
-    #                 #     continue                                
-                    
-    #                 if is_all_caps(text):
-    #                     continue
-                    
-    #                 if is_not_dream_text:                                        
-    #                     continue
-                    
-    #                 write_output(str({
-    #                     "text": text,
-    #                     "font": span.get("font"),
-    #                     "size": span.get("size"),
-    #                     "color": hex_rgb,
-    #                 }) + "\n", output_file_name)
-                    
-    #                 if hex_rgb == "#000000":
-    #                     pdf_text_list.append(text)
-                        
-    
-    # write_output("".join(pdf_text_list), output_file_name)
-    
-    for i, page in enumerate(doc): text += page.get_text()
-        
-    text = extract_clean_block(text)    
+    _, _, title_pdf = parse_filename(file_name)
 
-    text = f"title_pdf: {title_pdf}. last case id: {last_case_id}. PDF text: {text}"
+    _, block, pdf_hash = load_pdf_text(file_path)
 
-    text = clean_dream_text(text)
-    
-    text = remove_dash_bracket_blocks(text)
+    with get_metrics().span("prompt"):
+        prompt = prompt_from_block(block, title_pdf, pdf_hash if USE_DEDUP else "")
 
-    write_output(text, output_file_name)
+    write_output(prompt.text, output_file_name)
     
-    return llm_filter_dream_text(text, output_file_name, title_pdf)
+    return prompt
+
+def load_pdf_text(file_path: Path) -> Tuple[List[str], Optional[str], str]:
+    """
+    Trả về (text từng trang, block Date of dream -> Revision, sha256 byte của PDF).
+    Đọc từ text_store nếu PDF chưa đổi kể từ lần trích trước (kể cả sha256, không đọc lại file),
+    nếu không thì đọc file 1 lần, vừa hash vừa mở bằng PyMuPDF.
+    sha256 là "" khi entry cũ của text_store chưa có và USE_DEDUP tắt.
+    USE_LAYOUT_FILTER: bỏ phần in đậm / màu đánh dấu / in hoa ngay ở bước này (layout_filter).
+    """
+    metrics = get_metrics()
+    variant = f"layout{LAYOUT_FILTER_VERSION}" if USE_LAYOUT_FILTER else ""
+    with metrics.span("text_store"):
+        stored = get_text_store().get(file_path, CLEANER_VERSION, variant) if USE_TEXT_STORE else None
+    if stored is not None:
+        with metrics.span("clean"):
+            block = stored.block if stored.block_valid else extract_clean_block("".join(stored.pages))
+        return stored.pages, block, stored.sha256 or (file_sha256(file_path) if USE_DEDUP else "")
+
+    with metrics.span("pdf_open"):
+        data = Path(file_path).read_bytes()
+        pdf_hash = hashlib.sha256(data).hexdigest()
+        doc = fitz.open(stream=data, filetype="pdf")
+    with doc, metrics.span("pdf_text"):
+        if USE_LAYOUT_FILTER:
+            pages, stats = filter_document(doc)
+            record_stats(stats)
+            print(f"Layout filter {file_path.name}: {stats}")
+        else:
+            pages = [page.get_text() for page in doc]
+    with metrics.span("clean"):
+        block = extract_clean_block("".join(pages))
+
+    if USE_TEXT_STORE:
+        get_text_store().put(file_path, pages, block, CLEANER_VERSION, variant, pdf_hash)
+    return pages, block, pdf_hash
+
+def prompt_from_text(text: str, title_pdf: str) -> PdfPrompt:
+    """Từ text thô của PDF -> prompt gửi LLM (không đụng tới file / PyMuPDF)."""
+    return prompt_from_block(extract_clean_block(text), title_pdf)
+
+def prompt_from_block(block: Optional[str], title_pdf: str, pdf_hash: str = "") -> PdfPrompt:
+    text = block
+    if USE_PROMPT_BUDGET and block:
+        text, _ = drop_boilerplate(block)
+
+    # không có case id: ID do id_allocator cấp sau, prompt của 1 PDF luôn giống nhau (cache / dedup)
+    head = f"title_pdf: {title_pdf}. PDF text: "
+
+    prompt = normalize_prompt(f"{head}{text}")
+
+    chunks = ()
+    if USE_PROMPT_BUDGET and block and estimate_tokens(prompt) > PROMPT_TOKEN_BUDGET:
+        parts = split_at_dreams(text, PROMPT_TOKEN_BUDGET)
+        if len(parts) > 1:
+            chunks = tuple(normalize_prompt(f"{head}{part}") for part in parts)
+
+    return PdfPrompt(prompt, title_pdf, block, chunks, content_key(text) if USE_DEDUP and text else "", pdf_hash)
+
+def rule_filter_dream_text(prompt: PdfPrompt) -> Optional[List[Dream]]:
+    """Parser regex (rule_extractor); None nếu tắt hoặc điểm tin cậy dưới ngưỡng."""
+    if not USE_RULE_EXTRACTOR or not prompt.block:
+        return None
+
+    result = extract_with_confidence(prompt.block, prompt.title_pdf)
+    if result.confidence < RULE_CONFIDENCE_THRESHOLD:
+        return None
+
+    return update_dreams([
+        Dream(
+            date=result.date or "",
+            dream_text=r.dream_text,
+            state_of_mind=result.state_of_mind or "",
+            notes=r.notes,
+        )
+        for r in result.rows
+    ])
+
+def _dedup_namespace(instruction_version: str = INSTRUCTION_VERSION) -> str:
+    # mọi thiết lập làm đổi text / prompt của cùng 1 PDF: đổi 1 cái thì không dùng lại kết quả cũ
+    layout = f"layout{LAYOUT_FILTER_VERSION}" if USE_LAYOUT_FILTER else "nolayout"
+    budget = f"budget{PROMPT_BUDGET_VERSION}.{PROMPT_TOKEN_BUDGET}" if USE_PROMPT_BUDGET else "nobudget"
+    return f"{current_model().value}:{instruction_version}:cleaner{CLEANER_VERSION}:{layout}:{budget}"
+
+def dedup_lookup(prompt: PdfPrompt, OUTPUT_FILENAME: str, instruction_version: str = INSTRUCTION_VERSION) -> Optional[List[Dream]]:
+    """Kết quả của 1 PDF trùng nội dung đã trích trước đó (đóng dấu lại notes), None nếu chưa có."""
+    if not USE_DEDUP or not prompt.content_key:
+        return None
+    with get_metrics().span("dedup"):
+        hit = get_dedup_index().lookup(_dedup_namespace(instruction_version), prompt.pdf_hash, prompt.content_key,
+                                       prompt.text if USE_NEAR_DEDUP else None)
+    if hit is None:
+        return None
+    write_output(f"\n[duplicate:{hit.kind}] of {hit.source_title}, {len(hit.dreams)} dreams, LLM skipped\n", OUTPUT_FILENAME)
+    return [d.model_copy(update={"notes": f"From PDF: {prompt.title_pdf}"}) for d in hit.dreams]
+
+def dedup_record(prompt: PdfPrompt, data: List[Dream], instruction_version: str = INSTRUCTION_VERSION):
+    # không lưu kết quả rỗng: có thể là lỗi của lần gọi đó
+    if USE_DEDUP and prompt.content_key and data:
+        get_dedup_index().record(_dedup_namespace(instruction_version), prompt.pdf_hash, prompt.content_key, prompt.title_pdf, data,
+                                 prompt.text if USE_NEAR_DEDUP else None)
+
+def _llm_filter_prompt(prompt: PdfPrompt, OUTPUT_FILENAME: str) -> List[Dream]:
+    if prompt.chunks:
+        return merge_chunk_dreams(llm_filter_dream_text(c, OUTPUT_FILENAME, prompt.title_pdf) for c in prompt.chunks)
+    return llm_filter_dream_text(prompt.text, OUTPUT_FILENAME, prompt.title_pdf)
+
+def hybrid_filter_dream_text(prompt: PdfPrompt, OUTPUT_FILENAME: str) -> List[Dream]:
+    """
+    Thử parser regex trước, rồi kết quả của PDF trùng nội dung, chỉ gọi LLM khi cả 2 không có.
+    Dream trả về chưa có case_id / dream_id: người gọi đóng dấu bằng id_allocator theo thứ tự input.
+    """
+    with get_metrics().span("rule"):
+        data = rule_filter_dream_text(prompt)
+    if data is not None:
+        write_output(f"\n[rule-based] {len(data)} dreams, LLM skipped\n", OUTPUT_FILENAME)
+        return data
+
+    if not USE_DEDUP or not prompt.content_key:
+        return _llm_filter_prompt(prompt, OUTPUT_FILENAME)
+
+    # bản trùng đang chạy song song (pipeline) chờ bản đầu tiên xong rồi dùng lại kết quả
+    with get_dedup_index().lock_for(prompt.content_key):
+        data = dedup_lookup(prompt, OUTPUT_FILENAME)
+        if data is None:
+            data = _llm_filter_prompt(prompt, OUTPUT_FILENAME)
+            dedup_record(prompt, data)
+    return data
+
+async def _allm_filter_prompt(prompt: PdfPrompt, OUTPUT_FILENAME: str) -> List[Dream]:
+    if prompt.chunks:
+        parts = await asyncio.gather(*(allm_filter_dream_text(c, OUTPUT_FILENAME, prompt.title_pdf) for c in prompt.chunks))
+        return merge_chunk_dreams(parts)
+    return await allm_filter_dream_text(prompt.text, OUTPUT_FILENAME, prompt.title_pdf)
+
+async def ahybrid_filter_dream_text(prompt: PdfPrompt, OUTPUT_FILENAME: str) -> List[Dream]:
+    with get_metrics().span("rule"):
+        data = rule_filter_dream_text(prompt)
+    if data is not None:
+        write_output(f"\n[rule-based] {len(data)} dreams, LLM skipped\n", OUTPUT_FILENAME)
+        return data
+
+    if not USE_DEDUP or not prompt.content_key:
+        return await _allm_filter_prompt(prompt, OUTPUT_FILENAME)
+
+    # như hybrid_filter_dream_text: bản trùng đang chạy song song chờ bản đầu tiên
+    async with get_dedup_index().alock_for(prompt.content_key):
+        data = dedup_lookup(prompt, OUTPUT_FILENAME)
+        if data is None:
+            data = await _allm_filter_prompt(prompt, OUTPUT_FILENAME)
+            dedup_record(prompt, data)
+    return data
 
 def llm_filter_dream_text(dream_text: str, OUTPUT_FILENAME: str, title_pdf: str) -> str:    
-    
-    data = gemini_prompt(dream_text, OUTPUT_FILENAME, CHOOSEN_MODEL)
-    # data = groq_prompt(dream_text, OUTPUT_FILENAME, CHOOSEN_MODEL, title_pdf)
+    model = current_model()
+    cache_key = LLMCache.make_key(dream_text, model, INSTRUCTION_VERSION)
+    data = get_llm_cache().get(cache_key) if USE_LLM_CACHE else None
+
+    if data is None:
+        data = llm_prompt(dream_text, OUTPUT_FILENAME, model, title_pdf)
+        if USE_LLM_CACHE:
+            get_llm_cache().put(cache_key, model, data)
         
     data = update_dreams(data)
 
     return data
 
+def _tee(stream, sink: List[Dream]):
+    # yield lại từng Dream (đã clean như update_dreams), giữ bản gốc trong sink; trả về giá trị return của stream
+    while True:
+        try:
+            d = next(stream)
+        except StopIteration as stop:
+            return stop.value
+        sink.append(d)
+        yield d.model_copy(update={"dream_text": clean_dream_text(d.dream_text)})
+
+def llm_filter_dream_stream(dream_text: str, OUTPUT_FILENAME: str, title_pdf: str) -> Iterator[Dream]:
+    """Bản stream của llm_filter_dream_text; chỉ cache khi response đầy đủ."""
+    model = current_model()
+    cache_key = LLMCache.make_key(dream_text, model, INSTRUCTION_VERSION)
+    data = get_llm_cache().get(cache_key) if USE_LLM_CACHE else None
+    if data is not None:
+        yield from update_dreams(data)
+        return
+
+    raw: List[Dream] = []
+    complete = yield from _tee(llm_prompt_stream(dream_text, OUTPUT_FILENAME, model, title_pdf), raw)
+    if complete and USE_LLM_CACHE:
+        get_llm_cache().put(cache_key, model, raw)
+
+def hybrid_filter_dream_stream(prompt: PdfPrompt, OUTPUT_FILENAME: str) -> Iterator[Dream]:
+    """Như hybrid_filter_dream_text nhưng yield từng Dream ngay khi LLM trả về object của nó."""
+    with get_metrics().span("rule"):
+        data = rule_filter_dream_text(prompt)
+    if data is not None:
+        write_output(f"\n[rule-based] {len(data)} dreams, LLM skipped\n", OUTPUT_FILENAME)
+        yield from data
+        return
+
+    # stream chỉ dùng lại kết quả trùng, không ghi (response có thể bị cắt giữa chừng)
+    data = dedup_lookup(prompt, OUTPUT_FILENAME)
+    if data is not None:
+        yield from data
+        return
+
+    for text in prompt.chunks or (prompt.text,):
+        yield from llm_filter_dream_stream(text, OUTPUT_FILENAME, prompt.title_pdf)
+
+def build_batch_prompt(prompts: List[str]) -> str:
+    return "\n\n".join(f"### DOCUMENT {i}\n{prompt}" for i, prompt in enumerate(prompts))
+
+def llm_filter_dream_batch(docs: List[PdfPrompt], OUTPUT_FILENAME: str) -> List[List[Dream]]:
+    """
+    docs: list PdfPrompt như build_prompt_text trả về.
+    Gửi các tài liệu chưa có trong cache bằng 1 request duy nhất rồi tách kết quả
+    về từng tài liệu theo doc_index. Trả về list Dream cho mỗi tài liệu, đúng thứ tự.
+    """
+    results: List[Optional[List[Dream]]] = [None] * len(docs)
+    model = current_model()
+    # key theo BATCH_INSTRUCTION_VERSION: kết quả batch không dùng chung cache với đường từng file
+    keys = [LLMCache.make_key(doc.text, model, BATCH_INSTRUCTION_VERSION) for doc in docs]
+
+    # PDF trùng nội dung đã trích trước đó: dùng lại (đã clean), case_id / dream_id do main.py đóng dấu
+    deduped = {}
+    for i, doc in enumerate(docs):
+        data = dedup_lookup(doc, OUTPUT_FILENAME, BATCH_INSTRUCTION_VERSION)
+        if data is not None:
+            deduped[i] = data
+
+    if USE_LLM_CACHE:
+        for i, key in enumerate(keys):
+            if i not in deduped:
+                results[i] = get_llm_cache().get(key)
+
+    # trong cùng batch, bản trùng chỉ gửi 1 lần
+    first_of: Dict[str, int] = {}
+    copies: Dict[int, int] = {}
+    misses = []
+    for i, r in enumerate(results):
+        if r is not None or i in deduped:
+            continue
+        dup_key = docs[i].content_key or keys[i]
+        if dup_key in first_of:
+            copies[i] = first_of[dup_key]
+        else:
+            first_of[dup_key] = i
+            misses.append(i)
+
+    if misses:
+        data = llm_batch_prompt(build_batch_prompt([docs[i].text for i in misses]), OUTPUT_FILENAME, model)
+
+        per_doc: Dict[int, List[Dream]] = {k: [] for k in range(len(misses))}
+        for d in data:
+            if d.doc_index not in per_doc:
+                print(f"Batch response has unknown doc_index {d.doc_index}, skipping dream")
+                continue
+            per_doc[d.doc_index].append(Dream(**d.model_dump(exclude={"doc_index"})))
+
+        for k, i in enumerate(misses):
+            results[i] = per_doc[k]
+            # không cache kết quả rỗng: có thể LLM bỏ sót tài liệu trong batch
+            if USE_LLM_CACHE and per_doc[k]:
+                get_llm_cache().put(keys[i], model, per_doc[k])
+
+    out = []
+    for i, doc in enumerate(docs):
+        if i in deduped:
+            out.append(deduped[i])
+            continue
+        data = update_dreams(results[copies.get(i, i)])
+        if i in copies:
+            data = [d.model_copy(update={"notes": f"From PDF: {doc.title_pdf}"}) for d in data]
+        else:
+            dedup_record(doc, data, BATCH_INSTRUCTION_VERSION)
+        out.append(data)
+    return out
+
+async def areadPdf(sub_folder, file_name, output_file_name, case_id="C0001") -> List[Dream]:
+    # Bước PyMuPDF chạy trên thread riêng để không chặn event loop
+    prompt = await asyncio.to_thread(build_prompt_text, sub_folder, file_name, output_file_name)
+
+    return stamp_ids(await ahybrid_filter_dream_text(prompt, output_file_name), case_id)
+
+async def allm_filter_dream_text(dream_text: str, OUTPUT_FILENAME: str, title_pdf: str) -> List[Dream]:
+    model = current_model()
+    cache_key = LLMCache.make_key(dream_text, model, INSTRUCTION_VERSION)
+    data = get_llm_cache().get(cache_key) if USE_LLM_CACHE else None
+
+    if data is None:
+        data = await allm_prompt(dream_text, OUTPUT_FILENAME, model, title_pdf)
+        if USE_LLM_CACHE:
+            get_llm_cache().put(cache_key, model, data)
+
+    return update_dreams(data)
+
 def parse_filename(file_name: str):
 
     # Bỏ đuôi .pdf (nếu có)
@@ -132,91 +394,8 @@ def parse_filename(file_name: str):
 
     return ids, year, title_guess
 
-def extract_clean_block(text: str, remove_noise=True):
-    """
-    Trả về đoạn từ 'Date of dream|Dream date' đến trước 'Revision|student note|Student mark'.
-    Nếu remove_noise=True, sẽ cắt bỏ khúc nhiễu ( (https... ) -> ... -> dòng '1/2' ).
-    """
-    if not text:
-        return None
-    
-    # Regex marker (không phân biệt hoa thường, theo dòng)
-    RX_START = re.compile(r'(?im)^\s*(?:Date of dream|Dream date)\s*:?.*$')
-    RX_STOP  = re.compile(r'(?im)^\s*(?:Revision|student note|Student mark)\b.*$')
-
-    # 1) Xác định điểm bắt đầu
-    m_start = RX_START.search(text)
-    if not m_start:
-        return None
-    start_idx = m_start.start()
-
-    # 2) Xác định điểm dừng
-    m_stop = RX_STOP.search(text, start_idx)
-    end_idx = m_stop.start() if m_stop else len(text)
-
-    block = text[start_idx:end_idx]
-
-    # 3) (Tuỳ chọn) cắt bỏ khúc nhiễu từ dòng "(https..." đến dòng "x/y"
-    if remove_noise:
-        block = remove_noise_chunk(block)
-
-    # Chuẩn hoá khoảng trắng ngoài rìa
-    return block
-
-def remove_noise_chunk(block: str) -> str:
-    """
-    Cắt bỏ đoạn từ dòng bắt đầu bằng '(https' (trong ngoặc) cho đến dòng chỉ chứa 'x/y'.
-    Nếu không có cặp đó, giữ nguyên.
-    """
-    RX_PAGE  = re.compile(r'(?m)^\s*\d+\s*/\s*\d+\s*$')            # ví dụ "1/2" một mình trên dòng
-    RX_PAREN_HTTP_LINE = re.compile(r'(?im)^\s*\(https?://', re.IGNORECASE)
-    # Tìm dòng mở đầu khúc nhiễu: một dòng bắt đầu bằng '('https...
-    m_open = RX_PAREN_HTTP_LINE.search(block)
-    if not m_open:
-        return block
-
-    # Tìm dòng số trang (x/y) xuất hiện SAU đó
-    m_page = RX_PAGE.search(block, m_open.end())
-    if not m_page:
-        return block
-
-    # Cắt bỏ đoạn [m_open.start(), m_page.end())
-    cleaned = block[:m_open.start()] + block[m_page.end():]
-    return cleaned
-
-def remove_dash_bracket_blocks(text: str) -> str:
-    # Xóa mọi khối dạng [- ... ] (kể cả xuống dòng bên trong)
-    BLOCK_RX = re.compile(r"\[\s*-\s*.*?\]", flags=re.DOTALL)
-    
-    out = BLOCK_RX.sub("", text)
-    # dọn khoảng trắng thừa sau khi xóa
-    out = re.sub(r"\s{2,}", " ", out)
-    out = re.sub(r"\s+([,.!?;:…])", r"\1", out)
-    return out.strip()
-
-def strip_allcaps_runs(text: str, min_words: int = 0) -> str:
-    ALLCAPS_RUN = re.compile(
-    r"""
-    (                           # capture the whole run
-      \b[A-Z][A-Z'’\-]+         # 1st ALL-CAPS word (len >= 2)
-      (?:[ ,:;–-]+\b[A-Z][A-Z'’\-]+){2,}   # + at least 2 more ALL-CAPS words
-    )
-    """,
-    re.VERBOSE,
-    )
-    
-    def _repl(m):
-        run = m.group(0)
-        # Count words in the run (tokens with letters)
-        n_words = len(re.findall(r"\b[A-Z][A-Z'’\-]+\b", run))
-        return "" if n_words >= min_words else run
-
-    out = ALLCAPS_RUN.sub(_repl, text)
-    # Tidy spaces created by removals
-    out = re.sub(r"\s{2,}", " ", out)
-    out = re.sub(r"\s+([,.!?;:])", r"\1", out)
-    
-    return out.strip()
+# Tăng khi đổi extract_clean_block / remove_noise_chunk (text_normalizer): block lưu trong text_store sẽ được tính lại
+CLEANER_VERSION = "1"
 
 def parse_pdf_text_to_dreams(
     pdf_text: str,
@@ -355,103 +534,26 @@ def update_dreams(dreams: Iterable[Dream]) -> List[Dream]:
         for d in dreams
     ]
 
-def clean_dream_text(s: str) -> str:
-    if not s:
-        return ""
-    # Normalize newlines and spaces
-    s = s.replace("\r\n", "\n").replace("\r", "\n")
-    s = s.replace("\u00A0", " ")             # non-breaking space -> normal space
-    s = re.sub(r"[ \t]+", " ", s)            # collapse runs of spaces/tabs
-    s = "\n".join(line.strip() for line in s.split("\n"))  # trim each line
-    s = s.replace("\n", " ")               # replace newlines with spaces
-    s = re.sub(r" +", " ", s)               # collapse multiple spaces
-    s = s.strip()
-      
-    # Strip enclosing triple quotes: """ ... """
-    m = re.fullmatch(r'\s*"""\s*([\s\S]*?)\s*"""\s*', s)
-    if m:
-        s = m.group(1).strip()
-
-    # Strip enclosing single double-quotes: " ... "
-    m = re.fullmatch(r'\s*"\s*([\s\S]*?)\s*"\s*', s)
-    if m:
-        s = m.group(1).strip()
-        
-    return s
-
 def srgb_hex(srgb_int: int) -> str:
     return f"#{srgb_int:06x}"
 
-def _shear_angle_deg(transform):
-    """
-    transform: [a, b, c, d, e, f] từ texttrace (ma trận Tm).
-    Trả về độ nghiêng (độ). Dùng cả b/a và c/d rồi lấy trị tuyệt đối lớn hơn.
-    """
-    a, b, c, d, _, _ = transform
-    ang1 = math.degrees(math.atan2(c, d)) if abs(d) > 1e-9 else 0.0
-    ang2 = math.degrees(math.atan2(b, a)) if abs(a) > 1e-9 else 0.0
-    return max(abs(ang1), abs(ang2))
-
-def _collect_italic_regions(page: fitz.Page, shear_thresh_deg: float = 7.0):
-    """
-    Quét texttrace để lấy các bbox có nghiêng (italic) theo ngưỡng độ.
-    Trả về list các Rect (khu vực nghiêng).
-    """
-    italic_boxes = []
-    for tr in page.get_texttrace():
-        if tr.get("type") != "text":
-            continue
-        tf = tr.get("transform")
-        if not tf:
-            continue
-        if _shear_angle_deg(tf) >= shear_thresh_deg:
-            italic_boxes.append(fitz.Rect(tr["bbox"]))
-    return italic_boxes
-
 def spans_with_italic_only(page: fitz.Page, shear_thresh_deg: float = 7.0, use_flags_fallback: bool = False):
     """
     Trả về list spans: {text, bbox, color, size, italic}
-    - italic dựa trên texttrace (shear). Không xử lý bold.
+    - italic dựa trên texttrace (shear), tra qua PageStyleIndex. Không xử lý bold.
     - Tùy chọn: fallback dùng span.flags (bit 2) nếu muốn (mặc định tắt).
     """
-    # 1) Lấy các vùng nghiêng từ texttrace
-    italic_regions = _collect_italic_regions(page, shear_thresh_deg)
-
-    # 2) Duyệt spans từ "dict" và gán italic nếu bbox giao với vùng nghiêng
-    out = []
-    d = page.get_text("dict")
-    for block in d.get("blocks", []):
-        if "lines" not in block:
-            continue
-        for line in block["lines"]:
-            for sp in line["spans"]:
-                txt = sp.get("text", "")
-                if not txt.strip():
-                    continue
-                bbox = fitz.Rect(sp["bbox"])
-                italic = any(bbox.intersects(r) for r in italic_regions)
-
-                if use_flags_fallback and not italic:
-                    # bit 2 của flags thường không đáng tin trong nhiều PDF, nhưng để tùy chọn
-                    italic = bool(sp.get("flags", 0) & 2)
-
-                out.append({
-                    "text": txt,
-                    "bbox": sp["bbox"],
-                    "size": sp.get("size"),
-                    "color": f"#{sp.get('color', 0):06x}",
-                    "italic": italic,
-                })
-    return out
+    index = PageStyleIndex(page, shear_thresh_deg)
+    return [
+        {"text": sp.text, "bbox": sp.bbox, "size": sp.size, "color": sp.color, "italic": sp.italic}
+        for sp in index.spans(use_flags_fallback)
+    ]
 
 def is_all_caps(text: str) -> bool:
 
     if not text or text.isspace() or text.isdigit() or len(text) < 2:
         return False
-    
-    # s = ud.normalize("NFKC", text)
 
-    # has_letter = False    
     for ch in text[1:]:
         if not ch.isupper() and not ch in ("-", "—", "–", "'", "’", '"', "“", "”", ".", ",", "!", "?", ";", ":", "/"):
             return False
@@ -0,0 +1,113 @@
+"""
+Giới hạn kích thước prompt trước khi gửi LLM:
+1) bỏ phần không phải giấc mơ: lời chào ở đầu block, lời cảm ơn / ký tên ở cuối block,
+   Reviewer's Message, dòng link. Lời chào / ký tên phải đúng dạng ("Dear Prof ...",
+   "Thank you very much, Duyen") và đúng vị trí, để không xoá câu trong giấc mơ
+2) nếu vẫn vượt PROMPT_TOKEN_BUDGET thì chia block thành nhiều phần tại tiêu đề giấc mơ
+   (DREAM_MARKER: First dream, Dream 2, ...), mỗi phần giữ lại dòng Date / State of mind;
+   không có tiêu đề nào thì gửi nguyên block
+3) kết quả của các phần được nối lại bằng merge_chunk_dreams
+"""
+import re
+from typing import Iterable, List, Tuple
+
+from ai_helper import estimate_tokens
+from my_type import PROMPT_TOKEN_BUDGET, Dream
+from rule_extractor import DOC_DATE, DOC_STATE, DREAM_MARKER, START
+
+# Tăng khi drop_boilerplate / split_at_dreams đổi cách cắt (namespace của dedup_index)
+PROMPT_BUDGET_VERSION = "2"
+
+# Lời chào gửi người chấm: phải có danh xưng ("Hello Dear Prof Anthony and Dr. Mayur", "Dear teacher,")
+GREETING_LINE = re.compile(
+    r'^(?:(?:hello|hi|good (?:morning|afternoon|evening))[ ,!]+(?:dear[ ,]+)?|dear[ ,]+)'
+    r'(?:prof(?:essor)?|dr|teachers?|sirs?|madam|mr|mrs|ms|all|everyone)\b.{0,60}$',
+    re.I,
+)
+# Ký tên: chỉ cụm cảm ơn / chào + tối đa 3 chữ viết hoa (tên), vd. "Thank you very much, Duyen"
+SIGNOFF_LINE = re.compile(
+    r'^(?:[Tt]hank(?:s| you)(?: (?:very|so) much)?|[Bb]est(?: wishes)?|(?:[Kk]ind |[Ww]arm(?:est)? |[Bb]est )?[Rr]egards|[Ss]incerely)'
+    r'[,.!]?(?:\s+[A-Z][\w.\-]*){0,3}[.!]?$'
+)
+REVIEWER_START = re.compile(r'^(?:Reviewer(?:’|\'|)s? Message|Student mark)\b', re.I)
+URL_LINE = re.compile(r'^\(?https?://\S*\)?$')
+
+def drop_boilerplate(block: str) -> Tuple[str, int]:
+    """Trả về (block đã bỏ boilerplate, số ký tự đã bỏ). Giữ nguyên xuống dòng."""
+    lines = block.split("\n")
+    drop = [False] * len(lines)
+
+    # lời chào: chỉ trong phần đầu (trước dòng nội dung đầu tiên không phải Date / State of mind)
+    for i, line in enumerate(lines):
+        s = line.strip()
+        if GREETING_LINE.match(s):
+            drop[i] = True
+        elif s and not (DOC_DATE.match(s) or DOC_STATE.match(s)):
+            break
+
+    in_review = False
+    for i, line in enumerate(lines):
+        s = line.strip()
+        if in_review and (START.match(s) or DREAM_MARKER.match(s)):
+            in_review = False
+        if REVIEWER_START.match(s):
+            in_review = True
+        if in_review or URL_LINE.match(s):
+            drop[i] = True
+
+    # ký tên: chỉ các dòng cuối block (sau nội dung giấc mơ cuối cùng)
+    for i in range(len(lines) - 1, -1, -1):
+        s = lines[i].strip()
+        if drop[i] or not s:
+            continue
+        if not SIGNOFF_LINE.match(s):
+            break
+        drop[i] = True
+
+    kept = [line for line, d in zip(lines, drop) if not d]
+    removed = sum(len(line) + 1 for line, d in zip(lines, drop) if d)
+    return "\n".join(kept), removed
+
+def _is_boundary(line: str) -> bool:
+    # chỉ tiêu đề giấc mơ rõ ràng; START ("I saw ...", "Last night I ...") hay gặp giữa 1 giấc mơ
+    return bool(DREAM_MARKER.match(line.strip()))
+
+def split_at_dreams(block: str, budget_tokens: int = PROMPT_TOKEN_BUDGET) -> List[str]:
+    """
+    Chia block thành các phần <= budget_tokens (ước lượng), chỉ cắt ở đầu 1 giấc mơ.
+    1 giấc mơ dài hơn budget vẫn đi nguyên 1 phần (không cắt giữa giấc mơ).
+    """
+    lines = block.split("\n")
+    if not any(_is_boundary(l) for l in lines):
+        return [block]
+    header = "\n".join(l for l in lines if DOC_DATE.match(l.strip()) or DOC_STATE.match(l.strip()))
+
+    # phần trước tiêu đề đầu tiên (Date / State of mind) đi cùng giấc mơ đầu tiên
+    segments, cur, started = [], [], False
+    for line in lines:
+        if _is_boundary(line):
+            if started:
+                segments.append("\n".join(cur))
+                cur = []
+            started = True
+        cur.append(line)
+    if cur:
+        segments.append("\n".join(cur))
+
+    chunks, cur, cur_tokens = [], [], 0
+    for seg in segments:
+        t = estimate_tokens(seg)
+        if cur and cur_tokens + t > budget_tokens:
+            chunks.append("\n".join(cur))
+            cur, cur_tokens = [], 0
+        cur.append(seg)
+        cur_tokens += t
+    if cur:
+        chunks.append("\n".join(cur))
+
+    # phần thứ 2 trở đi không còn dòng Date / State of mind => thêm lại ở đầu
+    return [c if i == 0 or not header else f"{header}\n{c}" for i, c in enumerate(chunks)]
+
+def merge_chunk_dreams(parts: Iterable[List[Dream]]) -> List[Dream]:
+    """Nối Dream của các phần theo thứ tự (dream_id đánh cho cả tài liệu sau đó, xem id_allocator)."""
+    return [d for part in parts for d in part]
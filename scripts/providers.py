@@ -0,0 +1,66 @@
+"""
+Chọn model theo job + registry provider LLM.
+- parse_model("gemini-2.5-flash-lite" hoặc "GEMINI_2_5_FLASH_LITE") -> enum model
+- current_model() / use_model(model): model của job đang chạy (contextvar). Mặc định là DREAMS_MODEL
+  (biến môi trường) hoặc CHOOSEN_MODEL, main.py --model ghi đè; 1 worker có thể đổi model giữa các job
+- Provider: các hàm gọi API của 1 họ model (GEMINI_MODEL, GROQ_MODEL, ...). ai_helper đăng ký chúng,
+  SDK của provider (google.genai, langchain_groq) chỉ được import khi model của nó được gọi lần đầu
+"""
+import contextvars
+import os
+from contextlib import contextmanager
+from enum import Enum
+from typing import Callable, Dict, List, NamedTuple, Optional, Type
+
+from my_type import CHOOSEN_MODEL, GEMINI_MODEL, GROQ_MODEL
+
+# Thêm họ model mới: thêm enum vào my_type rồi đăng ký Provider cho nó (register_provider)
+MODEL_FAMILIES: List[Type[Enum]] = [GEMINI_MODEL, GROQ_MODEL]
+
+class Provider(NamedTuple):
+    # cùng chữ ký (prompt, OUTPUT_FILENAME, model, pdf_title)
+    prompt: Callable
+    aprompt: Callable
+    stream: Callable
+    batch: Optional[Callable] = None  # None = không hỗ trợ gộp nhiều PDF / request
+
+_registry: Dict[Type[Enum], Provider] = {}
+
+def register_provider(family: Type[Enum], provider: Provider):
+    _registry[family] = provider
+
+def provider_for(model: Enum) -> Provider:
+    try:
+        return _registry[type(model)]
+    except KeyError:
+        raise ValueError(f"no provider registered for {model.value}") from None
+
+def all_models() -> List[Enum]:
+    return [m for family in MODEL_FAMILIES for m in family]
+
+def parse_model(name: str) -> Enum:
+    for m in all_models():
+        if name in (m.value, m.name):
+            return m
+    raise ValueError(f"unknown model {name!r}, choose one of: {', '.join(m.value for m in all_models())}")
+
+_default_model = parse_model(os.environ["DREAMS_MODEL"]) if os.getenv("DREAMS_MODEL") else CHOOSEN_MODEL
+# None = dùng _default_model (thread mới của pool không mang theo context của thread tạo nó)
+_current_model: contextvars.ContextVar[Optional[Enum]] = contextvars.ContextVar("current_model", default=None)
+
+def current_model() -> Enum:
+    return _current_model.get() or _default_model
+
+def set_default_model(model: Enum):
+    """Model mặc định cho cả tiến trình (main.py --model)."""
+    global _default_model
+    _default_model = model
+
+@contextmanager
+def use_model(model: Enum):
+    """Đổi model cho job hiện tại (thread / task này và những gì nó gọi)."""
+    token = _current_model.set(model)
+    try:
+        yield model
+    finally:
+        _current_model.reset(token)
@@ -0,0 +1,200 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from my_type import MODEL_QUOTAS, OUTPUT_PATH, QUOTA_DAY_TZ, QUOTA_FILE, ModelQuota
+
+DAY_SECONDS = 24 * 3600
+
+class DailyQuotaExceeded(RuntimeError):
+    pass
+
+class DailyUsage:
+    """
+    Số request đã gửi trong ngày của từng model, lưu trên đĩa (SQLite) để chạy lại trong ngày
+    (hay nhiều process của work_queue) không tính lại từ 0 rồi vượt quota ngày.
+    Mở file lười: chỉ tạo khi có request đầu tiên.
+    """
+
+    def __init__(self, db_path: Path = OUTPUT_PATH / QUOTA_FILE, tz: str = QUOTA_DAY_TZ):
+        self.db_path = Path(db_path)
+        try:
+            self.tz = ZoneInfo(tz)
+        except ZoneInfoNotFoundError:
+            # Windows không có tzdata: tính ngày theo UTC
+            self.tz = timezone.utc
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level=None: tự quản lý transaction (BEGIN IMMEDIATE khi cộng)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS daily_usage (
+                    model TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (model, day)
+                )"""
+            )
+        return self._conn
+
+    def today(self) -> str:
+        return datetime.now(self.tz).date().isoformat()
+
+    def count(self, model: Enum) -> int:
+        row = self._db().execute(
+            "SELECT count FROM daily_usage WHERE model = ? AND day = ?", (model.value, self.today())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def try_add(self, model: Enum, limit: int) -> bool:
+        """Cộng 1 request nếu chưa tới limit trong ngày (atomic giữa các process)."""
+        conn = self._db()
+        day = self.today()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT count FROM daily_usage WHERE model = ? AND day = ?", (model.value, day)).fetchone()
+            used = row[0] if row else 0
+            if used >= limit:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO daily_usage (model, day, count) VALUES (?, ?, ?)", (model.value, day, used + 1)
+            )
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+class TokenBucket:
+    """
+    Token bucket cho 1 model: giới hạn request/phút, token/phút và request/ngày.
+    reserve() trừ trước (cho phép âm) và trả về thời gian phải chờ, nên các
+    request xếp hàng theo đúng thứ tự gọi mà không cần giữ lock khi ngủ.
+    Dung lượng bucket chỉ bằng 1 request (và phần token tương ứng) để không
+    dồn burst vượt quota trong 1 cửa sổ 60s.
+    """
+
+    def __init__(self, quota: ModelQuota, model: Optional[Enum] = None, usage: Optional[DailyUsage] = None):
+        self.quota = quota
+        self.model = model
+        self.usage = usage  # None = chỉ đếm trong bộ nhớ (24h kể từ lúc tạo)
+        self.scale = 1.0  # < 1 sau khi bị 429, hồi phục dần khi thành công
+        self._request_cap = 1.0
+        self._token_cap = quota.tpm / quota.rpm
+        now = time.monotonic()
+        self._requests = self._request_cap
+        self._tokens = self._token_cap
+        self._updated = now
+        self._blocked_until = 0.0
+        self._day_start = now
+        self._day_count = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self._request_cap, self._requests + elapsed * self.quota.rpm * self.scale / 60.0)
+        self._tokens = min(self._token_cap, self._tokens + elapsed * self.quota.tpm * self.scale / 60.0)
+        if now - self._day_start >= DAY_SECONDS:
+            self._day_start = now
+            self._day_count = 0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        """Thời gian phải chờ nếu reserve ngay bây giờ (không trừ gì)."""
+        self._refill(now)
+        if self._used_today() >= self.quota.rpd:
+            return float("inf")
+        req_wait = max(0.0, 1 - self._requests) * 60.0 / (self.quota.rpm * self.scale)
+        tok_wait = max(0.0, min(tokens, self.quota.tpm) - self._tokens) * 60.0 / (self.quota.tpm * self.scale)
+        return max(req_wait, tok_wait, self._blocked_until - now)
+
+    def reserve(self, tokens: int, now: float) -> float:
+        wait = self.wait_time(tokens, now)
+        if wait == float("inf") or (self.usage is not None and not self.usage.try_add(self.model, self.quota.rpd)):
+            name = self.model.value if self.model is not None else "model"
+            raise DailyQuotaExceeded(f"daily request quota of {name} ({self.quota.rpd}) used up")
+        self._requests -= 1
+        self._tokens -= min(tokens, self.quota.tpm)
+        self._day_count += 1
+        return wait
+
+    def _used_today(self) -> int:
+        return self.usage.count(self.model) if self.usage is not None else self._day_count
+
+    def penalize(self, now: float, retry_after: Optional[float]):
+        # 429: giảm tốc độ một nửa và chặn bucket tới khi hết Retry-After
+        self.scale = max(0.1, self.scale * 0.5)
+        self._blocked_until = max(self._blocked_until, now + (retry_after if retry_after is not None else 60.0 / self.quota.rpm * 2))
+        self._requests = min(self._requests, 0.0)
+
+    def reward(self):
+        self.scale = min(1.0, self.scale + 0.05)
+
+class RateScheduler:
+    """
+    Mỗi model (GEMINI_MODEL / GROQ_MODEL) có 1 TokenBucket theo MODEL_QUOTAS.
+    Nếu có fallback và model chính phải chờ lâu hơn spill_after giây (hoặc hết
+    quota ngày), request được chuyển sang model fallback khi nó chờ ít hơn.
+    usage: đếm quota ngày trên đĩa (DailyUsage) thay vì trong bộ nhớ.
+    """
+
+    def __init__(self, quotas: Dict[Enum, ModelQuota] = MODEL_QUOTAS,
+                 fallback: Optional[Enum] = None, spill_after: float = 5.0, usage: Optional[DailyUsage] = None):
+        self._buckets = {model: TokenBucket(q, model, usage) for model, q in quotas.items()}
+        self.fallback = fallback
+        self.spill_after = spill_after
+        self._lock = threading.Lock()
+
+    def _reserve(self, model: Enum, tokens: int, spill: bool):
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets[model]
+            if spill and self.fallback is not None and self.fallback != model:
+                wait = bucket.wait_time(tokens, now)
+                if wait > self.spill_after:
+                    spill_wait = self._buckets[self.fallback].wait_time(tokens, now)
+                    if spill_wait < wait:
+                        model = self.fallback
+                        bucket = self._buckets[model]
+            return model, bucket.reserve(tokens, now)
+
+    def acquire(self, model: Enum, tokens: int = 0, spill: bool = True) -> Enum:
+        """Chờ tới lượt; trả về model thực sự được dùng (có thể là fallback nếu spill=True)."""
+        model, wait = self._reserve(model, tokens, spill)
+        if wait > 0:
+            time.sleep(wait)
+        return model
+
+    async def aacquire(self, model: Enum, tokens: int = 0, spill: bool = True) -> Enum:
+        model, wait = self._reserve(model, tokens, spill)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return model
+
+    def try_acquire(self, model: Enum, tokens: int = 0) -> bool:
+        """Lấy quota ngay nếu không phải chờ (request hedge), không thì bỏ qua, không spill."""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets[model]
+            if bucket.wait_time(tokens, now) > 0:
+                return False
+            bucket.reserve(tokens, now)
+            return True
+
+    def report_success(self, model: Enum):
+        with self._lock:
+            self._buckets[model].reward()
+
+    def report_rate_limited(self, model: Enum, retry_after: Optional[float] = None):
+        with self._lock:
+            self._buckets[model].penalize(time.monotonic(), retry_after)
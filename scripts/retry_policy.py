@@ -0,0 +1,172 @@
+"""
+Chính sách thử lại cho request LLM (dùng trong ai_helper, chung cho Gemini và Groq):
+- lỗi tạm thời (429, 5xx, timeout, rớt kết nối) được thử lại với exponential backoff + jitter,
+  không ngắn hơn Retry-After nếu server có gửi
+- deadline cho cả chuỗi thử lại của 1 prompt (timeout từng request đặt ở client, LLM_CALL_TIMEOUT)
+- hedging: request chạy quá p95 độ trễ gần đây của model thì gửi thêm 1 bản sao,
+  lấy kết quả về trước (bản sao cũng phải lấy quota từ scheduler)
+"""
+import asyncio
+import contextvars
+import math
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from my_type import (HEDGE_MIN_SAMPLES, HEDGE_QUANTILE, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_CALL_TIMEOUT,
+                     LLM_MAX_ATTEMPTS, LLM_TOTAL_DEADLINE, MODEL_QUOTAS, USE_HEDGING)
+from run_metrics import get_metrics, percentile
+
+T = TypeVar("T")
+
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+# httpx / groq / openai đặt tên lỗi mạng như vậy; so theo tên để không phải import SDK ở đây
+TRANSIENT_ERRORS = {"TimeoutError", "ConnectionError", "TimeoutException", "TransportError",
+                    "APIConnectionError", "APITimeoutError", "RemoteProtocolError"}
+
+def status_of(e: Exception) -> Optional[int]:
+    # google.genai.errors.APIError có .code, groq.APIStatusError có .status_code
+    code = getattr(e, "code", None)
+    if not isinstance(code, int):
+        code = getattr(e, "status_code", None)
+    return code if isinstance(code, int) else None
+
+def is_transient(e: Exception) -> bool:
+    if status_of(e) in TRANSIENT_STATUS:
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(e).__mro__)
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = LLM_MAX_ATTEMPTS, base_delay: float = LLM_BACKOFF_BASE,
+                 max_delay: float = LLM_BACKOFF_MAX, total_deadline: float = LLM_TOTAL_DEADLINE, seed: Optional[int] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.total_deadline = total_deadline
+        self._rng = random.Random(seed)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # full jitter: uniform(0, min(max, base * 2^attempt)), nhưng không sớm hơn Retry-After
+        delay = self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def deadline(self) -> float:
+        return time.monotonic() + self.total_deadline
+
+    def next_delay(self, e: Exception, attempt: int, deadline: float, retry_after: Optional[float] = None) -> Optional[float]:
+        """Số giây chờ trước lần thử tiếp theo, None = không thử lại (raise)."""
+        if not is_transient(e) or attempt + 1 >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt, retry_after)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+class LatencyTracker:
+    """Độ trễ của các request thành công gần đây, theo model; hedge_after = p95 của chúng."""
+
+    def __init__(self, window: int = 200, min_samples: int = HEDGE_MIN_SAMPLES, quantile: float = HEDGE_QUANTILE):
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self._lock = threading.Lock()
+        self._samples: Dict[object, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, model, seconds: float):
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def hedge_after(self, model) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples[model])
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, self.quantile)
+
+def _hedge_workers() -> int:
+    # mọi request chạy trên pool đã lấy quota từ scheduler và kết thúc trong LLM_CALL_TIMEOUT (cả bản thua),
+    # nên số request đang chạy không vượt quá số quota cấp được trong LLM_CALL_TIMEOUT giây:
+    # pool không bao giờ bắt request phải xếp hàng chờ thread (thread chỉ được tạo khi cần)
+    windows = math.ceil(LLM_CALL_TIMEOUT / 60)
+    return sum(quota.rpm for quota in MODEL_QUOTAS.values()) * windows
+
+# thread cho bản gốc + bản sao hedge (bản gốc chạy trên pool để có thể chờ với timeout)
+_hedge_pool = ThreadPoolExecutor(max_workers=_hedge_workers(), thread_name_prefix="llm-hedge")
+
+def _submit(fn: Callable[[], T]):
+    # giữ file_scope (run_metrics) của thread gọi
+    return _hedge_pool.submit(contextvars.copy_context().run, fn)
+
+def call_hedged(call: Callable[[], T], hedge_after: Optional[float], try_hedge: Callable[[], bool],
+                tracker: Optional[LatencyTracker] = None, model=None) -> T:
+    """
+    Chạy call(); nếu sau hedge_after giây chưa xong và try_hedge() cấp được quota thì chạy thêm
+    1 bản sao, trả về kết quả thành công đầu tiên. Bản chậm hơn không huỷ được (thread), kết quả bị bỏ.
+    """
+    start = time.perf_counter()
+    if not USE_HEDGING or hedge_after is None:
+        result = call()
+        if tracker is not None:
+            tracker.add(model, time.perf_counter() - start)
+        return result
+
+    pending = {_submit(call)}
+    done, pending = wait(pending, timeout=hedge_after)
+    if not done and try_hedge():
+        get_metrics().count("hedges")
+        hedge = _submit(call)
+        pending.add(hedge)
+    else:
+        hedge = None
+
+    error = None
+    while pending or done:
+        if not done:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        fut = done.pop()
+        if fut.exception() is None:
+            if fut is hedge:
+                get_metrics().count("hedge_wins")
+            if tracker is not None:
+                tracker.add(model, time.perf_counter() - start)
+            return fut.result()
+        error = error or fut.exception()
+    raise error
+
+async def acall_hedged(call: Callable[[], Awaitable[T]], hedge_after: Optional[float], try_hedge: Callable[[], bool],
+                       tracker: Optional[LatencyTracker] = None, model=None) -> T:
+    start = time.perf_counter()
+    if not USE_HEDGING or hedge_after is None:
+        result = await call()
+        if tracker is not None:
+            tracker.add(model, time.perf_counter() - start)
+        return result
+
+    first = asyncio.ensure_future(call())
+    done, pending = await asyncio.wait({first}, timeout=hedge_after)
+    hedge = None
+    if not done and try_hedge():
+        get_metrics().count("hedges")
+        hedge = asyncio.ensure_future(call())
+        pending.add(hedge)
+
+    error = None
+    try:
+        while pending or done:
+            if not done:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            task = done.pop()
+            if task.exception() is None:
+                if task is hedge:
+                    get_metrics().count("hedge_wins")
+                if tracker is not None:
+                    tracker.add(model, time.perf_counter() - start)
+                return task.result()
+            error = error or task.exception()
+        raise error
+    finally:
+        # async thì huỷ được bản còn chạy
+        for task in pending:
+            task.cancel()
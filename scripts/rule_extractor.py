@@ -0,0 +1,271 @@
+"""
+Bộ tách giấc mơ bằng regex (không gọi LLM) + chấm điểm độ tin cậy.
+Tài liệu có điểm >= RULE_CONFIDENCE_THRESHOLD được xử lý ngay tại máy,
+phần còn lại mới gửi cho LLM (xem pdf_helper.hybrid_filter_dream_text).
+"""
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# ====== Patterns (EN-only) ======
+START = re.compile(
+    r'^(?:'
+    r'Date(?: of dream)?|Dream(?:\s*\d+)?|First dream|Second dream|Third dream|'
+    r'The (?:second|third|fourth) dream|Dream and analysis|Dream analysis|'
+    r'I (?:dreamed|dreamt|saw)\b|At night I\b|Last night I\b'
+    r')\s*[:\-–]?', re.I
+)
+END = re.compile(r'^(?:Reviewer(?:’|\'|)s? Message|Thank you)\b', re.I)
+SCENE_CONT = re.compile(r'^(?:A next scene|Next scene|In another (?:day|scene))\b', re.I)
+
+FIELD_DATE = re.compile(r'^(?:Date(?: of dream)?|Dream Date|Date)\s*:\s*(.+)$', re.I)
+FIELD_STATE = re.compile(r'^(?:State of mind|Mood|Feeling)\s*:\s*(.+)$', re.I)
+FIELD_ANALYSIS = re.compile(r'^(?:Dream and analysis|Dream analysis)\s*[:\-–]?\s*$', re.I)
+
+# ====== Data model ======
+@dataclass
+class DreamRow:
+    case_id: str
+    dream_id: str
+    date: Optional[str]
+    dream_text: str
+    state_of_mind: Optional[str]
+    notes: str
+
+# ====== Utilities ======
+def _normalize_lines(text: str) -> list[str]:
+    # collapse weird spacing, keep line structure (helps markers)
+    lines = []
+    for raw in text.splitlines():
+        line = re.sub(r'\s+', ' ', raw).strip()
+        if line:  # drop empty after normalization
+            lines.append(line)
+    return lines
+
+def _split_dream_chunks(lines: list[str]) -> list[str]:
+    chunks, cur = [], []
+    for line in lines:
+        # Start a new chunk when a new START marker appears (and we have content)
+        if START.match(line) and cur:
+            chunks.append("\n".join(cur).strip())
+            cur = [line]
+        else:
+            cur.append(line)
+        # Hard end markers close the current chunk
+        if END.match(line) and cur:
+            chunks.append("\n".join(cur).strip())
+            cur = []
+    if cur:
+        chunks.append("\n".join(cur).strip())
+
+    # Merge scene continuations back into previous chunk
+    merged: list[str] = []
+    for ch in chunks:
+        first = ch.splitlines()[0]
+        if SCENE_CONT.match(first) and merged:
+            merged[-1] = merged[-1] + "\n" + ch
+        else:
+            merged.append(ch)
+    return merged
+
+# Try a handful of common English formats before falling back
+_DATE_FORMATS = [
+    "%B %d, %Y",      # January 02, 2024
+    "%b %d, %Y",      # Jan 02, 2024
+    "%d %B %Y",       # 02 January 2024
+    "%d %b %Y",       # 02 Jan 2024
+    "%Y-%m-%d",       # 2024-01-02
+    "%m/%d/%Y",       # 01/02/2024
+    "%d/%m/%Y",       # 02/01/2024
+]
+
+def _parse_date_to_iso(s: str) -> Optional[str]:
+    s = s.strip().rstrip(".")
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date().isoformat()
+        except ValueError:
+            continue
+    # Very loose month name with ordinal removal (e.g., "January 2nd, 2024")
+    s2 = re.sub(r'(\d+)(st|nd|rd|th)', r'\1', s, flags=re.I)
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(s2, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def _clean_dream_text(s: str) -> str:
+    # Remove leading/trailing straight or curly quotes, including triple quotes
+    s = s.strip()
+    s = re.sub(r'^\s*(?:"{1,3}|“{1,3}|\'{1,3})', '', s)
+    s = re.sub(r'(?:"{1,3}|”{1,3}|\'{1,3})\s*$', '', s)
+    # Normalize internal spacing a bit
+    s = re.sub(r'[ \t]+', ' ', s)
+    return s.strip()
+
+def _increment_dream_id(last_id: str) -> str:
+    # last_id like "D0000" → return next
+    m = re.match(r'^[Dd](\d{4})$', last_id or "D0000")
+    n = int(m.group(1)) if m else 0
+    return f"D{n+1:04d}"
+
+def _parse_fields_from_chunk(chunk: str) -> tuple[Optional[str], Optional[str], str]:
+    """
+    Return (date_iso, state_of_mind, dream_text_without_headers)
+    """
+    date_iso: Optional[str] = None
+    state: Optional[str] = None
+
+    lines = chunk.splitlines()
+    body_lines: list[str] = []
+
+    for line in lines:
+        md = FIELD_DATE.match(line)
+        if md and not date_iso:
+            date_iso = _parse_date_to_iso(md.group(1))
+            continue
+
+        ms = FIELD_STATE.match(line)
+        if ms and not state:
+            state = ms.group(1).strip()
+            continue
+
+        # Skip pure analysis header lines from body
+        if FIELD_ANALYSIS.match(line):
+            continue
+
+        body_lines.append(line)
+
+    body = "\n".join(body_lines).strip()
+
+    # If the top line is a generic "Dream X" heading, drop it from body
+    if body:
+        top = body.splitlines()[0]
+        if re.match(r'^(?:Dream(?:\s*\d+)?|First dream|Second dream|Third dream)\b', top, re.I):
+            body = "\n".join(body.splitlines()[1:]).strip()
+
+    return date_iso, state, body
+
+# ====== Convenience: parse from raw text instead of PDF ======
+def parse_text_into_dream_rows(
+    raw_text: str,
+    title_for_notes: str = "unknown",
+    last_dream_id: str = "D0000",
+    default_case_id: str = "C01",
+) -> List[DreamRow]:
+    lines = _normalize_lines(raw_text)
+    chunks = _split_dream_chunks(lines)
+
+    rows: List[DreamRow] = []
+    current_id = last_dream_id
+
+    for ch in chunks:
+        date_iso, state, body = _parse_fields_from_chunk(ch)
+        body = re.sub(r'\bDream (?:and )?analysis\s*:\s*.*$', '', body, flags=re.I).strip()
+        cleaned = _clean_dream_text(body)
+        if not cleaned:
+            continue
+        current_id = _increment_dream_id(current_id)
+        rows.append(
+            DreamRow(
+                case_id=default_case_id,
+                dream_id=current_id,
+                date=date_iso,
+                dream_text=cleaned,
+                state_of_mind=state.strip() if state else None,
+                notes=f"From PDF: {title_for_notes}",
+            )
+        )
+    return rows
+
+# ====== Confidence scoring (hybrid fast path) ======
+DOC_DATE = re.compile(r'^(?:Date of dream|Dream date|Date)\s*:\s*(.+)$', re.I)
+DOC_STATE = re.compile(r'^(?:State of mind|Dream mood|Mood|Feeling)\s*:\s*(.+)$', re.I)
+NUMERIC_DATE = re.compile(r'^(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{4})$')
+WEEKDAY = re.compile(r'^(?:mon|tues|wednes|thurs|fri|satur|sun)day,?\s*', re.I)
+DREAM_MARKER = re.compile(
+    r'^(?:(?:the\s+)?(?:first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth)\s+dream|dream\s*(?:no\.?|#)?\s*\d+)\b',
+    re.I,
+)
+# Nhận xét của người chấm: [+ ...] / [- ...] hoặc cả chuỗi chữ IN HOA
+ANNOTATION = re.compile(r"[\[\]]|\b[A-Z][A-Z'’\-]+(?:[ ,:;–-]+[A-Z][A-Z'’\-]+){2,}\b")
+ANALYSIS_HINT = re.compile(r'\b(?:analys[ie]s|analy[sz]e|interpretation|symboli[sz]e[sd]?|represents?|subconscious)\b', re.I)
+
+MIN_DREAM_CHARS = 40
+MAX_DREAM_CHARS = 8000
+
+@dataclass
+class RuleResult:
+    rows: List[DreamRow]
+    date: Optional[str]             # dd/mm/yyyy
+    state_of_mind: Optional[str]
+    confidence: float
+    reasons: List[str]
+
+def _doc_fields(lines: list[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Date / state of mind dùng chung cho cả tài liệu (dòng đầu tiên tìm thấy)."""
+    date: Optional[str] = None
+    state: Optional[str] = None
+    for line in lines:
+        md = DOC_DATE.match(line)
+        if md and date is None:
+            raw = md.group(1).strip().rstrip(".")
+            m_num = NUMERIC_DATE.match(raw)
+            if m_num:
+                # 05/03/2021: giữ nguyên thứ tự ngày/tháng như văn bản gốc
+                date = f"{int(m_num.group(1)):02d}/{int(m_num.group(2)):02d}/{m_num.group(3)}"
+                continue
+            iso = _parse_date_to_iso(raw) or _parse_date_to_iso(WEEKDAY.sub('', raw.strip()))
+            if iso:
+                date = datetime.strptime(iso, "%Y-%m-%d").strftime("%d/%m/%Y")
+        ms = DOC_STATE.match(line)
+        if ms and state is None:
+            state = ms.group(1).strip()
+    return date, state
+
+def extract_with_confidence(raw_text: str, title_for_notes: str = "unknown") -> RuleResult:
+    """
+    Chạy parser regex trên text của 1 PDF và chấm điểm 0..1:
+      - 0.3 nếu đọc được ngày (Date of dream / Dream date)
+      - 0.2 nếu có State of mind / Dream mood
+      - 0.3 nếu ranh giới giấc mơ rõ ràng (mỗi giấc mơ có marker "First dream",
+        "Dream 2"..., hoặc chỉ có đúng 1 giấc mơ và không có marker nào)
+      - 0.2 nếu độ dài mỗi giấc mơ hợp lý
+    Nếu còn nhận xét của người chấm ([...], chữ IN HOA) hoặc câu phân tích thì điểm bị chia đôi.
+    """
+    lines = _normalize_lines(raw_text)
+    rows = parse_text_into_dream_rows(raw_text, title_for_notes)
+    date, state = _doc_fields(lines)
+
+    score = 0.0
+    reasons: List[str] = []
+
+    if date:
+        score += 0.3
+    else:
+        reasons.append("no parsable date")
+
+    if state:
+        score += 0.2
+    else:
+        reasons.append("no state of mind")
+
+    markers = sum(1 for line in lines if DREAM_MARKER.match(line))
+    if rows and (markers == len(rows) or (markers == 0 and len(rows) == 1)):
+        score += 0.3
+    else:
+        reasons.append(f"{len(rows)} segments for {markers} dream markers")
+
+    if rows and all(MIN_DREAM_CHARS <= len(r.dream_text) <= MAX_DREAM_CHARS for r in rows):
+        score += 0.2
+    else:
+        reasons.append("segment length out of range")
+
+    if ANNOTATION.search(raw_text) or any(ANALYSIS_HINT.search(r.dream_text) for r in rows):
+        score *= 0.5
+        reasons.append("annotations or analysis left in text")
+
+    return RuleResult(rows, date, state, round(score, 2), reasons)
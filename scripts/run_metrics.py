@@ -0,0 +1,137 @@
+"""
+Đo thời gian từng bước cho mỗi file (mở PDF, lấy text, làm sạch, chờ rate limit,
+gọi LLM, ghi CSV) + token / số lần retry, rồi xuất báo cáo p50 / p95 cuối mỗi lần chạy.
+File đang xử lý được gắn qua file_scope() (contextvar), nên các hàm sâu bên trong
+(ai_helper, pdf_helper) chỉ cần gọi span() / add_tokens() mà không phải truyền tên file.
+"""
+import contextvars
+import csv
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from my_type import COLLECT_METRICS, OUTPUT_PATH
+
+_current_file: contextvars.ContextVar[str] = contextvars.ContextVar("current_file", default="-")
+# Worker process (extract_stage) gom thời gian từng bước của 1 file vào đây để gửi về process chính
+_captured: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("captured_stages", default=None)
+
+def percentile(values: List[float], p: float) -> float:
+    # nearest-rank
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[k]
+
+class RunMetrics:
+    def __init__(self, enabled: bool = COLLECT_METRICS):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages: Dict[str, List[float]] = defaultdict(list)
+        self._files: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def file_scope(self, file_key: str):
+        token = _current_file.set(file_key)
+        try:
+            yield
+        finally:
+            _current_file.reset(token)
+
+    @contextmanager
+    def capture(self):
+        """Gom (cộng dồn theo bước) các span ghi trong khối with, để process khác record() lại."""
+        captured: Dict[str, float] = defaultdict(float)
+        token = _captured.set(captured)
+        try:
+            yield captured
+        finally:
+            _captured.reset(token)
+
+    def record(self, stage: str, seconds: float, file_key: Optional[str] = None):
+        captured = _captured.get()
+        if captured is not None:
+            captured[stage] += seconds
+        if not self.enabled:
+            return
+        key = file_key or _current_file.get()
+        with self._lock:
+            self._stages[stage].append(seconds)
+            self._files[key][f"{stage}_s"] += seconds
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def count(self, name: str, n: float = 1, file_key: Optional[str] = None):
+        if not self.enabled:
+            return
+        key = file_key or _current_file.get()
+        with self._lock:
+            self._files[key][name] += n
+
+    def add_tokens(self, prompt_tokens: Optional[int], response_tokens: Optional[int]):
+        self.count("prompt_tokens", prompt_tokens or 0)
+        self.count("response_tokens", response_tokens or 0)
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {
+                    "count": len(v),
+                    "total_s": round(sum(v), 4),
+                    "p50_s": round(percentile(v, 50), 4),
+                    "p95_s": round(percentile(v, 95), 4),
+                    "max_s": round(max(v), 4),
+                }
+                for name, v in sorted(self._stages.items())
+            }
+            files = {k: dict(v) for k, v in self._files.items()}
+        totals: Dict[str, float] = defaultdict(float)
+        for counters in files.values():
+            for name, value in counters.items():
+                if not name.endswith("_s"):
+                    totals[name] += value
+        return {
+            "wall_s": round(time.perf_counter() - self._started, 4),
+            "stages": stages,
+            "totals": dict(totals),
+            "files": files,
+        }
+
+    def write_report(self, stem: str) -> Optional[Path]:
+        """Ghi <stem>.metrics.json (đầy đủ) và <stem>.metrics.csv (p50 / p95 mỗi bước) vào OUTPUT_PATH."""
+        if not self.enabled:
+            return None
+        summary = self.summary()
+        json_path = OUTPUT_PATH / f"{stem}.metrics.json"
+        json_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        with (OUTPUT_PATH / f"{stem}.metrics.csv").open("w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage", "count", "total_s", "p50_s", "p95_s", "max_s"])
+            for name, s in summary["stages"].items():
+                writer.writerow([name, s["count"], s["total_s"], s["p50_s"], s["p95_s"], s["max_s"]])
+
+        print(f"Run report ({summary['wall_s']:.1f}s wall): {json_path.as_posix()}")
+        for name, s in summary["stages"].items():
+            print(f"  {name:12s} n={s['count']:<5d} p50={s['p50_s'] * 1000:8.1f}ms  p95={s['p95_s'] * 1000:8.1f}ms  total={s['total_s']:.1f}s")
+        if summary["totals"]:
+            print("  " + ", ".join(f"{k}={v:g}" for k, v in sorted(summary["totals"].items())))
+        return json_path
+
+_metrics = RunMetrics()
+
+def get_metrics() -> RunMetrics:
+    return _metrics
@@ -0,0 +1,108 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+BUCKET_HEIGHT = 16.0  # ~1 dòng chữ cỡ 12pt
+
+def _shear_angle_deg(transform):
+    """
+    transform: [a, b, c, d, e, f] từ texttrace (ma trận Tm).
+    Trả về độ nghiêng (độ). Dùng cả b/a và c/d rồi lấy trị tuyệt đối lớn hơn.
+    """
+    a, b, c, d, _, _ = transform
+    ang1 = math.degrees(math.atan2(c, d)) if abs(d) > 1e-9 else 0.0
+    ang2 = math.degrees(math.atan2(b, a)) if abs(a) > 1e-9 else 0.0
+    return max(abs(ang1), abs(ang2))
+
+def _collect_italic_regions(page: fitz.Page, shear_thresh_deg: float = 7.0):
+    """
+    Quét texttrace để lấy các bbox có nghiêng (italic) theo ngưỡng độ.
+    Trả về list các Rect (khu vực nghiêng).
+    """
+    italic_boxes = []
+    for tr in page.get_texttrace():
+        if tr.get("type") != "text":
+            continue
+        tf = tr.get("transform")
+        if not tf:
+            continue
+        if _shear_angle_deg(tf) >= shear_thresh_deg:
+            italic_boxes.append(fitz.Rect(tr["bbox"]))
+    return italic_boxes
+
+class StyledSpan(NamedTuple):
+    text: str
+    bbox: Tuple[float, float, float, float]
+    size: Optional[float]
+    font: Optional[str]
+    color: str      # "#rrggbb"
+    italic: bool
+    bold: bool
+
+class PageStyleIndex:
+    """
+    Chỉ mục style của 1 trang, dựng 1 lần từ get_texttrace() + get_text("dict").
+    Các vùng nghiêng (italic theo shear) được chia vào lưới theo trục y
+    (bucket cao BUCKET_HEIGHT), nên mỗi span chỉ so với vài vùng cùng dòng
+    thay vì toàn bộ vùng của trang.
+    with_italic=False: bỏ qua get_texttrace() (bước tốn nhất) khi không cần italic,
+    span chỉ có italic theo flags nếu use_flags_fallback, không thì luôn False.
+    """
+
+    def __init__(self, page: fitz.Page, shear_thresh_deg: float = 7.0, bucket_height: float = BUCKET_HEIGHT,
+                 with_italic: bool = True):
+        self.bucket_height = bucket_height
+        self._buckets: Dict[int, List[fitz.Rect]] = defaultdict(list)
+        for r in _collect_italic_regions(page, shear_thresh_deg) if with_italic else ():
+            if r.is_empty:
+                continue  # Rect rỗng không bao giờ intersects
+            for b in self._bucket_range(r.y0, r.y1):
+                self._buckets[b].append(r)
+        self._dict = page.get_text("dict")
+
+    def _bucket_range(self, y0: float, y1: float) -> range:
+        return range(int(y0 // self.bucket_height), int(y1 // self.bucket_height) + 1)
+
+    def is_italic(self, bbox) -> bool:
+        rect = fitz.Rect(bbox)
+        for b in self._bucket_range(rect.y0, rect.y1):
+            for r in self._buckets.get(b, ()):
+                if rect.intersects(r):
+                    return True
+        return False
+
+    def _styled(self, sp: dict, use_flags_fallback: bool) -> StyledSpan:
+        flags = sp.get("flags", 0)
+        italic = self.is_italic(sp["bbox"])
+        if use_flags_fallback and not italic:
+            # bit 2 của flags thường không đáng tin trong nhiều PDF, nhưng để tùy chọn
+            italic = bool(flags & 2)
+        return StyledSpan(
+            text=sp.get("text", ""),
+            bbox=sp["bbox"],
+            size=sp.get("size"),
+            font=sp.get("font"),
+            color=f"#{sp.get('color', 0):06x}",
+            italic=italic,
+            bold=bool(flags & 16),
+        )
+
+    def lines(self, use_flags_fallback: bool = False) -> Iterator[List[StyledSpan]]:
+        """Duyệt từng dòng của trang theo thứ tự đọc, mỗi dòng là list span kèm italic / bold / màu."""
+        for block in self._dict.get("blocks", []):
+            if "lines" not in block:
+                continue
+            for line in block["lines"]:
+                yield [self._styled(sp, use_flags_fallback) for sp in line["spans"]]
+
+    def spans(self, use_flags_fallback: bool = False) -> Iterator[StyledSpan]:
+        """Như lines() nhưng trải phẳng và bỏ span trắng."""
+        for block in self._dict.get("blocks", []):
+            if "lines" not in block:
+                continue
+            for line in block["lines"]:
+                for sp in line["spans"]:
+                    if sp.get("text", "").strip():
+                        yield self._styled(sp, use_flags_fallback)
@@ -0,0 +1,89 @@
+"""
+Sinh PDF giấc mơ giả (PyMuPDF) theo đúng bố cục thư mục data/ để benchmark:
+
+    <root>/<k>. <NAME> (19 - 25) <n> Dreams/D/<i>. D_<title> _ <year>.pdf
+
+Mỗi file có Date of dream, State of mind, 1-4 giấc mơ (First dream, Second dream, ...),
+lời chào, header in hoa và Revision ở cuối. File "khó" có thêm đoạn phân tích in đậm
+và nhận xét [- ...] nên rule_extractor không đủ tin cậy => phải gọi LLM.
+
+    python synth_pdfs.py <root> [số người] [số file / người]
+"""
+import random
+import sys
+from pathlib import Path
+from typing import List
+
+import fitz  # PyMuPDF
+
+NAMES = ["TRINH", "NHU", "SUONG", "DUYEN", "LINH", "MAI"]
+ORDINALS = ["First", "Second", "Third", "Fourth"]
+PLACES = ["a garden", "an old house", "a crowded market", "the school yard", "a river bank", "a mountain road"]
+PEOPLE = ["my sister", "an old friend", "my boss", "a stranger", "my grandmother", "a small child"]
+ACTIONS = ["was looking for something", "could not find the way home", "was flying above the roofs",
+           "was talking about the past", "was carrying a heavy bag", "kept opening the same door"]
+MOODS = ["calm", "anxious", "happy", "confused", "tired"]
+
+def _sentence(rng: random.Random) -> str:
+    return f"I was in {rng.choice(PLACES)} with {rng.choice(PEOPLE)} who {rng.choice(ACTIONS)}."
+
+def _dream(rng: random.Random, sentences: int) -> str:
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+def make_dream_pdf(path: Path, rng: random.Random, hard: bool = False, sentences: int = 6):
+    """1 PDF giả; hard=True thêm phần phân tích in đậm + nhận xét của người chấm."""
+    doc = fitz.open()
+    page = doc.new_page()
+    rect = fitz.Rect(50, 50, page.rect.width - 50, page.rect.height - 50)
+    y = rect.y0
+
+    def write(text: str, font: str = "helv", color=(0, 0, 0)):
+        nonlocal page, y
+        left = -1.0
+        if y < rect.y1 - 20:
+            box = fitz.Rect(rect.x0, y, rect.x1, rect.y1)
+            left = page.insert_textbox(box, text, fontsize=11, fontname=font, color=color)
+        if left < 0:  # không đủ chỗ => sang trang mới
+            page = doc.new_page()
+            y = rect.y0
+            box = fitz.Rect(rect.x0, y, rect.x1, rect.y1)
+            left = page.insert_textbox(box, text, fontsize=11, fontname=font, color=color)
+        y = rect.y1 - max(left, 0) + 6
+
+    write("DREAM JOURNAL WEEKLY SUBMISSION")
+    write("Hello Dear Prof Anthony and Dr. Mayur")
+    write(f"Date of dream: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.choice([2022, 2023, 2024])}")
+    write(f"State of mind: {rng.choice(MOODS)}")
+
+    for k in range(rng.randint(1, 4)):
+        write(f"{ORDINALS[k]} dream")
+        write(_dream(rng, rng.randint(max(2, sentences - 2), sentences + 2)))
+        if hard:
+            write("This dream represents my subconscious fear of losing control.", font="hebo")
+            write("[- REVIEWER NOTE: PLEASE REMOVE ANALYSIS ]")
+
+    write("Thank you very much, Duyen")
+    write("Revision")
+    write("Student mark: 8/10")
+    doc.save(path)
+    doc.close()
+
+def generate_corpus(root: Path, participants: int = 2, files_per_participant: int = 20,
+                    hard_fraction: float = 0.5, seed: int = 0) -> List[Path]:
+    """Trả về list thư mục D/ của từng người (mỗi thư mục là 1 INPUT_PATH hợp lệ)."""
+    rng = random.Random(seed)
+    folders = []
+    for p in range(participants):
+        folder = Path(root) / f"{p + 1}. {NAMES[p % len(NAMES)]} (19 - 25) {files_per_participant} Dreams" / "D"
+        folder.mkdir(parents=True, exist_ok=True)
+        for i in range(files_per_participant):
+            make_dream_pdf(folder / f"{i + 1}. D_Dream title {i} _ 2024.pdf", rng, hard=rng.random() < hard_fraction)
+        folders.append(folder)
+    return folders
+
+if __name__ == "__main__":
+    root = Path(sys.argv[1])
+    participants = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    per = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    for folder in generate_corpus(root, participants, per):
+        print(f"{folder}: {per} PDFs")
@@ -0,0 +1,107 @@
+"""
+pytest scripts/test_async_runs.py — ASYNC_MODE: nhiều asyncio.run trong cùng 1 process với server Gemini giả
+(client async phải theo từng event loop, ai_helper._loop_client).
+Mỗi kịch bản chạy trong process con (python test_async_runs.py <kịch bản>) vì my_type đọc DREAMS_* lúc import.
+"""
+import csv
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from fake_llm_server import FakeLLMServer
+from synth_pdfs import generate_corpus
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+@pytest.fixture
+def server():
+    srv = FakeLLMServer(latency=0.02).start()
+    yield srv
+    srv.stop()
+
+@pytest.fixture
+def env(tmp_path, server):
+    folders = generate_corpus(tmp_path / "data", participants=2, files_per_participant=4, hard_fraction=1.0, seed=3)
+    (tmp_path / "out").mkdir()
+    return dict(os.environ, GEMINI_BASE_URL=server.base_url, GEMINI_API_KEY="x", DREAMS_QUOTA_SCALE="100",
+               DREAMS_DATA_PATH=str(tmp_path / "data"), DREAMS_INPUT_PATH=str(folders[0]),
+               DREAMS_OUTPUT_PATH=str(tmp_path / "out"))
+
+def _run(scenario: str, env: dict, *args: str) -> str:
+    proc = subprocess.run([sys.executable, __file__, scenario, *args], cwd=SCRIPTS_DIR, env=env,
+                          capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stdout[-2000:] + proc.stderr[-2000:]
+    return proc.stdout
+
+def _case_ids(path: Path) -> list:
+    with path.open(encoding="utf-8", newline="") as f:
+        return sorted({row["case_id"] for row in csv.DictReader(f)})
+
+def test_asyncio_run_twice_in_one_process(env):
+    # lần 1: 2 file đầu, lần 2 (resume, asyncio.run mới): phần còn lại
+    _run("resume", env)
+    assert _case_ids(Path(env["DREAMS_OUTPUT_PATH"]) / "async.csv") == ["C0001", "C0002", "C0003", "C0004"]
+
+def test_duplicates_wait_for_first_extraction(env, server):
+    # bản copy chạy song song với bản gốc: chờ lock của dedup_index rồi dùng lại kết quả, không gọi LLM lần 2
+    folder = Path(env["DREAMS_INPUT_PATH"])
+    for k, f in enumerate(sorted(folder.glob("*.pdf"))):
+        shutil.copy(f, folder / f"{20 + k}. D_Copy {k} _ 2024.pdf")
+    _run("all", env)
+    assert server.stats["requests"] == 4
+    assert len(_case_ids(Path(env["DREAMS_OUTPUT_PATH"]) / "async.csv")) == 8
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_run_study_async(env, workers):
+    # main.py --all: mỗi participant 1 thread, mỗi thread 1 asyncio.run riêng
+    out = _run("study", env, workers)
+    assert "FAILED" not in out
+    csvs = sorted(Path(env["DREAMS_OUTPUT_PATH"]).glob("*_dreams.csv"))
+    assert len(csvs) == 2
+    for path in csvs:
+        assert _case_ids(path) == ["C0001", "C0002", "C0003", "C0004"]
+
+# --- process con ---
+
+def _scenario_resume():
+    import main
+    from output_helper import OutputWriter
+
+    main.PIPELINE_MODE, main.ASYNC_MODE = True, True
+    files = sorted(Path(os.environ["DREAMS_INPUT_PATH"]).glob("*.pdf"))
+    with OutputWriter():
+        main.run_files(files[:2], "async.csv", "async.txt")
+        main.run_files(files, "async.csv", "async.txt")
+
+def _scenario_all():
+    import main
+    from output_helper import OutputWriter
+
+    main.PIPELINE_MODE, main.ASYNC_MODE = True, True
+    with OutputWriter():
+        main.run_files(sorted(Path(os.environ["DREAMS_INPUT_PATH"]).glob("*.pdf")), "async.csv", "async.txt")
+
+def _scenario_study(workers: str):
+    import main
+    from manifest import by_participant, refresh_manifest
+    from my_type import DATA_PATH, PARTICIPANT_SUBDIR
+
+    main.PIPELINE_MODE, main.ASYNC_MODE = True, True
+    main.PARTICIPANT_WORKERS = int(workers)
+    groups = {
+        slug: [DATA_PATH / e.path for e in entries]
+        for slug, entries in by_participant(refresh_manifest(), PARTICIPANT_SUBDIR).items()
+    }
+    failed = main.run_study(groups)
+    assert not failed, failed
+
+if __name__ == "__main__":
+    import pdf_helper
+
+    # mọi file phải đi qua LLM (không dùng parser regex)
+    pdf_helper.USE_RULE_EXTRACTOR = False
+    {"resume": _scenario_resume, "all": _scenario_all, "study": _scenario_study}[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,44 @@
+"""
+pytest scripts/test_layout_filter.py — is_caps_run chỉ bỏ header in hoa, không bỏ từ viết tắt trong giấc mơ;
+filter_page giữ tiêu đề giấc mơ in đậm (ranh giới cho prompt_budget / rule_extractor).
+"""
+import fitz  # PyMuPDF
+import pytest
+
+from layout_filter import filter_page, is_caps_run
+
+@pytest.mark.parametrize("text", ["DREAM JOURNAL WEEK 3", "STUDENT NOTE:", "ĐÁNH GIÁ CHUNG"])
+def test_caps_headers_are_runs(text):
+    assert is_caps_run(text)
+
+@pytest.mark.parametrize("text", ["OK", "USA", "I", "I SAW", " NASA ", "3 A", "Dream Journal", "USA trip"])
+def test_short_caps_and_mixed_case_are_kept(text):
+    assert not is_caps_run(text)
+
+def _page(lines):
+    # (text, font) mỗi dòng; "hebo" = Helvetica-Bold
+    doc = fitz.open()
+    page = doc.new_page()
+    for k, (text, font) in enumerate(lines):
+        page.insert_text((72, 72 + 18 * k), text, fontname=font, fontsize=11)
+    return doc, page
+
+def test_bold_dream_headings_are_kept():
+    doc, page = _page([
+        ("Date of dream: 01/02/2024", "helv"),
+        ("First dream", "hebo"),
+        ("I was in a garden with my sister.", "helv"),
+        ("The first dream shows my fear of losing control.", "hebo"),
+        ("The second dream:", "hebo"),
+        ("I flew over the city.", "helv"),
+    ])
+    with doc:
+        text, stats = filter_page(page)
+    assert text.splitlines() == [
+        "Date of dream: 01/02/2024",
+        "First dream",
+        "I was in a garden with my sister.",
+        "The second dream:",
+        "I flew over the city.",
+    ]
+    assert stats.removed_bold == len("The first dream shows my fear of losing control.")
@@ -0,0 +1,46 @@
+"""pytest scripts/test_prompt_budget.py — drop_boilerplate / split_at_dreams không được đụng vào nội dung giấc mơ."""
+import pytest
+
+from prompt_budget import drop_boilerplate, split_at_dreams
+
+HEADER = "Date of dream: 05/03/2021\nState of mind: calm"
+
+@pytest.mark.parametrize("line", [
+    "Hi mom was standing at the door waiting for me.",
+    "Dear friend of mine handed me a letter in the dream",
+    "thanks, he said",
+    "Best wishes and a cake",
+])
+def test_dream_lines_starting_with_greeting_words_are_kept(line):
+    # đầu block, giữa giấc mơ và cuối block đều phải giữ nguyên
+    for block in (f"{HEADER}\n{line}\nI woke up.", f"{HEADER}\nFirst dream\nI walked.\n{line}\nI woke up.",
+                  f"{HEADER}\nFirst dream\nI walked home.\n{line}"):
+        text, removed = drop_boilerplate(block)
+        assert line in text.split("\n")
+        assert removed == 0
+
+def test_header_greeting_and_signoff_are_dropped():
+    block = (f"{HEADER}\nHello Dear Prof Anthony and Dr. Mayur\nFirst dream\nI was in a garden.\n"
+             "Thank you very much, Duyen\n(https://example.com)")
+    text, removed = drop_boilerplate(block)
+    assert text == f"{HEADER}\nFirst dream\nI was in a garden."
+    assert removed > 0
+
+def test_reviewer_message_is_dropped():
+    block = f"{HEADER}\nFirst dream\nI ran.\nReviewer's Message\nGood work\nSecond dream\nI flew."
+    text, _ = drop_boilerplate(block)
+    assert "Good work" not in text and "I flew." in text
+
+def test_split_ignores_mid_dream_start_lines():
+    # "I saw ..." / "Last night I ..." là câu trong giấc mơ, không phải ranh giới
+    dream = "\n".join(["I walked along a long corridor with many doors."] * 40)
+    block = f"{HEADER}\n{dream}\nI saw a door at the end of it\nLast night I was there too.\n{dream}"
+    assert split_at_dreams(block, budget_tokens=50) == [block]
+
+def test_split_at_dream_markers_keeps_header():
+    body = "I walked along a long corridor with many doors. " * 30
+    block = f"{HEADER}\nFirst dream\n{body}\nSecond dream\nI saw a door.\n{body}"
+    parts = split_at_dreams(block, budget_tokens=200)
+    assert len(parts) == 2
+    assert parts[1].startswith(HEADER) and "Second dream" in parts[1]
+    assert "I saw a door." in parts[1]
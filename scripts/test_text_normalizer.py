@@ -0,0 +1,58 @@
+"""pytest scripts/test_text_normalizer.py — text_normalizer phải cho output giống hệt chuỗi làm sạch cũ (bench_normalizer.legacy_*)."""
+import pytest
+
+import text_normalizer as tn
+from bench_normalizer import (legacy_clean_dream_text, legacy_extract_clean_block, legacy_remove_dash_bracket_blocks,
+                              legacy_strip_allcaps_runs)
+
+# khoảng trắng lạ như trong text PDF thô: nbsp, zero-width, CRLF / CR, tab, nhiều dòng trống liền nhau
+TRICKY = [
+    "",
+    " ",
+    "\n\n\n",
+    "I was\xa0in a house.",
+    "I was \xa0 in\xa0\xa0a house .",
+    "I\u200bwas in a\u200b house\u200b.\u200b",
+    "\u200b I was in a house \u200b",
+    "\ufeffI was in a house.\u2060",
+    "I was\r\nin a house.\r\n\r\nThen I woke up\r",
+    "I was\rin a house.\r\rEnd",
+    "I was\tin a\t\thouse \t .\t",
+    "\tI was in a house\t\n\t Then I ran .\t",
+    "I was in a house.\n\n\n\n\nThen I ran.\n\n\n",
+    "I was in a house.\n \n\xa0\n\t\nThen I ran.",
+    "I was in\u2003a house\u2003 \u2003 .",
+    "I was in\u3000a house\u2028then I ran\u2029.",
+    "I was in a house\x0bthen I ran\x0c.",
+    '  """ I was in a house.\r\n [- note\n here ] """ ',
+    '"I was in a house [-x]\u2026  !"',
+    '\xa0"I was in a house"\xa0',
+    "I SAW A BIG RED DOOR, then I ran .",
+    "I saw THE BIG\xa0RED DOOR\r\nTHEN I RAN : home",
+    "Date of dream: 01/02/2021\r\nI was in a house.\r\n(https://example.com/x\r\n1/2\r\nThen I ran.\r\nRevision: none",
+    "Dream date \xa0: 01/02/2021\n\n\n\tI was in a house.\u200b\n\nStudent mark 9",
+]
+
+@pytest.mark.parametrize("text", TRICKY)
+def test_clean_dream_text_matches_legacy(text):
+    assert tn.clean_dream_text(text) == legacy_clean_dream_text(text)
+
+@pytest.mark.parametrize("text", TRICKY)
+def test_remove_dash_bracket_blocks_matches_legacy(text):
+    assert tn.remove_dash_bracket_blocks(text) == legacy_remove_dash_bracket_blocks(text)
+
+@pytest.mark.parametrize("min_words", [0, 3, 5])
+@pytest.mark.parametrize("text", TRICKY)
+def test_strip_allcaps_runs_matches_legacy(text, min_words):
+    assert tn.strip_allcaps_runs(text, min_words) == legacy_strip_allcaps_runs(text, min_words)
+
+@pytest.mark.parametrize("text", TRICKY)
+def test_extract_clean_block_matches_legacy(text):
+    assert tn.extract_clean_block(text) == legacy_extract_clean_block(text)
+
+@pytest.mark.parametrize("text", TRICKY)
+def test_normalize_prompt_matches_legacy_chain(text):
+    # chuỗi đầy đủ như prompt_from_block: cắt block rồi làm sạch
+    block = legacy_extract_clean_block(text) or text
+    assert tn.normalize_prompt(tn.extract_clean_block(text) or text) == \
+        legacy_remove_dash_bracket_blocks(legacy_clean_dream_text(block))
@@ -0,0 +1,116 @@
+import re
+from typing import Optional
+
+# Tất cả regex của bước làm sạch được compile 1 lần khi import module.
+# Output phải giống hệt chuỗi hàm cũ trong pdf_helper (kiểm tra bằng bench_normalizer.py).
+
+RX_START = re.compile(r'(?im)^\s*(?:Date of dream|Dream date)\s*:?.*$')
+RX_STOP = re.compile(r'(?im)^\s*(?:Revision|student note|Student mark)\b.*$')
+RX_PAGE = re.compile(r'(?m)^\s*\d+\s*/\s*\d+\s*$')            # ví dụ "1/2" một mình trên dòng
+RX_PAREN_HTTP_LINE = re.compile(r'(?im)^\s*\(https?://')
+
+# clean_dream_text: 1 lượt thay cho (\r\n -> \n, nbsp -> space, [ \t]+ -> space, strip từng dòng,
+# \n -> space, " +" -> space). Cụm khoảng trắng có xuống dòng => 1 space; cụm space/tab/nbsp => 1 space.
+# Mọi nhánh bắt đầu bằng 1 ký tự \s (để re nhảy nhanh qua chữ); 1 dấu space đơn lẻ không match.
+RX_WS_FUSED = re.compile(
+    r'\s(?:'
+    r'(?<=[\r\n])\s*'                  # bắt đầu bằng xuống dòng: nuốt hết cụm khoảng trắng
+    r'|[^\S\r\n]*[\r\n]\s*'            # cụm khoảng trắng có xuống dòng ở giữa
+    r'|(?<=[ \t\u00a0])[ \t\u00a0]+'     # >= 2 space/tab/nbsp liền nhau
+    r'|(?<=[\t\u00a0])'                 # 1 tab / nbsp
+    r')'
+)
+RX_TRIPLE_QUOTED = re.compile(r'\s*"""\s*([\s\S]*?)\s*"""\s*')
+RX_QUOTED = re.compile(r'\s*"\s*([\s\S]*?)\s*"\s*')
+
+RX_DASH_BLOCK = re.compile(r"\[\s*-\s*.*?\]", flags=re.DOTALL)
+# tidy sau khi xoá: \s{2,} -> " " rồi bỏ khoảng trắng trước dấu câu
+# (sau bước đầu mọi cụm khoảng trắng chỉ còn 1 ký tự nên không cần \s+)
+RX_MULTI_WS = re.compile(r"\s{2,}")
+RX_WS_BEFORE_PUNCT = re.compile(r"\s(?=[,.!?;:…])")
+RX_WS_BEFORE_PUNCT_NO_ELLIPSIS = re.compile(r"\s(?=[,.!?;:])")
+
+RX_ALLCAPS_RUN = re.compile(
+    r"""
+    (                           # capture the whole run
+      \b[A-Z][A-Z'’\-]+         # 1st ALL-CAPS word (len >= 2)
+      (?:[ ,:;–-]+\b[A-Z][A-Z'’\-]+){2,}   # + at least 2 more ALL-CAPS words
+    )
+    """,
+    re.VERBOSE,
+)
+RX_ALLCAPS_WORD = re.compile(r"\b[A-Z][A-Z'’\-]+\b")
+
+def extract_clean_block(text: str, remove_noise=True) -> Optional[str]:
+    """
+    Trả về đoạn từ 'Date of dream|Dream date' đến trước 'Revision|student note|Student mark'.
+    Nếu remove_noise=True, sẽ cắt bỏ khúc nhiễu ( (https... ) -> ... -> dòng '1/2' ).
+    """
+    if not text:
+        return None
+
+    m_start = RX_START.search(text)
+    if not m_start:
+        return None
+    start_idx = m_start.start()
+
+    m_stop = RX_STOP.search(text, start_idx)
+    end_idx = m_stop.start() if m_stop else len(text)
+
+    block = text[start_idx:end_idx]
+
+    if remove_noise:
+        block = remove_noise_chunk(block)
+
+    return block
+
+def remove_noise_chunk(block: str) -> str:
+    """
+    Cắt bỏ đoạn từ dòng bắt đầu bằng '(https' (trong ngoặc) cho đến dòng chỉ chứa 'x/y'.
+    Nếu không có cặp đó, giữ nguyên.
+    """
+    m_open = RX_PAREN_HTTP_LINE.search(block)
+    if not m_open:
+        return block
+
+    m_page = RX_PAGE.search(block, m_open.end())
+    if not m_page:
+        return block
+
+    return block[:m_open.start()] + block[m_page.end():]
+
+def remove_dash_bracket_blocks(text: str) -> str:
+    # Xóa mọi khối dạng [- ... ] (kể cả xuống dòng bên trong), rồi dọn khoảng trắng thừa
+    out = RX_DASH_BLOCK.sub("", text) if "[" in text else text
+    return RX_WS_BEFORE_PUNCT.sub("", RX_MULTI_WS.sub(" ", out)).strip()
+
+def strip_allcaps_runs(text: str, min_words: int = 0) -> str:
+    def _repl(m):
+        run = m.group(0)
+        n_words = len(RX_ALLCAPS_WORD.findall(run))
+        return "" if n_words >= min_words else run
+
+    out = RX_ALLCAPS_RUN.sub(_repl, text)
+    return RX_WS_BEFORE_PUNCT_NO_ELLIPSIS.sub("", RX_MULTI_WS.sub(" ", out)).strip()
+
+def clean_dream_text(s: str) -> str:
+    if not s:
+        return ""
+    s = RX_WS_FUSED.sub(" ", s).strip()
+
+    # Strip enclosing triple quotes: """ ... """
+    if s.startswith('"'):
+        m = RX_TRIPLE_QUOTED.fullmatch(s)
+        if m:
+            s = m.group(1).strip()
+
+        # Strip enclosing single double-quotes: " ... "
+        m = RX_QUOTED.fullmatch(s)
+        if m:
+            s = m.group(1).strip()
+
+    return s
+
+def normalize_prompt(text: str) -> str:
+    """clean_dream_text + remove_dash_bracket_blocks (bước làm sạch prompt trong prompt_from_block)."""
+    return remove_dash_bracket_blocks(clean_dream_text(text))
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from my_type import OUTPUT_PATH
+
+TEXT_STORE_FILE = OUTPUT_PATH / "text_store.sqlite"
+
+class StoredText(NamedTuple):
+    pages: List[str]        # text thô từng trang (page.get_text())
+    block: Optional[str]    # kết quả extract_clean_block, None nếu không có block
+    block_valid: bool       # False nếu cleaner đã đổi version => tính lại block từ pages
+    sha256: str = ""        # sha256 byte của PDF lúc trích (dedup_index), "" với entry cũ
+
+class ExtractedTextStore:
+    """
+    Lưu text đã trích từ PDF để các lần chạy sau (model / prompt khác) không phải
+    mở lại PDF. Key = đường dẫn + size + mtime; nếu by_hash=True thì dùng sha256
+    nội dung file (chậm hơn nhưng đúng cả khi file bị copy / touch).
+    block chỉ được dùng lại khi cleaner_version trùng với lúc ghi.
+    variant phân biệt các cách trích khác nhau của cùng 1 file (vd. "layout1"
+    cho layout_filter), mỗi variant là 1 entry riêng.
+    """
+
+    def __init__(self, db_path: Path = TEXT_STORE_FILE, by_hash: bool = False):
+        self.db_path = Path(db_path)
+        self.by_hash = by_hash
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS pdf_text (
+                path TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                pages TEXT NOT NULL,
+                block TEXT,
+                cleaner_version TEXT NOT NULL,
+                sha256 TEXT
+            )"""
+        )
+        # store tạo trước khi có cột sha256
+        if "sha256" not in {row[1] for row in self._conn.execute("PRAGMA table_info(pdf_text)")}:
+            self._conn.execute("ALTER TABLE pdf_text ADD COLUMN sha256 TEXT")
+        self._conn.commit()
+
+    def fingerprint(self, file_path: Path) -> str:
+        if self.by_hash:
+            h = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            return f"sha256:{h.hexdigest()}"
+        st = file_path.stat()
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    @staticmethod
+    def _key(file_path: Path, variant: str) -> str:
+        return f"{file_path.as_posix()}#{variant}" if variant else file_path.as_posix()
+
+    def get(self, file_path: Path, cleaner_version: str, variant: str = "") -> Optional[StoredText]:
+        file_path = Path(file_path).resolve()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, pages, block, cleaner_version, sha256 FROM pdf_text WHERE path = ?",
+                (self._key(file_path, variant),),
+            ).fetchone()
+        if row is None or row[0] != self.fingerprint(file_path):
+            return None
+        valid = row[3] == cleaner_version
+        return StoredText(json.loads(row[1]), row[2] if valid else None, valid, row[4] or "")
+
+    def put(self, file_path: Path, pages: List[str], block: Optional[str], cleaner_version: str, variant: str = "",
+            sha256: str = ""):
+        file_path = Path(file_path).resolve()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pdf_text (path, fingerprint, pages, block, cleaner_version, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(file_path, variant), self.fingerprint(file_path), json.dumps(pages, ensure_ascii=False), block,
+                 cleaner_version, sha256 or None),
+            )
+            self._conn.commit()
+
+_text_store: Optional[ExtractedTextStore] = None
+_text_store_pid: Optional[int] = None
+_text_store_lock = threading.Lock()
+
+def get_text_store() -> ExtractedTextStore:
+    # Mỗi process (kể cả worker của extract_stage) mở connection SQLite riêng
+    global _text_store, _text_store_pid
+    with _text_store_lock:
+        if _text_store is None or _text_store_pid != os.getpid():
+            _text_store = ExtractedTextStore()
+            _text_store_pid = os.getpid()
+        return _text_store
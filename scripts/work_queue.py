@@ -0,0 +1,360 @@
+"""
+Hàng đợi job dùng chung (SQLite) để nhiều process / máy (chung filesystem với OUTPUT_PATH) chia nhau 1 lần chạy.
+Mỗi PDF là 1 job {run, seq, file, model, state, lease_owner, lease_until, attempts, result}:
+- worker claim job bằng lease (hết hạn => worker khác lấy lại), heartbeat gia hạn lease của job đang làm
+- kết quả của job ghi ra OUTPUT_PATH/queue/<run>/<seq>.<attempt>.<owner>.csv (riêng cho từng lần thử,
+  file tạm + os.replace), rồi mới đánh dấu done kèm con trỏ tới file đó; chỉ worker còn giữ lease mới
+  được đánh dấu done, worker đã mất lease xoá file của mình (không ghi đè kết quả của lần thử khác)
+- model (enqueue --model) được giữ theo job, worker chạy job đó với model này (providers.use_model);
+  không đặt thì dùng model mặc định của worker (DREAMS_MODEL / CHOOSEN_MODEL)
+- case_id = C(seq + 1), dream_id D0001, ... (id_allocator) theo thứ tự input, nên không phụ thuộc worker nào làm job nào
+- collect ghép các file kết quả theo seq thành <run>.csv khi mọi job đã xong
+
+    python work_queue.py enqueue [--all | --participant 4_trinh] [--model gemini-2.5-flash]   # thêm job (chạy lại không tạo trùng)
+    python work_queue.py work [--threads 8]                          # chạy trên bao nhiêu process / máy cũng được
+    python work_queue.py status
+    python work_queue.py collect                                    # ghi <run>.csv cho các run đã xong
+
+SQLite trên ổ mạng chỉ an toàn nếu filesystem hỗ trợ khoá file đúng cách (NFS thường không).
+"""
+import argparse
+import csv
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from id_allocator import IdAllocator
+from my_type import (DATA_PATH, INPUT_PATH, OUTPUT_PATH, PARTICIPANT_SUBDIR, QUEUE_FILE, QUEUE_LEASE_SECONDS,
+                     QUEUE_MAX_ATTEMPTS, Dream)
+
+RESULTS_DIR = OUTPUT_PATH / "queue"
+
+class Job(NamedTuple):
+    id: int
+    run: str     # tên CSV không có đuôi, vd. "4_trinh_dreams"
+    seq: int     # vị trí trong input của run (0, 1, 2, ...)
+    file: str    # journal_key của PDF
+    attempts: int
+    model: Optional[str] = None  # giá trị enum model, None = model mặc định của worker
+
+class WorkQueue:
+    def __init__(self, db_path: Path = OUTPUT_PATH / QUEUE_FILE, lease_seconds: float = QUEUE_LEASE_SECONDS,
+                 max_attempts: int = QUEUE_MAX_ATTEMPTS, owner: Optional[str] = None):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: tự quản lý transaction (BEGIN IMMEDIATE khi claim)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                run TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                file TEXT NOT NULL,
+                model TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result TEXT,
+                rows INTEGER,
+                updated_at REAL NOT NULL,
+                UNIQUE (run, file)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, run, seq)")
+        # queue tạo trước khi có cột model
+        if "model" not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN model TEXT")
+
+    def enqueue(self, run: str, files: List[str], model: Optional[str] = None) -> int:
+        """Thêm job theo thứ tự files; job đã có (cùng run + file) được giữ nguyên. Trả về số job mới."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                start = self._conn.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM jobs WHERE run = ?", (run,)).fetchone()[0]
+                known = {f for (f,) in self._conn.execute("SELECT file FROM jobs WHERE run = ?", (run,))}
+                new = [f for f in dict.fromkeys(files) if f not in known]
+                self._conn.executemany(
+                    "INSERT INTO jobs (run, seq, file, model, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(run, start + i, f, model, now) for i, f in enumerate(new)],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(new)
+
+    def claim(self) -> Optional[Job]:
+        """Lấy 1 job pending (hoặc lease đã hết hạn), ưu tiên seq nhỏ."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # worker chết khi đang giữ job ở lần thử cuối => failed thay vì kẹt ở leased
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'failed', error = COALESCE(error, 'lease expired'), lease_owner = NULL, "
+                    "updated_at = ? WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id, run, seq, file, attempts, model FROM jobs "
+                    "WHERE (state = 'pending' OR (state = 'leased' AND lease_until < ?)) AND attempts < ? "
+                    "ORDER BY run, seq LIMIT 1",
+                    (now, self.max_attempts),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'leased', lease_owner = ?, lease_until = ?, attempts = attempts + 1, "
+                        "updated_at = ? WHERE id = ?",
+                        (self.owner, now + self.lease_seconds, now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return Job(row[0], row[1], row[2], row[3], row[4] + 1, row[5]) if row else None
+
+    def heartbeat(self) -> int:
+        """Gia hạn lease mọi job process này đang giữ."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE state = 'leased' AND lease_owner = ?",
+                (now + self.lease_seconds, now, self.owner),
+            )
+        return cur.rowcount
+
+    def complete(self, job: Job, result: str, rows: int) -> bool:
+        """False nếu lease đã mất (worker khác đã lấy job), kết quả của lần này bị bỏ qua."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, rows = ?, error = NULL, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (result, rows, time.time(), job.id, self.owner),
+            )
+        return cur.rowcount == 1
+
+    def fail(self, job: Job, error: str):
+        # hết số lần thử => failed (status hiển thị lỗi), không thì trả về pending cho lần claim sau
+        state = "failed" if job.attempts >= self.max_attempts else "pending"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (state, error[:2000], time.time(), job.id, self.owner),
+            )
+
+    def release(self, job: Job):
+        # trả job về pending mà không tính lần thử (vd. hết quota ngày, không phải lỗi của job)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = 'pending', attempts = attempts - 1, lease_owner = NULL, updated_at = ? "
+                "WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (time.time(), job.id, self.owner),
+            )
+
+    def retry_failed(self, run: Optional[str] = None) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, error = NULL WHERE state = 'failed' AND (? IS NULL OR run = ?)",
+                (run, run),
+            )
+        return cur.rowcount
+
+    def status(self) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        with self._lock:
+            for run, state, n in self._conn.execute("SELECT run, state, COUNT(*) FROM jobs GROUP BY run, state ORDER BY run"):
+                out.setdefault(run, {})[state] = n
+        return out
+
+    def results(self, run: str) -> List[tuple]:
+        """(seq, state, result) theo seq."""
+        with self._lock:
+            return self._conn.execute("SELECT seq, state, result FROM jobs WHERE run = ? ORDER BY seq", (run,)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def resolve_file(key: str) -> Path:
+    # key = journal_key: tương đối so với DATA_PATH (hoặc INPUT_PATH), mỗi máy tự ghép với đường dẫn của mình
+    path = Path(key)
+    if path.is_absolute():
+        return path
+    return DATA_PATH / path if (DATA_PATH / path).exists() else INPUT_PATH / path
+
+def write_result(job: Job, dreams: List[Dream], owner: str) -> str:
+    """
+    Ghi dòng CSV của job (không header) ra file riêng của lần thử này, atomic; trả về đường dẫn
+    tương đối so với OUTPUT_PATH. Chỉ complete() mới lưu con trỏ tới file này.
+    """
+    from output_helper import CSV_FIELDNAMES
+
+    owner = re.sub(r"[^\w.-]+", "_", owner)
+    path = RESULTS_DIR / job.run / f"{job.seq:06d}.{job.attempts}.{owner}.csv"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES)
+        writer.writerows(d.model_dump() for d in dreams)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path.relative_to(OUTPUT_PATH).as_posix()
+
+def process_job(job: Job, output_filename: str) -> List[Dream]:
+    from pdf_helper import build_prompt_text, hybrid_filter_dream_text
+    from providers import parse_model, use_model
+
+    file = resolve_file(job.file)
+    # model của job chỉ áp dụng trong thread đang chạy job này
+    with use_model(parse_model(job.model)) if job.model else nullcontext():
+        prompt = build_prompt_text(file.parent, file.name, output_filename)
+        return IdAllocator().stamp(job.seq, hybrid_filter_dream_text(prompt, output_filename))
+
+def run_worker(queue: WorkQueue, threads: int = 4, idle_exit: bool = True):
+    """
+    threads job cùng lúc trong process này (chung rate scheduler); dừng khi hết job nếu idle_exit,
+    hoặc khi hết quota ngày (job đang làm được trả lại hàng đợi, không tính lần thử).
+    """
+    from output_helper import initOutput
+    from rate_scheduler import DailyQuotaExceeded
+    from run_metrics import get_metrics
+
+    stop = threading.Event()
+    quota_used_up = threading.Event()
+
+    def _beat():
+        while not stop.wait(queue.lease_seconds / 3):
+            queue.heartbeat()
+
+    # output log riêng cho từng worker, không ghi xen kẽ với process khác
+    output_filename = f"output_worker_{queue.owner.replace(':', '_')}.txt"
+    initOutput(output_filename)
+    done = [0]
+
+    def _loop():
+        while not quota_used_up.is_set():
+            job = queue.claim()
+            if job is None:
+                if idle_exit:
+                    return
+                time.sleep(5)
+                continue
+            try:
+                with get_metrics().file_scope(job.file):
+                    dreams = process_job(job, output_filename)
+                    result = write_result(job, dreams, queue.owner)
+            except DailyQuotaExceeded as e:
+                queue.release(job)
+                if not quota_used_up.is_set():
+                    quota_used_up.set()
+                    print(f"Worker {queue.owner}: {e}, stopping")
+                return
+            except Exception as e:
+                queue.fail(job, f"{type(e).__name__}: {e}")
+                print(f"[{job.run} #{job.seq}] failed (attempt {job.attempts}): {e!r}")
+                continue
+            if queue.complete(job, result, len(dreams)):
+                done[0] += 1
+                print(f"[{job.run} #{job.seq}] done: {len(dreams)} dreams")
+            else:
+                # lease đã sang worker khác: file của lần thử này không được trỏ tới, xoá đi
+                (OUTPUT_PATH / result).unlink(missing_ok=True)
+                print(f"[{job.run} #{job.seq}] lease lost, result discarded")
+
+    beat = threading.Thread(target=_beat, name="queue-heartbeat", daemon=True)
+    beat.start()
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            for fut in [pool.submit(_loop) for _ in range(threads)]:
+                fut.result()
+    finally:
+        stop.set()
+    print(f"Worker {queue.owner}: {done[0]} jobs done")
+    get_metrics().write_report(f"worker_{queue.owner.replace(':', '_')}")
+
+def collect(queue: WorkQueue, run: str, partial: bool = False) -> Optional[Path]:
+    """Ghép kết quả theo seq thành OUTPUT_PATH/<run>.csv (atomic). Chưa xong hết thì bỏ qua, trừ khi partial."""
+    from output_helper import CSV_FIELDNAMES
+
+    jobs = queue.results(run)
+    pending = [seq for seq, state, _ in jobs if state != "done"]
+    if pending and not partial:
+        print(f"{run}: {len(pending)}/{len(jobs)} jobs not done, skip collect")
+        return None
+
+    out = OUTPUT_PATH / f"{run}.csv"
+    tmp = out.with_name(out.name + ".tmp")
+    with tmp.open("w", encoding="utf-8", newline="") as f:
+        csv.DictWriter(f, fieldnames=CSV_FIELDNAMES).writeheader()
+        for _, state, result in jobs:
+            if state == "done" and result:
+                with (OUTPUT_PATH / result).open("r", encoding="utf-8", newline="") as part:
+                    f.write(part.read())
+    os.replace(tmp, out)
+    print(f"{run}: {len(jobs) - len(pending)} files -> {out.as_posix()}")
+    return out
+
+def _enqueue_args(queue: WorkQueue, args):
+    from journal_helper import journal_key
+    from manifest import by_participant, participant_for, refresh_manifest
+
+    if args.all or args.participant:
+        for slug, entries in by_participant(refresh_manifest(), PARTICIPANT_SUBDIR).items():
+            if not args.participant or slug in args.participant:
+                added = queue.enqueue(f"{slug}_dreams", [e.path for e in entries], args.model)
+                print(f"{slug}_dreams: +{added} jobs")
+    else:
+        run = f"{participant_for(INPUT_PATH)}_dreams"
+        # chỉ PDF, như main.py: file khác không được chiếm seq / case_id
+        files = sorted(f for f in INPUT_PATH.rglob("*") if f.is_file() and f.suffix.lower() == ".pdf")
+        print(f"{run}: +{queue.enqueue(run, [journal_key(f) for f in files], args.model)} jobs")
+
+if __name__ == "__main__":
+    from providers import all_models
+
+    ap = argparse.ArgumentParser(description="Shared SQLite work queue for multi-process / multi-host runs")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("enqueue")
+    p.add_argument("--all", action="store_true")
+    p.add_argument("--participant", action="append", default=None)
+    p.add_argument("--model", choices=[m.value for m in all_models()], default=None,
+                   help="model cho các job mới (mặc định: model của worker)")
+    p = sub.add_parser("work")
+    p.add_argument("--threads", type=int, default=4)
+    p.add_argument("--wait", action="store_true", help="không thoát khi hết job, chờ job mới")
+    sub.add_parser("status")
+    p = sub.add_parser("collect")
+    p.add_argument("--partial", action="store_true", help="ghi cả khi còn job chưa xong")
+    p = sub.add_parser("retry-failed")
+    args = ap.parse_args()
+
+    queue = WorkQueue()
+    if args.cmd == "enqueue":
+        _enqueue_args(queue, args)
+    elif args.cmd == "work":
+        run_worker(queue, args.threads, idle_exit=not args.wait)
+    elif args.cmd == "status":
+        for run, states in queue.status().items():
+            print(f"{run}: " + ", ".join(f"{k}={v}" for k, v in sorted(states.items())))
+    elif args.cmd == "collect":
+        for run in queue.status():
+            collect(queue, run, args.partial)
+    elif args.cmd == "retry-failed":
+        print(f"{queue.retry_failed()} jobs back to pending")